@@ -1,15 +1,46 @@
-from flask import Flask, jsonify, request
+import click
+from flask import Flask, abort, jsonify, request
 import mysql.connector
 from mysql.connector import Error
 import re
 from dotenv import load_dotenv
 import os
-import sendgrid
-from sendgrid.helpers.mail import Mail
+import sys
+import base64
+import binascii
+import hashlib
+import json
+import logging
 import secrets
+import time
 from datetime import datetime, timedelta
 from flask_cors import CORS
 
+# Vercel loads this file directly, so make sibling modules importable
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import db
+from db import ConnectionPool, ReplicaSet, get_db, get_read_db, parse_hosts, release_db
+from caches import DailyCounterCache, TTLCache, utc_timestamp
+from subscriptions import SUBSCRIPTION_DAYS, expire_subscriptions
+from otp_store import create_otp_store
+from mailer import EmailDispatcher, EmailOutbox, create_transport
+from email_templates import render_email
+from search import create_template_search, highlight, index_terms, search_terms
+from content_store import ContentCodec, backfill, store_dictionary, train_dictionary
+from revisions import materialize, record_revision
+from passwords import PasswordHasher, PasswordHasherBusy
+import ratelimit
+from ratelimit import RateLimiter, create_rate_limit_store, parse_limits
+import tokens
+from tokens import RevocationList, TokenError, TokenIssuer, current_caller
+import migrations
+import metrics
+import compression
+from compression import fetch_in_batches, stream_json
+from logs import parse_levels, parse_rates, setup_logging
+from metrics import Metrics, TimedTransport, instrumented_connect
+
 app = Flask(__name__)
 # Enable CORS for all routes
 
@@ -31,232 +62,190 @@ CORS(app, resources={
 load_dotenv()
 SENDGRID_API_KEY = os.getenv('SENDGRID_API_KEY')
 SENDGRID_FROM_EMAIL = os.getenv('SENDGRID_FROM_EMAIL')
+# Shared secret for scheduled jobs (Vercel Cron sends it as a bearer token)
+CRON_SECRET = os.getenv('CRON_SECRET')
+# Bearer token for the /api/_stats and /api/_metrics diagnostics; both are off without it
+METRICS_SECRET = os.getenv('METRICS_SECRET')
 
 # MySQL database configuration
 DB_CONFIG = {
-    'host': 'trolley.proxy.rlwy.net',
-    'port': 28889,
-    'user': 'root',
-    'password': 'cLvJtIXnDdDjwGOSvBnFbxrDfBzsLOjh',
-    'database': 'railway'
+    'host': os.getenv('DB_HOST', 'trolley.proxy.rlwy.net'),
+    'port': int(os.getenv('DB_PORT', 28889)),
+    'user': os.getenv('DB_USER', 'root'),
+    'password': os.getenv('DB_PASSWORD', 'cLvJtIXnDdDjwGOSvBnFbxrDfBzsLOjh'),
+    'database': os.getenv('DB_NAME', 'railway')
 }
 
-# In-memory OTP store for demo (use persistent store in production)
-otp_store = {}
-OTP_EXPIRY_MINUTES = 10
+# JSON logs through a background queue, see logs.py for the LOG_* settings
+logger = logging.getLogger(__name__)
+log_handler = setup_logging(
+    app,
+    level=os.getenv('LOG_LEVEL', 'INFO'),
+    route_levels=parse_levels(os.getenv('LOG_ROUTE_LEVELS')),
+    sample_rates=parse_rates(os.getenv('LOG_SAMPLE')),
+    queue_size=int(os.getenv('LOG_QUEUE_SIZE', 10000))
+)
+
+# Request latency, MySQL and email timings, served by /api/_metrics.
+# Registered first so the hooks below are included in request timings.
+request_metrics = Metrics()
+metrics.init_app(app, request_metrics, server_timing=os.getenv('SERVER_TIMING') == '1')
+
+# Shared connection pool; every route borrows one connection per request via get_db()
+db_pool = ConnectionPool(
+    DB_CONFIG,
+    size=int(os.getenv('DB_POOL_SIZE', 5)),
+    timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+    max_idle=int(os.getenv('DB_POOL_MAX_IDLE', 300)),
+    connect=instrumented_connect(mysql.connector.connect, request_metrics)
+)
+# Read replicas: DB_REPLICAS=host[:port],... with the primary's user, password
+# and database. Read-only routes use get_read_db(); see db.py for routing.
+DB_REPLICAS = parse_hosts(os.getenv('DB_REPLICAS'), default_port=DB_CONFIG['port'])
+db_replicas = ReplicaSet(
+    [
+        ConnectionPool(
+            {**DB_CONFIG, 'host': host, 'port': port,
+             'connection_timeout': int(os.getenv('DB_REPLICA_CONNECT_TIMEOUT', 2))},
+            size=int(os.getenv('DB_POOL_SIZE', 5)),
+            timeout=float(os.getenv('DB_REPLICA_POOL_TIMEOUT', 0.5)),
+            max_idle=int(os.getenv('DB_POOL_MAX_IDLE', 300)),
+            connect=instrumented_connect(mysql.connector.connect, request_metrics)
+        )
+        for host, port in DB_REPLICAS
+    ],
+    selection=os.getenv('DB_REPLICA_SELECTION', 'round_robin'),
+    pin_seconds=int(os.getenv('DB_READ_PIN_SECONDS', 5))
+) if DB_REPLICAS else None
 
-def init_db():
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                username VARCHAR(255) NOT NULL,
-                email VARCHAR(255) NOT NULL UNIQUE,
-                password VARCHAR(255) NOT NULL,
-                verified BOOLEAN DEFAULT FALSE,
-                plan VARCHAR(32) DEFAULT 'free',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS templates (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                title VARCHAR(255) NOT NULL,
-                content TEXT NOT NULL,
-                is_trashed BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS document_generation_logs (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                document_type VARCHAR(255),
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS consultations (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT,
-                user_name VARCHAR(255),
-                user_email VARCHAR(255),
-                attorney_id VARCHAR(32),
-                attorney_name VARCHAR(255),
-                full_name VARCHAR(255),
-                email VARCHAR(255),
-                phone VARCHAR(20),
-                preferred_date DATE,
-                preferred_time TIME,
-                reason_for_consult TEXT,
-                case_type VARCHAR(255),
-                status VARCHAR(255),
-                metadata TEXT
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS contact_forms (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT,
-                name VARCHAR(255) NOT NULL,
-                email VARCHAR(255) NOT NULL,
-                subject VARCHAR(255),
-                message TEXT NOT NULL,
-                submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS payments (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id INT NOT NULL,
-            plan ENUM('free', 'pro', 'attorney') NOT NULL,
-            payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            amount DECIMAL(10, 2) NOT NULL,
-            status ENUM('success', 'failed') NOT NULL,
-            transaction_id VARCHAR(100) UNIQUE NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users(id)
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS plan_changes (
-                id INT AUTO_INCREMENT PRIMARY KEY,
-                user_id INT NOT NULL,
-                old_plan VARCHAR(32) NOT NULL,
-                new_plan VARCHAR(32) NOT NULL,
-                payment_id INT,
-                change_reason ENUM('payment', 'system', 'expiration', 'user_request') NOT NULL,
-                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                FOREIGN KEY (payment_id) REFERENCES payments(id) ON DELETE SET NULL
-            )
-        ''')
-        cursor.close()
-        conn.close()
-    except Error as e:
-        print('DB init error:', e)
 
-init_db()
+def read_pin_keys():
+    """
+    Who a request is from, for keeping reads on the primary after a write:
+    the user, and the client address for writes that name no user (template
+    PUT, trash and restore called without a token).
+    """
+    user_id = ratelimit.request_user_id()
+    address = ratelimit.client_ip(rate_limiter.proxies)
+    return (f'user:{user_id}' if user_id else None, f'ip:{address}' if address else None)
+
+
+# After a write, the caller's reads stay on the primary
+db.init_app(app, db_pool, replicas=db_replicas, pin_keys=read_pin_keys)
+# Schema changes live in migrations.py; importing the app runs no DDL
+migrations.init_app(app, db_pool, mode=os.getenv('SCHEMA_CHECK', 'warn'))
+
+# gzip/brotli for JSON responses of COMPRESS_MIN_SIZE bytes or more
+compression.init_app(
+    app,
+    min_size=int(os.getenv('COMPRESS_MIN_SIZE', 1024)),
+    level=int(os.getenv('COMPRESS_LEVEL', 6))
+)
+
+# Outgoing email is queued and sent by background workers (EMAIL_DISPATCH=sync sends inline)
+mailer = EmailDispatcher(
+    TimedTransport(
+        create_transport(os.getenv('EMAIL_TRANSPORT', 'sendgrid'), SENDGRID_API_KEY, SENDGRID_FROM_EMAIL),
+        request_metrics
+    ),
+    outbox=EmailOutbox(db_pool, connect=get_db),
+    workers=int(os.getenv('EMAIL_WORKERS', 2)),
+    asynchronous=os.getenv('EMAIL_DISPATCH', 'async') != 'sync'
+)
+
+# OTP_STORE=mysql shares OTPs across serverless instances; memory is per process
+otp_store = create_otp_store(os.getenv('OTP_STORE', 'mysql'), connect=get_db)
+OTP_EXPIRY_MINUTES = 10
+# Past versions kept per template, see revisions.py
+TEMPLATE_REVISIONS = int(os.getenv('TEMPLATE_REVISIONS', 50))
+# templates.content is stored compressed, see content_store.py
+content_codec = ContentCodec(get_db, level=int(os.getenv('CONTENT_COMPRESSION_LEVEL', 6)))
+# TEMPLATE_SEARCH=mysql uses the FULLTEXT index; memory indexes in process for local databases
+template_search = create_template_search(os.getenv('TEMPLATE_SEARCH', 'mysql'), connect=get_read_db, codec=content_codec)
+FREE_DAILY_LIMIT = 3
+
+# Today's document generation count per user, read by check-daily-limit
+daily_generations = DailyCounterCache(ttl=int(os.getenv('DAILY_LIMIT_CACHE_TTL', 60)))
+# (is_paid, plan_type, expiry_date) per user, see check_subscription_status
+subscription_cache = TTLCache(ttl=int(os.getenv('SUBSCRIPTION_CACHE_TTL', 60)))
+
+# Signed access/refresh tokens, see tokens.py. TOKEN_SECRET is a comma-separated
+# list of keys: the first signs, all of them verify. Every instance must share
+# them, so without TOKEN_SECRET no tokens are issued or accepted.
+TOKEN_KEYS = [key.strip() for key in os.getenv('TOKEN_SECRET', '').split(',') if key.strip()]
+# TOKENS_REQUIRED=1 stops accepting user_id without an access token
+TOKENS_REQUIRED = os.getenv('TOKENS_REQUIRED') == '1'
+if TOKEN_KEYS:
+    token_issuer = TokenIssuer(
+        TOKEN_KEYS,
+        access_ttl=int(os.getenv('ACCESS_TOKEN_TTL', 900)),
+        refresh_ttl=int(os.getenv('REFRESH_TOKEN_TTL', 30 * 24 * 3600))
+    )
+elif TOKENS_REQUIRED:
+    raise RuntimeError('TOKENS_REQUIRED=1 needs TOKEN_SECRET')
+else:
+    logger.warning('TOKEN_SECRET is not set; access tokens are disabled')
+    token_issuer = None
+token_revocations = RevocationList(get_db, refresh_interval=int(os.getenv('TOKEN_REVOCATION_REFRESH', 30)))
+if token_issuer is not None:
+    # The cron, stats and metrics endpoints' Authorization header carries a shared
+    # secret, not a token; login and refresh must work whatever stale token a
+    # client sends
+    tokens.init_app(
+        app, token_issuer, token_revocations,
+        exempt=(
+            'cron_drain_email_outbox', 'cron_expire_subscriptions', 'get_metrics', 'get_runtime_stats',
+            'login', 'refresh_token'
+        )
+    )
+# Requests per client IP / email address / user on endpoints that send email
+# or check credentials, as (limit, window seconds). Checked after the token
+# hook (so user_id limits see the token's user) and before any route query.
+# RATE_LIMITS=login.ip=60/60,send_otp.email=off,... overrides them.
+RATE_LIMITS = {
+    'login': {'ip': (30, 60), 'email': (10, 300)},
+    'register': {'ip': (10, 60)},
+    'send_otp': {'ip': (10, 60), 'email': (3, 300)},
+    'verify_otp': {'ip': (20, 60), 'email': (10, 600)},
+    'forgot_password': {'ip': (10, 60), 'email': (3, 300)},
+    'reset_password': {'ip': (10, 60), 'email': (10, 600)},
+    'submit_contact_form': {'ip': (5, 60)},
+}
+# RATE_LIMIT_STORE=mysql shares counts across serverless instances; memory is per process
+rate_limiter = RateLimiter(
+    create_rate_limit_store(os.getenv('RATE_LIMIT_STORE', 'memory'), connect=get_db),
+    RATE_LIMITS,
+    overrides=parse_limits(os.getenv('RATE_LIMITS')),
+    proxies=int(os.getenv('RATE_LIMIT_PROXIES', 1))
+)
+ratelimit.init_app(app, rate_limiter)
+# users.password holds scrypt hashes, see passwords.py. PASSWORD_HASH_COST is
+# log2 of the scrypt N; PASSWORD_WORKERS hashes run at once per instance.
+password_hasher = PasswordHasher(
+    log_n=int(os.getenv('PASSWORD_HASH_COST', 14)),
+    workers=int(os.getenv('PASSWORD_WORKERS', 2)),
+    max_pending=int(os.getenv('PASSWORD_MAX_PENDING', 32))
+)
 
 def generate_otp():
     return str(secrets.randbelow(1000000)).zfill(6)
 
 def send_otp_email(email, otp, purpose):
-    subject = 'LegallyUp - ' + ('Registration OTP' if purpose == 'register' else 'Password Reset OTP')
-    
-    # Common CSS styles
-    styles = """
-        .container { 
-            font-family: Arial, sans-serif;
-            max-width: 600px;
-            margin: 0 auto;
-            padding: 20px;
-            background-color: #f9f9f9;
-            border-radius: 10px;
-        }
-        .header {
-            text-align: center;
-            padding: 20px 0;
-            border-bottom: 2px solid #eee;
-        }
-        .content {
-            padding: 30px 0;
-            text-align: center;
-        }
-        .otp-code {
-            font-size: 32px;
-            font-weight: bold;
-            color: #2563eb;
-            letter-spacing: 5px;
-            padding: 20px;
-            background-color: #ffffff;
-            border-radius: 5px;
-            margin: 20px 0;
-            display: inline-block;
-        }
-        .footer {
-            text-align: center;
-            color: #666;
-            font-size: 14px;
-            padding-top: 20px;
-            border-top: 1px solid #eee;
-        }
-    """
-
-    if purpose == 'register':
-        html_content = f"""
-            <html>
-            <head>
-                <style>{styles}</style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="header">
-                        <h1>Welcome to LegallyUp!</h1>
-                    </div>
-                    <div class="content">
-                        <p>Thank you for registering with LegallyUp. To complete your registration, please use the following OTP code:</p>
-                        <div class="otp-code">{otp}</div>
-                        <p>This code will expire in {OTP_EXPIRY_MINUTES} minutes.</p>
-                    </div>
-                    <div class="footer">
-                        <p>If you didn't request this registration, please ignore this email.</p>
-                        <p>© {datetime.now().year} LegallyUp. All rights reserved.</p>
-                    </div>
-                </div>
-            </body>
-            </html>
-        """
-    else:
-        html_content = f"""
-            <html>
-            <head>
-                <style>{styles}</style>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="header">
-                        <h1>Password Reset Request</h1>
-                    </div>
-                    <div class="content">
-                        <p>You have requested to reset your password for your LegallyUp account. Please use the following OTP code to proceed:</p>
-                        <div class="otp-code">{otp}</div>
-                        <p>This code will expire in {OTP_EXPIRY_MINUTES} minutes.</p>
-                    </div>
-                    <div class="footer">
-                        <p>If you didn't request this password reset, please ignore this email.</p>
-                        <p>© {datetime.now().year} LegallyUp. All rights reserved.</p>
-                    </div>
-                </div>
-            </body>
-            </html>
-        """
-
-    sg = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
-    message = Mail(
-        from_email=SENDGRID_FROM_EMAIL,
-        to_emails=email,
-        subject=subject,
-        html_content=html_content
-    )
-    sg.send(message)
+    template = 'register_otp' if purpose == 'register' else 'forgot_otp'
+    message = render_email(template, otp=otp, expiry_minutes=OTP_EXPIRY_MINUTES)
+    mailer.send(dict(message, to=email))
 
 @app.route('/api/register', methods=['POST'])
 def register():
     data = request.get_json()
-    print('Received registration data:', data)
+    logger.debug('Received registration data', extra={'payload': data})
     username = data.get('username')
     email = data.get('email')
     password = data.get('password')
     otp = data.get('otp')
 
     if not username or not email or not password or not otp:
-        print('Missing required fields')
+        logger.info('Missing required fields')
         return jsonify({'error': 'Missing required fields'}), 400
 
     # Check OTP validity
@@ -265,151 +254,427 @@ def register():
         return jsonify({'error': 'Invalid or expired OTP'}), 400
 
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
         # Check if user already exists
         cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
         if cursor.fetchone():
             cursor.close()
-            conn.close()
             return jsonify({'error': 'Email already registered'}), 400
+        cursor.close()
+        # Hash without holding a pooled connection
+        release_db()
+        password_hash = password_hasher.hash(password)
+        conn = get_db()
+        cursor = conn.cursor(dictionary=True)
         sql = "INSERT INTO users (username, email, password, verified) VALUES (%s, %s, %s, TRUE)"
-        cursor.execute(sql, (username, email, password))
+        cursor.execute(sql, (username, email, password_hash))
         conn.commit()
         # Fetch the new user with plan
         cursor.execute("SELECT id, username, email, plan FROM users WHERE email = %s", (email,))
         user = cursor.fetchone()
         cursor.close()
-        conn.close()
-        del otp_store[email]
-        print('User registered and verified successfully')
+        otp_store.delete(email)
+        logger.info('User registered and verified successfully')
         return jsonify({'message': 'User registered and verified successfully', 'user': user}), 201
+    except PasswordHasherBusy:
+        return busy_response()
     except Error as e:
-        print('Registration error:', e)
+        logger.exception('Registration error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/login', methods=['POST'])
 def login():
     data = request.get_json()
-    print('Received login data:', data)
+    logger.debug('Received login data', extra={'payload': data})
     email = data.get('email')
     password = data.get('password')
 
     if not email or not password:
-        print('Missing required fields')
+        logger.info('Missing required fields')
         return jsonify({'error': 'Missing required fields'}), 400
 
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
-        sql = "SELECT id, username, email, plan FROM users WHERE email = %s AND password = %s"
-        cursor.execute(sql, (email, password))
+        sql = "SELECT id, username, email, plan, password FROM users WHERE email = %s"
+        cursor.execute(sql, (email,))
         user = cursor.fetchone()
         cursor.close()
-        conn.close()
-        if user:
-            print('Login successful for:', user)
-            return jsonify({'message': 'Login successful', 'user': user}), 200
+        stored = user.pop('password') if user else None
+        # The connection goes back to the pool while the hash is computed
+        release_db()
+        if password_hasher.verify(password, stored):
+            if password_hasher.needs_rehash(stored):
+                rehash_password(user['id'], stored, password)
+            logger.info('Login successful', extra={'user_id': user['id']})
+            issued = token_issuer.issue(user['id'], check_subscription_status(user['id'])) if token_issuer else {}
+            return jsonify({'message': 'Login successful', 'user': user, **issued}), 200
         else:
-            print('Invalid email or password')
+            logger.info('Invalid email or password')
             return jsonify({'error': 'Invalid email or password'}), 401
+    except PasswordHasherBusy:
+        return busy_response()
     except Error as e:
-        print('Login error:', e)
+        logger.exception('Login error')
         return jsonify({'error': str(e)}), 500
 
+def rehash_password(user_id, stored, password):
+    """
+    Replace a plaintext password or an outdated hash after a successful
+    login. Skipped if the password changed meanwhile; a failure only logs,
+    since the login itself succeeded.
+    """
+    try:
+        password_hash = password_hasher.hash(password)
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE users SET password = %s WHERE id = %s AND password = %s", (password_hash, user_id, stored)
+        )
+        conn.commit()
+        cursor.close()
+        logger.info('Password rehashed', extra={'user_id': user_id})
+    except PasswordHasherBusy:
+        pass  # Next login tries again
+    except Error:
+        logger.exception('Password rehash error')
+
+def busy_response():
+    response = jsonify({'error': 'Server busy, please retry'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+@app.route('/api/auth/refresh', methods=['POST'])
+def refresh_token():
+    """Trade a refresh token for a new token pair; the old pair is revoked."""
+    if token_issuer is None:
+        return jsonify({'error': 'Access tokens are not enabled'}), 404
+    data = request.get_json(silent=True) or {}
+    try:
+        claims = token_issuer.verify(data.get('refresh_token') or '', kind='refresh')
+        if token_revocations.is_revoked(claims):
+            raise TokenError('Token revoked')
+    except TokenError as e:
+        return jsonify({'error': str(e)}), 401
+
+    try:
+        # Plan claims are re-read here, so a refresh also picks up plan changes
+        subscription = check_subscription_status(claims['sub'])
+        if subscription[1] is None:
+            return jsonify({'error': 'User not found'}), 401
+        # Rotation: a refresh token works once
+        token_revocations.revoke_session(claims['sid'], claims['exp'])
+        return jsonify(token_issuer.issue(claims['sub'], subscription)), 200
+    except Error as e:
+        logger.exception('Token refresh error')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/auth/logout', methods=['POST'])
+def logout():
+    caller = current_caller()
+    if caller is None:
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        # Covers the session's refresh token, which outlives the access token
+        token_revocations.revoke_session(caller.session_id, int(time.time()) + token_issuer.refresh_ttl)
+        return jsonify({'message': 'Logged out'}), 200
+    except Error as e:
+        logger.exception('Logout error')
+        return jsonify({'error': str(e)}), 500
+
+def caller_user_id(supplied):
+    """
+    The user a request acts for.
+
+    With an access token that is the token's user, and a user_id naming
+    someone else is refused with 403. Without one the supplied user_id is
+    trusted as before, unless TOKENS_REQUIRED is set.
+    """
+    caller = current_caller()
+    if caller is None:
+        if TOKENS_REQUIRED:
+            abort(error_response('Unauthorized', 401))
+        return supplied
+    if supplied and not caller.is_user(supplied):
+        abort(error_response('user_id does not match the access token', 403))
+    return caller.user_id
+
+def error_response(message, status):
+    response = jsonify({'error': message})
+    response.status_code = status
+    return response
+
+def subscription_status(user_id):
+    """
+    check_subscription_status, answered from the access token's claims when
+    the caller has one, so no query is made. Claims can be up to
+    ACCESS_TOKEN_TTL old; routes that change the plan return a fresh token.
+    """
+    caller = current_caller()
+    if caller is not None and caller.is_user(user_id):
+        return caller.subscription()
+    return check_subscription_status(user_id)
+
+def with_access_token(user_id, body):
+    """
+    Add an access token carrying the user's new plan to a plan change
+    response, so the caller's claims are current without a refresh.
+    """
+    caller = current_caller()
+    if caller is not None:
+        body['access_token'] = token_issuer.access_token(
+            caller.user_id, check_subscription_status(user_id), caller.session_id
+        )
+    return body
+
+# Conditional GET: user-specific responses are cached by the browser but
+# revalidated every time; a matching If-None-Match gets an empty 304.
+# Matching is weak because compression.py weakens the ETags it compresses.
+PRIVATE_REVALIDATE = 'private, no-cache'
+
+def make_etag(*parts):
+    return hashlib.sha1('|'.join(map(str, parts)).encode()).hexdigest()[:24]
+
+def not_modified(etag, cache_control=PRIVATE_REVALIDATE):
+    """Return a 304 response if the client already has this version, else None."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    response = app.response_class(status=304)
+    return with_etag(response, etag, cache_control)
+
+def with_etag(response, etag, cache_control=PRIVATE_REVALIDATE):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def template_etag(template_id, updated_at):
+    return make_etag('template', template_id, updated_at.isoformat())
+
 # Template management endpoints
 @app.route('/api/templates', methods=['POST'])
 def create_template():
     data = request.get_json()
-    user_id = data.get('user_id')
+    user_id = caller_user_id(data.get('user_id'))
     title = data.get('title')
     content = data.get('content')
     
     if not user_id or not title or not content:
         return jsonify({'error': 'Missing required fields'}), 400
 
-    # Check if user can generate document
-    can_generate, error_message = check_and_log_document_generation(user_id)
-    if not can_generate:
-        return jsonify({'error': error_message}), 403
-
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
+        # Quota check, generation log and template insert commit together.
+        # READ COMMITTED lets the count see generations committed by requests
+        # that held the user's lock before us.
+        conn.start_transaction(isolation_level='READ COMMITTED')
+
+        # Check if user can generate document
+        can_generate, error_message = check_and_log_document_generation(user_id)
+        if not can_generate:
+            conn.rollback()
+            return jsonify({'error': error_message}), 403
+
         cursor = conn.cursor()
-        sql = "INSERT INTO templates (user_id, title, content) VALUES (%s, %s, %s)"
-        cursor.execute(sql, (user_id, title, content))
+        sql = """
+            INSERT INTO templates (user_id, title, content, content_z, search_terms)
+            VALUES (%s, %s, '', %s, %s)
+        """
+        cursor.execute(sql, (user_id, title, content_codec.encode(content), index_terms(content)))
         conn.commit()
         cursor.close()
-        conn.close()
+        # Only count the generation once it is committed
+        daily_generations.incr(user_id)
         return jsonify({'message': 'Template created successfully'}), 201
     except Error as e:
-        print('Create template error:', e)
+        logger.exception('Create template error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/templates', methods=['GET'])
 def get_templates():
-    user_id = request.args.get('user_id')
-    if not user_id:
-        return jsonify({'error': 'Missing user_id'}), 400
-    try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
-        sql = "SELECT * FROM templates WHERE user_id = %s AND is_trashed = FALSE ORDER BY created_at DESC"
-        cursor.execute(sql, (user_id,))
-        templates = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return jsonify({'templates': templates}), 200
-    except Error as e:
-        print('Get templates error:', e)
-        return jsonify({'error': str(e)}), 500
+    return list_templates(trashed=False, error_label='Get templates error')
 
 @app.route('/api/templates/trash', methods=['GET'])
 def get_trashed_templates():
-    user_id = request.args.get('user_id')
+    return list_templates(trashed=True, error_label='Get trashed templates error')
+
+TEMPLATE_FIELDS = ('id', 'user_id', 'title', 'content', 'is_trashed', 'created_at', 'updated_at')
+TEMPLATE_SUMMARY_FIELDS = ('id', 'user_id', 'title', 'is_trashed', 'created_at', 'updated_at')
+MAX_TEMPLATE_PAGE_SIZE = 100
+MAX_EXCERPT_LENGTH = 1000
+# Rows read per cursor round trip when streaming a list response
+STREAM_BATCH_SIZE = 200
+
+def list_templates(trashed, error_label):
+    """
+    List a user's templates, newest first.
+
+    Without paging parameters every template is returned with all columns,
+    streamed to the client as rows are read. Passing limit and/or cursor
+    switches to keyset pagination on (created_at, id): each page is one
+    index range scan and the response carries next_cursor for the following
+    page. Paged responses default to
+    the summary fields (no content); fields=a,b,c picks columns explicitly
+    and excerpt=N adds the first N characters of content.
+    """
+    user_id = caller_user_id(request.args.get('user_id'))
     if not user_id:
         return jsonify({'error': 'Missing user_id'}), 400
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        listing = template_list_query(request.args, user_id, trashed)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def present(row):
+        return present_template(row, listing)
+
+    try:
+        conn = get_read_db()
         cursor = conn.cursor(dictionary=True)
-        sql = "SELECT * FROM templates WHERE user_id = %s AND is_trashed = TRUE ORDER BY created_at DESC"
-        cursor.execute(sql, (user_id,))
-        templates = cursor.fetchall()
+        cursor.execute(TEMPLATE_LIST_VERSION_SQL, (user_id, trashed))
+        etag = template_list_etag(user_id, trashed, cursor.fetchone(), request.query_string.decode())
+        cached = not_modified(etag)
+        if cached:
+            cursor.close()
+            return cached
+        sql = listing['sql']
+        cursor.execute(sql, listing['params'])
+        if not listing['paginated']:
+            # Unbounded: rows are serialized as they are read instead of
+            # building the whole list. The first batch is read here so a
+            # failing query still gets a 500.
+            first = cursor.fetchmany(STREAM_BATCH_SIZE)
+            rows = map(present, fetch_in_batches(cursor, first, STREAM_BATCH_SIZE))
+            return with_etag(stream_json('templates', rows), etag)
+        templates = [present(row) for row in cursor.fetchall()]
         cursor.close()
-        conn.close()
-        return jsonify({'templates': templates}), 200
     except Error as e:
-        print('Get trashed templates error:', e)
+        logger.exception(error_label)
         return jsonify({'error': str(e)}), 500
 
+    return with_etag(jsonify(template_page(templates, listing['limit'])), etag)
+
+# Any insert, delete or update in a template list changes its row count or
+# newest updated_at; both come from the index without touching rows.
+TEMPLATE_LIST_VERSION_SQL = """
+    SELECT COUNT(*) AS total, MAX(updated_at) AS last_updated
+    FROM templates WHERE user_id = %s AND is_trashed = %s
+"""
+
+def template_list_query(args, user_id, trashed):
+    """
+    Build the listing SELECT from list_templates' query parameters.
+
+    Returns a dict with sql, params, fields, excerpt, limit and paginated;
+    raises ValueError with the message for a 400. Shared with asgi.py.
+    """
+    paginated = 'limit' in args or 'cursor' in args
+    try:
+        limit = int(args.get('limit', MAX_TEMPLATE_PAGE_SIZE))
+        excerpt = int(args.get('excerpt', 0))
+    except ValueError:
+        raise ValueError('limit and excerpt must be integers')
+    limit = max(1, min(limit, MAX_TEMPLATE_PAGE_SIZE))
+    excerpt = max(0, min(excerpt, MAX_EXCERPT_LENGTH))
+
+    if 'fields' in args:
+        fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in TEMPLATE_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    else:
+        fields = list(TEMPLATE_SUMMARY_FIELDS if paginated else TEMPLATE_FIELDS)
+    # The cursor needs both sort keys, so they are always returned
+    for key in ('id', 'created_at'):
+        if key not in fields:
+            fields.append(key)
+
+    # Content is compressed, so excerpts are cut after decompressing it
+    selected = fields + ['content'] if excerpt and 'content' not in fields else fields
+    params = [user_id, trashed]
+    sql = f"SELECT {template_columns(selected)} FROM templates WHERE user_id = %s AND is_trashed = %s"
+
+    if paginated:
+        cursor_value = args.get('cursor')
+        if cursor_value:
+            after_created_at, after_id = decode_page_cursor(cursor_value)
+            # Spelled out rather than (created_at, id) < (%s, %s) so MySQL
+            # can turn it into a range on the listing index
+            sql += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+            params += [after_created_at, after_created_at, after_id]
+        sql += " ORDER BY created_at DESC, id DESC LIMIT %s"
+        params.append(limit + 1)
+    else:
+        sql += " ORDER BY created_at DESC, id DESC"
+    return {
+        'sql': sql, 'params': tuple(params), 'fields': fields, 'excerpt': excerpt,
+        'limit': limit, 'paginated': paginated,
+    }
+
+def present_template(row, listing):
+    """Decompress a listed row's content and cut its excerpt."""
+    content_codec.decode_row(row)
+    if listing['excerpt']:
+        row['excerpt'] = row['content'][:listing['excerpt']]
+        if 'content' not in listing['fields']:
+            del row['content']
+    return row
+
+def template_list_etag(user_id, trashed, version, query_string):
+    return make_etag('templates', user_id, trashed, version['total'], version['last_updated'], query_string)
+
+def template_page(templates, limit):
+    """The body of a paged listing, given up to limit + 1 templates."""
+    next_cursor = None
+    if len(templates) > limit:
+        templates = templates[:limit]
+        last = templates[-1]
+        next_cursor = encode_page_cursor(last['created_at'], last['id'])
+    return {'templates': templates, 'next_cursor': next_cursor}
+
+def template_columns(fields):
+    """The SELECT list for template fields; content needs both of its storage columns."""
+    return ', '.join('content, content_z' if field == 'content' else field for field in fields)
+
+def encode_page_cursor(created_at, row_id):
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_page_cursor(value):
+    try:
+        raw = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError('Invalid cursor') from e
+
 @app.route('/api/templates/<int:template_id>/trash', methods=['POST'])
 def trash_template(template_id):
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor()
         sql = "UPDATE templates SET is_trashed = TRUE WHERE id = %s"
         cursor.execute(sql, (template_id,))
         conn.commit()
         cursor.close()
-        conn.close()
         return jsonify({'message': 'Template moved to trash'}), 200
     except Error as e:
-        print('Trash template error:', e)
+        logger.exception('Trash template error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/templates/<int:template_id>/restore', methods=['POST'])
 def restore_template(template_id):
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor()
         sql = "UPDATE templates SET is_trashed = FALSE WHERE id = %s"
         cursor.execute(sql, (template_id,))
         conn.commit()
         cursor.close()
-        conn.close()
         return jsonify({'message': 'Template restored from trash'}), 200
     except Error as e:
-        print('Restore template error:', e)
+        logger.exception('Restore template error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/templates/<int:template_id>', methods=['PUT'])
@@ -420,40 +685,280 @@ def update_template(template_id):
     if not title or not content:
         return jsonify({'error': 'Missing required fields'}), 400
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor()
-        sql = "UPDATE templates SET title = %s, content = %s WHERE id = %s"
-        cursor.execute(sql, (title, content, template_id))
+        if not save_template(template_id, title, content):
+            return jsonify({'error': 'Template not found'}), 404
+        return jsonify({'message': 'Template updated successfully'}), 200
+    except Error as e:
+        logger.exception('Update template error')
+        return jsonify({'error': str(e)}), 500
+
+def save_template(template_id, title, content):
+    """
+    Overwrite a template, recording the replaced version as a revision.
+
+    Returns False if the template does not exist.
+    """
+    conn = get_db()
+    conn.start_transaction()
+    try:
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            "SELECT title, content, content_z FROM templates WHERE id = %s FOR UPDATE", (template_id,)
+        )
+        current = cursor.fetchone()
+        if current is None:
+            conn.rollback()
+            return False
+        current = content_codec.decode_row(current)
+        if (current['title'], current['content']) != (title, content):
+            record_revision(conn, template_id, current['title'], current['content'], content, TEMPLATE_REVISIONS)
+            cursor.execute("""
+                UPDATE templates SET title = %s, content = '', content_z = %s, search_terms = %s
+                WHERE id = %s
+            """, (title, content_codec.encode(content), index_terms(content), template_id))
         conn.commit()
         cursor.close()
-        conn.close()
-        return jsonify({'message': 'Template updated successfully'}), 200
+        return True
+    except Error:
+        conn.rollback()
+        raise
+
+@app.route('/api/templates/<int:template_id>/revisions', methods=['GET'])
+def list_template_revisions(template_id):
+    try:
+        conn = get_read_db()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT revision, title, content_length, created_at
+            FROM template_revisions
+            WHERE template_id = %s
+            ORDER BY revision DESC
+        """, (template_id,))
+        revisions = cursor.fetchall()
+        cursor.close()
+        return jsonify({'revisions': revisions}), 200
+    except Error as e:
+        logger.exception('List template revisions error')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/templates/<int:template_id>/revisions/<int:revision>', methods=['GET'])
+def get_template_revision(template_id, revision):
+    try:
+        version = materialize(get_read_db(), template_id, revision, content_codec)
+        if version is None:
+            return jsonify({'error': 'Revision not found'}), 404
+        return jsonify({'revision': dict(version, revision=revision)}), 200
     except Error as e:
-        print('Update template error:', e)
+        logger.exception('Get template revision error')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/templates/<int:template_id>/revisions/<int:revision>/restore', methods=['POST'])
+def restore_template_revision(template_id, revision):
+    """Make a past revision current again; the replaced content becomes a revision too."""
+    try:
+        conn = get_db()
+        version = materialize(conn, template_id, revision, content_codec)
+        if version is None:
+            return jsonify({'error': 'Revision not found'}), 404
+        # End the read so save_template can start its own transaction
+        conn.rollback()
+        if not save_template(template_id, version['title'], version['content']):
+            return jsonify({'error': 'Template not found'}), 404
+        return jsonify({'message': f'Template restored to revision {revision}'}), 200
+    except Error as e:
+        logger.exception('Restore template revision error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/templates/<int:template_id>', methods=['GET'])
 def get_template(template_id):
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_read_db()
         cursor = conn.cursor(dictionary=True)
-        sql = "SELECT * FROM templates WHERE id = %s"
+        if request.if_none_match:
+            # Revalidation: compare versions before reading the content column
+            cursor.execute("SELECT updated_at FROM templates WHERE id = %s", (template_id,))
+            row = cursor.fetchone()
+            if row:
+                cached = not_modified(template_etag(template_id, row['updated_at']))
+                if cached:
+                    cursor.close()
+                    return cached
+        sql = """
+            SELECT id, user_id, title, content, content_z, is_trashed, created_at, updated_at
+            FROM templates WHERE id = %s
+        """
         cursor.execute(sql, (template_id,))
         template = cursor.fetchone()
         cursor.close()
-        conn.close()
         if template:
-            return jsonify({'template': template}), 200
+            content_codec.decode_row(template)
+            etag = template_etag(template_id, template['updated_at'])
+            return with_etag(jsonify({'template': template}), etag)
         else:
             return jsonify({'error': 'Template not found'}), 404
     except Error as e:
-        print('Get template error:', e)
+        logger.exception('Get template error')
+        return jsonify({'error': str(e)}), 500
+
+MAX_SEARCH_RESULTS = 50
+MAX_SEARCH_OFFSET = 1000
+
+@app.route('/api/templates/search', methods=['GET'])
+def search_templates():
+    """
+    Rank a user's templates against q by title and content, best match first.
+
+    Every word of q must occur (as a word prefix); words under three
+    characters and common stopwords are ignored. trashed=1 searches the
+    trash instead. Results carry a snippet of the content with the matches
+    in <mark> tags, and next_offset when there are more.
+    """
+    user_id = caller_user_id(request.args.get('user_id'))
+    if not user_id:
+        return jsonify({'error': 'Missing user_id'}), 400
+    terms = search_terms(request.args.get('q', ''))
+    if not terms:
+        return jsonify({'error': 'q must contain a searchable word (3 or more letters, not a stopword)'}), 400
+    trashed = request.args.get('trashed', '').lower() in ('1', 'true')
+    try:
+        limit = int(request.args.get('limit', 20))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    limit = max(1, min(limit, MAX_SEARCH_RESULTS))
+    offset = max(0, min(offset, MAX_SEARCH_OFFSET))
+
+    try:
+        hits = template_search.search(user_id, trashed, terms, limit + 1, offset)
+    except Error as e:
+        logger.exception('Search templates error')
+        return jsonify({'error': str(e)}), 500
+
+    results = [{
+        'id': hit['id'],
+        'title': hit['title'],
+        'is_trashed': hit['is_trashed'],
+        'created_at': hit['created_at'],
+        'updated_at': hit['updated_at'],
+        'score': round(float(hit['score']), 4),
+        'snippet': highlight(hit['content'], terms),
+    } for hit in hits[:limit]]
+    return jsonify({
+        'results': results,
+        'next_offset': offset + limit if len(hits) > limit else None
+    }), 200
+
+# Bulk template operations: one set-based statement per call, scoped to the owner
+MAX_TEMPLATE_BATCH_SIZE = 500
+
+def parse_template_ids(values):
+    """Validate a list of template ids, dropping duplicates; raises ValueError."""
+    if isinstance(values, str):
+        values = values.split(',')
+    if not isinstance(values, list) or not values:
+        raise ValueError('ids must be a non-empty list of template ids')
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise ValueError('ids must be integers')
+    if len(ids) > MAX_TEMPLATE_BATCH_SIZE:
+        raise ValueError(f'At most {MAX_TEMPLATE_BATCH_SIZE} ids per request')
+    return ids
+
+def id_placeholders(ids):
+    return ', '.join(['%s'] * len(ids))
+
+@app.route('/api/templates/batch', methods=['GET'])
+def get_templates_batch():
+    user_id = caller_user_id(request.args.get('user_id'))
+    if not user_id:
+        return jsonify({'error': 'Missing user_id'}), 400
+    try:
+        ids = parse_template_ids(request.args.get('ids', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    fields = list(TEMPLATE_FIELDS)
+    if 'fields' in request.args:
+        fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in TEMPLATE_FIELDS]
+        if unknown:
+            return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+        if 'id' not in fields:
+            fields.append('id')
+    try:
+        conn = get_read_db()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(
+            f"SELECT {template_columns(fields)} FROM templates WHERE user_id = %s AND id IN ({id_placeholders(ids)})",
+            (user_id, *ids)
+        )
+        found = {row['id']: content_codec.decode_row(row) for row in cursor.fetchall()}
+        cursor.close()
+        return jsonify({
+            'templates': [found[i] for i in ids if i in found],
+            'missing': [i for i in ids if i not in found]
+        }), 200
+    except Error as e:
+        logger.exception('Batch get templates error')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/templates/batch/trash', methods=['POST'])
+def trash_templates_batch():
+    return update_templates_batch("UPDATE templates SET is_trashed = TRUE", 'Templates moved to trash')
+
+@app.route('/api/templates/batch/restore', methods=['POST'])
+def restore_templates_batch():
+    return update_templates_batch("UPDATE templates SET is_trashed = FALSE", 'Templates restored from trash')
+
+@app.route('/api/templates/batch/delete', methods=['POST'])
+def delete_templates_batch():
+    return update_templates_batch("DELETE FROM templates", 'Templates deleted')
+
+def update_templates_batch(statement, message):
+    data = request.get_json() or {}
+    user_id = caller_user_id(data.get('user_id'))
+    if not user_id:
+        return jsonify({'error': 'Missing user_id'}), 400
+    try:
+        ids = parse_template_ids(data.get('ids'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"{statement} WHERE user_id = %s AND id IN ({id_placeholders(ids)})",
+            (user_id, *ids)
+        )
+        affected = cursor.rowcount
+        conn.commit()
+        cursor.close()
+        return jsonify({'message': message, 'count': affected}), 200
+    except Error as e:
+        logger.exception('Batch template update error')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/templates/trash', methods=['DELETE'])
+def empty_trash():
+    user_id = caller_user_id(request.args.get('user_id'))
+    if not user_id:
+        return jsonify({'error': 'Missing user_id'}), 400
+    try:
+        conn = get_db()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM templates WHERE user_id = %s AND is_trashed = TRUE", (user_id,))
+        deleted = cursor.rowcount
+        conn.commit()
+        cursor.close()
+        return jsonify({'message': 'Trash emptied', 'count': deleted}), 200
+    except Error as e:
+        logger.exception('Empty trash error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/consultations', methods=['POST'])
 def create_consultation():
     data = request.get_json()
-    user_id = data.get('userId')
+    user_id = caller_user_id(data.get('userId'))
     user_name = data.get('userName')
     user_email = data.get('userEmail')
     attorney_id = data.get('attorneyId')
@@ -483,7 +988,7 @@ def create_consultation():
         return jsonify({'error': 'Missing required fields'}), 400
 
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor()
         sql = '''
             INSERT INTO consultations
@@ -496,10 +1001,9 @@ def create_consultation():
         ))
         conn.commit()
         cursor.close()
-        conn.close()
         return jsonify({'message': 'Consultation scheduled!'}), 201
     except Exception as e:
-        print('Consultation error:', e)
+        logger.exception('Consultation error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/forgot-password', methods=['POST'])
@@ -509,39 +1013,27 @@ def forgot_password():
     if not email:
         return jsonify({'error': 'Email is required'}), 400
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
         sql = "SELECT id, username FROM users WHERE email = %s"
         cursor.execute(sql, (email,))
         user = cursor.fetchone()
         cursor.close()
-        conn.close()
         if not user:
             return jsonify({'error': 'No user found with that email'}), 404
         # Generate a simple reset token (not stored, demo only)
         reset_token = secrets.token_urlsafe(32)
         reset_link = f"https://your-frontend-domain.com/reset-password?token={reset_token}&email={email}"
-        # Send email via SendGrid
-        sg = sendgrid.SendGridAPIClient(api_key=SENDGRID_API_KEY)
-        message = Mail(
-            from_email=SENDGRID_FROM_EMAIL,
-            to_emails=email,
-            subject='Password Reset Request',
-            html_content=f"""
-                <p>Hello {user['username']},</p>
-                <p>You requested a password reset. Click the link below to reset your password:</p>
-                <a href='{reset_link}'>Reset Password</a>
-                <p>If you did not request this, please ignore this email.</p>
-            """
-        )
+        # Queue the email; delivery happens in the background
         try:
-            sg.send(message)
+            message = render_email('reset_link', username=user['username'], reset_link=reset_link)
+            mailer.send(dict(message, to=email))
             return jsonify({'message': 'Password reset email sent!'}), 200
-        except Exception as e:
-            print('SendGrid error:', e)
+        except Exception:
+            logger.exception('Email queue error')
             return jsonify({'error': 'Failed to send email'}), 500
     except Exception as e:
-        print('Forgot password error:', e)
+        logger.exception('Forgot password error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/auth/send-otp', methods=['POST'])
@@ -552,12 +1044,11 @@ def send_otp():
     if not email:
         return jsonify({'error': 'Email is required'}), 400
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
         cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
         user = cursor.fetchone()
         cursor.close()
-        conn.close()
         if purpose == 'register':
             if user:
                 return jsonify({'error': 'Email already registered'}), 400
@@ -567,11 +1058,11 @@ def send_otp():
         else:
             return jsonify({'error': 'Invalid OTP purpose'}), 400
         otp = generate_otp()
-        otp_store[email] = {'otp': otp, 'expires': datetime.utcnow() + timedelta(minutes=OTP_EXPIRY_MINUTES), 'purpose': purpose}
+        otp_store.set(email, otp, purpose, datetime.utcnow() + timedelta(minutes=OTP_EXPIRY_MINUTES))
         send_otp_email(email, otp, purpose)
         return jsonify({'message': 'OTP sent'}), 200
-    except Exception as e:
-        print('Send OTP error:', e)
+    except Exception:
+        logger.exception('Send OTP error')
         return jsonify({'error': 'Failed to send OTP'}), 500
 
 @app.route('/api/auth/verify-otp', methods=['POST'])
@@ -587,16 +1078,15 @@ def verify_otp():
     # Optionally, mark user as verified in DB for registration
     if record['purpose'] == 'register':
         try:
-            conn = mysql.connector.connect(**DB_CONFIG)
+            conn = get_db()
             cursor = conn.cursor()
             cursor.execute("UPDATE users SET verified = TRUE WHERE email = %s", (email,))
             conn.commit()
             cursor.close()
-            conn.close()
-        except Exception as e:
-            print('Verify OTP DB error:', e)
+        except Exception:
+            logger.exception('Verify OTP DB error')
             return jsonify({'error': 'Failed to verify user'}), 500
-    del otp_store[email]
+    otp_store.delete(email)
     return jsonify({'message': 'OTP verified'}), 200
 
 @app.route('/api/auth/reset-password', methods=['POST'])
@@ -611,22 +1101,31 @@ def reset_password():
     if not record or record['otp'] != otp or record['expires'] < datetime.utcnow() or record['purpose'] != 'forgot':
         return jsonify({'error': 'Invalid or expired OTP'}), 400
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        release_db()
+        password_hash = password_hasher.hash(new_password)
+        conn = get_db()
         cursor = conn.cursor()
-        cursor.execute("UPDATE users SET password = %s WHERE email = %s", (new_password, email))
+        cursor.execute("UPDATE users SET password = %s WHERE email = %s", (password_hash, email))
         conn.commit()
+        cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
+        user = cursor.fetchone()
         cursor.close()
-        conn.close()
-        del otp_store[email]
+        otp_store.delete(email)
+        # Sign out every session that was opened with the old password
+        if user and token_issuer:
+            token_revocations.revoke_user(user[0], int(time.time()) + token_issuer.refresh_ttl)
         return jsonify({'message': 'Password reset successful'}), 200
-    except Exception as e:
-        print('Reset password error:', e)
+    except PasswordHasherBusy:
+        return busy_response()
+    except Exception:
+        logger.exception('Reset password error')
         return jsonify({'error': 'Failed to reset password'}), 500
 
 @app.route('/api/contact', methods=['POST'])
 def submit_contact_form():
     data = request.get_json()
-    user_id = data.get('user_id')  # Optional, if user is logged in
+    caller = current_caller()
+    user_id = caller.user_id if caller else data.get('user_id')  # Optional, if user is logged in
     name = data.get('name')
     email = data.get('email')
     subject = data.get('subject')
@@ -634,7 +1133,7 @@ def submit_contact_form():
     if not name or not email or not message:
         return jsonify({'error': 'Missing required fields'}), 400
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor()
         sql = """
             INSERT INTO contact_forms (user_id, name, email, subject, message)
@@ -643,16 +1142,15 @@ def submit_contact_form():
         cursor.execute(sql, (user_id, name, email, subject, message))
         conn.commit()
         cursor.close()
-        conn.close()
         return jsonify({'message': 'Contact form submitted successfully!'}), 201
     except Exception as e:
-        print('Contact form error:', e)
+        logger.exception('Contact form error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/payments/select-plan', methods=['POST'])
 def select_plan():
     data = request.get_json()
-    user_id = data.get('user_id')
+    user_id = caller_user_id(data.get('user_id'))
     plan = data.get('plan')
 
     if not user_id or not plan:
@@ -662,7 +1160,7 @@ def select_plan():
         return jsonify({'error': 'Invalid plan selected'}), 400
 
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
 
         # Check current user plan
@@ -695,13 +1193,13 @@ def select_plan():
             
             conn.commit()
             cursor.close()
-            conn.close()
+            subscription_cache.invalidate(user_id)
             
-            return jsonify({
+            return jsonify(with_access_token(user_id, {
                 'message': 'Free plan activated successfully',
                 'transaction_id': transaction_id,
                 'previous_plan': current_plan
-            }), 200
+            })), 200
 
         else:
             # For paid plans, return error as payment processing is not implemented yet
@@ -710,27 +1208,48 @@ def select_plan():
             }), 501
 
     except Error as e:
-        print('Plan selection error:', e)
+        logger.exception('Plan selection error')
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/payments/user-plan', methods=['GET'])
 def get_user_plan():
-    user_id = request.args.get('user_id')
+    user_id = caller_user_id(request.args.get('user_id'))
     
     if not user_id:
         return jsonify({'error': 'User ID is required'}), 400
 
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_read_db()
         cursor = conn.cursor(dictionary=True)
 
-        # Get current plan
-        cursor.execute("SELECT plan FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
+        # Current plan plus a fingerprint of the payment history; payments
+        # are never edited, so new rows are the only way the history changes.
+        # An access token already names the plan, so users is not read.
+        caller = current_caller()
+        if caller is not None:
+            cursor.execute("""
+                SELECT COUNT(id) AS payments, MAX(id) AS last_payment
+                FROM payments WHERE user_id = %s
+            """, (user_id,))
+            user = dict(cursor.fetchone(), plan=caller.subscription()[1])
+        else:
+            cursor.execute("""
+                SELECT u.plan, COUNT(p.id) AS payments, MAX(p.id) AS last_payment
+                FROM users u LEFT JOIN payments p ON p.user_id = u.id
+                WHERE u.id = %s
+                GROUP BY u.id, u.plan
+            """, (user_id,))
+            user = cursor.fetchone()
 
         if not user:
             return jsonify({'error': 'User not found'}), 404
 
+        etag = make_etag('user-plan', user_id, user['plan'], user['payments'], user['last_payment'])
+        cached = not_modified(etag)
+        if cached:
+            cursor.close()
+            return cached
+
         # Get payment history
         cursor.execute("""
             SELECT plan, payment_date, amount, status, transaction_id 
@@ -741,190 +1260,205 @@ def get_user_plan():
         payment_history = cursor.fetchall()
 
         cursor.close()
-        conn.close()
 
-        return jsonify({
+        return with_etag(jsonify({
             'current_plan': user['plan'],
             'payment_history': payment_history
-        }), 200
+        }), etag)
 
     except Error as e:
-        print('Get user plan error:', e)
+        logger.exception('Get user plan error')
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/payments/plan-features', methods=['GET'])
-def get_plan_features():
-    # Define plan features and pricing
-    plan_details = {
-        'free': {
-            'name': 'Free Plan',
-            'price': 0.00,
-            'features': [
-                'Access to basic document templates',
-                'Limited document generation',
-                'Basic legal resources'
-            ],
-            'limits': {
-                'templates_per_month': 3,
-                'documents_per_month': 5
-            }
-        },
-        'pro': {
-            'name': 'Pro Plan',
-            'price': 29.99,
-            'features': [
-                'Access to all document templates',
-                'Unlimited document generation',
-                'Priority support',
-                'Advanced legal resources',
-                'Document storage'
-            ],
-            'limits': {
-                'templates_per_month': 'Unlimited',
-                'documents_per_month': 'Unlimited'
-            }
-        },
-        'attorney': {
-            'name': 'Attorney Plan',
-            'price': 99.99,
-            'features': [
-                'All Pro Plan features',
-                'Direct attorney consultation',
-                'Custom document review',
-                'Priority support',
-                'Legal advisory services'
-            ],
-            'limits': {
-                'templates_per_month': 'Unlimited',
-                'documents_per_month': 'Unlimited',
-                'attorney_consultations_per_month': 2
-            }
+# Plan features and pricing. Static, so the body and its ETag are built once
+# and the CDN may cache the response.
+PLAN_DETAILS = {
+    'free': {
+        'name': 'Free Plan',
+        'price': 0.00,
+        'features': [
+            'Access to basic document templates',
+            'Limited document generation',
+            'Basic legal resources'
+        ],
+        'limits': {
+            'templates_per_month': 3,
+            'documents_per_month': 5
+        }
+    },
+    'pro': {
+        'name': 'Pro Plan',
+        'price': 29.99,
+        'features': [
+            'Access to all document templates',
+            'Unlimited document generation',
+            'Priority support',
+            'Advanced legal resources',
+            'Document storage'
+        ],
+        'limits': {
+            'templates_per_month': 'Unlimited',
+            'documents_per_month': 'Unlimited'
+        }
+    },
+    'attorney': {
+        'name': 'Attorney Plan',
+        'price': 99.99,
+        'features': [
+            'All Pro Plan features',
+            'Direct attorney consultation',
+            'Custom document review',
+            'Priority support',
+            'Legal advisory services'
+        ],
+        'limits': {
+            'templates_per_month': 'Unlimited',
+            'documents_per_month': 'Unlimited',
+            'attorney_consultations_per_month': 2
         }
     }
-    
-    return jsonify(plan_details), 200
+}
+PLAN_FEATURES_BODY = json.dumps(PLAN_DETAILS)
+PLAN_FEATURES_ETAG = make_etag(PLAN_FEATURES_BODY)
+PLAN_FEATURES_CACHE_CONTROL = 'public, max-age=3600, s-maxage=86400, stale-while-revalidate=604800'
+
+@app.route('/api/payments/plan-features', methods=['GET'])
+def get_plan_features():
+    cached = not_modified(PLAN_FEATURES_ETAG, PLAN_FEATURES_CACHE_CONTROL)
+    if cached:
+        return cached
+    response = app.response_class(PLAN_FEATURES_BODY, mimetype='application/json')
+    return with_etag(response, PLAN_FEATURES_ETAG, PLAN_FEATURES_CACHE_CONTROL)
 
 @app.route('/api/documents/check-daily-limit', methods=['GET'])
 def check_daily_limit():
-    user_id = request.args.get('user_id')
+    user_id = caller_user_id(request.args.get('user_id'))
     
     if not user_id:
         return jsonify({'error': 'User ID is required'}), 400
 
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
+        # Get user's plan (from the access token, else cached)
+        is_paid, plan_type, _ = subscription_status(user_id)
 
-        # Get user's plan
-        cursor.execute("SELECT plan FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
-
-        if not user:
+        if plan_type is None:
             return jsonify({'error': 'User not found'}), 404
 
-        # If user is not on free plan, they have unlimited generations
-        if user['plan'] != 'free':
-            return jsonify({
-                'can_generate': True,
-                'daily_limit': 'unlimited',
-                'generations_today': 0,
-                'remaining_generations': 'unlimited'
-            }), 200
-
-        # Count today's generations for free users
-        cursor.execute("""
-            SELECT COUNT(*) as count
-            FROM document_generation_logs
-            WHERE user_id = %s
-            AND DATE(generated_at) = CURDATE()
-        """, (user_id,))
-        result = cursor.fetchone()
-        generations_today = result['count']
-
-        daily_limit = 3  # Updated: Free plan daily limit increased to 3
-        remaining_generations = max(0, daily_limit - generations_today)
+        # If user has an active paid plan, they have unlimited generations
+        if is_paid:
+            return jsonify(daily_limit_body(True, 0)), 200
 
-        cursor.close()
-        conn.close()
+        # Count today's generations for free users (cached per user and day)
+        def load_generations_today():
+            cursor = get_read_db().cursor(dictionary=True)
+            count = count_generations_today(cursor, user_id)
+            cursor.close()
+            return count
 
-        return jsonify({
-            'can_generate': remaining_generations > 0,
-            'daily_limit': daily_limit,
-            'generations_today': generations_today,
-            'remaining_generations': remaining_generations
-        }), 200
+        generations_today = daily_generations.get(user_id, load_generations_today)
+        return jsonify(daily_limit_body(False, generations_today)), 200
 
     except Error as e:
-        print('Check daily limit error:', e)
+        logger.exception('Check daily limit error')
         return jsonify({'error': str(e)}), 500
 
-def check_subscription_status(user_id):
+def daily_limit_body(is_paid, generations_today):
+    if is_paid:
+        return {
+            'can_generate': True,
+            'daily_limit': 'unlimited',
+            'generations_today': 0,
+            'remaining_generations': 'unlimited'
+        }
+    daily_limit = FREE_DAILY_LIMIT
+    remaining_generations = max(0, daily_limit - generations_today)
+    return {
+        'can_generate': remaining_generations > 0,
+        'daily_limit': daily_limit,
+        'generations_today': generations_today,
+        'remaining_generations': remaining_generations
+    }
+
+def check_subscription_status(user_id, lock=False):
     """
     Check if user has an active paid subscription
+    Results are cached per user until the subscription's expiry date (or the
+    cache TTL, whichever is sooner); plan changes invalidate the entry.
+    Never writes: lapsed plans are reported as free and left for the
+    expire-subscriptions job to downgrade.
+    With lock=True the cache is bypassed, the user's row is locked FOR UPDATE
+    and errors are raised, so the check can be part of the caller's transaction.
     Returns (is_paid, plan_type, expiry_date)
     """
+    if not lock:
+        cached = subscription_cache.get(user_id)
+        if cached is not None:
+            return cached
+
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
+        status = load_subscription_status(user_id, lock)
+    except Error:
+        if lock:
+            raise
+        logger.exception('Subscription check error')
+        return False, 'free', None
 
-        # First check user's current plan in users table
-        cursor.execute("SELECT plan FROM users WHERE id = %s", (user_id,))
-        user = cursor.fetchone()
-        
-        if not user:
-            return False, None, None  # User not found
-            
-        # If user is explicitly on free plan, no need to check payments
-        if user['plan'] == 'free':
-            return False, 'free', None
+    is_paid, plan_type, expiry_date = status
+    if plan_type is not None:
+        subscription_cache.set(user_id, status, expires_at=utc_timestamp(expiry_date) if expiry_date else None)
+    return status
 
-        # Only check payment status for paid plans
-        cursor.execute("""
-            SELECT *
-            FROM payments
-            WHERE user_id = %s 
-            AND status = 'success'
-            AND plan != 'free'
-            ORDER BY payment_date DESC
-            LIMIT 1
-        """, (user_id,))
-        
-        latest_payment = cursor.fetchone()
-        cursor.close()
-        conn.close()
+def load_subscription_status(user_id, lock=False):
+    # Locking reads are part of a write transaction on the primary
+    cursor = (get_db() if lock else get_read_db()).cursor(dictionary=True)
 
-        # If user's plan is paid but no payment found, something's wrong
-        if not latest_payment:
-            # Reset to free plan as no valid payment found
-            conn = mysql.connector.connect(**DB_CONFIG)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET plan = 'free' WHERE id = %s", (user_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return False, 'free', None
+    # First check user's current plan in users table
+    cursor.execute(USER_PLAN_SQL + (" FOR UPDATE" if lock else ""), (user_id,))
+    user = cursor.fetchone()
 
-        # Check if payment is still valid
-        payment_date = latest_payment['payment_date']
-        expiry_date = payment_date + timedelta(days=30)
-        is_active = datetime.utcnow() < expiry_date
+    # If user is explicitly on free plan, no need to check payments
+    latest_payment = None
+    if user and user['plan'] != 'free':
+        cursor.execute(LATEST_PAID_PAYMENT_SQL, (user_id,))
+        latest_payment = cursor.fetchone()
+    cursor.close()
+    return subscription_from(user, latest_payment)
+
+USER_PLAN_SQL = "SELECT plan FROM users WHERE id = %s"
+# Only checked for paid plans
+LATEST_PAID_PAYMENT_SQL = """
+    SELECT *
+    FROM payments
+    WHERE user_id = %s 
+    AND status = 'success'
+    AND plan != 'free'
+    ORDER BY payment_date DESC
+    LIMIT 1
+"""
+
+def subscription_from(user, latest_payment):
+    """(is_paid, plan_type, expiry_date) from the USER_PLAN_SQL and LATEST_PAID_PAYMENT_SQL rows."""
+    if not user:
+        return False, None, None  # User not found
+
+    if user['plan'] == 'free':
+        return False, 'free', None
 
-        if not is_active:
-            # If subscription expired, update user to free plan
-            conn = mysql.connector.connect(**DB_CONFIG)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET plan = 'free' WHERE id = %s", (user_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return False, 'free', None
+    # A paid plan without a valid payment, or whose payment has lapsed, is
+    # treated as free here; expire_subscriptions downgrades the row in bulk
+    if not latest_payment:
+        return False, 'free', None
 
-        return True, latest_payment['plan'], expiry_date
+    # Check if payment is still valid
+    payment_date = latest_payment['payment_date']
+    expiry_date = payment_date + timedelta(days=SUBSCRIPTION_DAYS)
+    is_active = datetime.utcnow() < expiry_date
 
-    except Error as e:
-        print('Subscription check error:', e)
+    if not is_active:
         return False, 'free', None
 
+    return True, latest_payment['plan'], expiry_date
+
 def update_user_plan(user_id, new_plan, payment_id=None):
     """
     Update user's plan and log the change
@@ -936,7 +1470,7 @@ def update_user_plan(user_id, new_plan, payment_id=None):
         (success, error_message)
     """
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
 
         # Get current plan
@@ -970,33 +1504,35 @@ def update_user_plan(user_id, new_plan, payment_id=None):
         
         conn.commit()
         cursor.close()
-        conn.close()
+        subscription_cache.invalidate(user_id)
         return True, None
 
     except Error as e:
-        print('Plan update error:', e)
+        logger.exception('Plan update error')
         return False, str(e)
 
 @app.route('/api/payments/subscription-status', methods=['GET'])
 def get_subscription_status():
-    user_id = request.args.get('user_id')
+    user_id = caller_user_id(request.args.get('user_id'))
     
     if not user_id:
         return jsonify({'error': 'User ID is required'}), 400
 
-    is_paid, plan_type, expiry_date = check_subscription_status(user_id)
-    
-    return jsonify({
+    return jsonify(subscription_status_body(subscription_status(user_id))), 200
+
+def subscription_status_body(status):
+    is_paid, plan_type, expiry_date = status
+    return {
         'is_paid': is_paid,
         'plan_type': plan_type,
         'expiry_date': expiry_date.isoformat() if expiry_date else None,
         'days_remaining': (expiry_date - datetime.utcnow()).days if expiry_date else 0
-    }), 200
+    }
 
 @app.route('/api/payments/process-payment', methods=['POST'])
 def process_payment():
     data = request.get_json()
-    user_id = data.get('user_id')
+    user_id = caller_user_id(data.get('user_id'))
     plan = data.get('plan')
     payment_method = data.get('payment_method')
     amount = data.get('amount')
@@ -1008,7 +1544,7 @@ def process_payment():
         return jsonify({'error': 'Invalid plan selected'}), 400
 
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_db()
         cursor = conn.cursor()
 
         # Generate a transaction ID
@@ -1035,108 +1571,104 @@ def process_payment():
                 return jsonify({'error': f'Failed to update plan: {error}'}), 500
 
             conn.commit()
+            subscription_cache.invalidate(user_id)
             
-            return jsonify({
+            return jsonify(with_access_token(user_id, {
                 'message': 'Payment processed and plan updated successfully',
                 'transaction_id': transaction_id,
                 'plan': plan,
-                'expiry_date': (datetime.utcnow() + timedelta(days=30)).isoformat()
-            }), 200
+                'expiry_date': (datetime.utcnow() + timedelta(days=SUBSCRIPTION_DAYS)).isoformat()
+            })), 200
 
         except Error as e:
             conn.rollback()
             raise e
 
     except Error as e:
-        print('Payment processing error:', e)
+        logger.exception('Payment processing error')
         return jsonify({'error': str(e)}), 500
     finally:
         cursor.close()
-        conn.close()
+
+PAYMENT_HISTORY_SQL = """
+    SELECT plan, payment_date, amount, status, transaction_id
+    FROM payments
+    WHERE user_id = %s
+    ORDER BY payment_date DESC
+"""
 
 @app.route('/api/payments/history', methods=['GET'])
 def get_payment_history():
-    user_id = request.args.get('user_id')
+    user_id = caller_user_id(request.args.get('user_id'))
     
     if not user_id:
         return jsonify({'error': 'User ID is required'}), 400
 
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        conn = get_read_db()
         cursor = conn.cursor(dictionary=True)
         
-        cursor.execute("""
-            SELECT plan, payment_date, amount, status, transaction_id
-            FROM payments
-            WHERE user_id = %s
-            ORDER BY payment_date DESC
-        """, (user_id,))
-        
-        payments = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        cursor.execute(PAYMENT_HISTORY_SQL, (user_id,))
         
-        return jsonify({'payments': payments}), 200
+        first = cursor.fetchmany(STREAM_BATCH_SIZE)
+        return stream_json('payments', fetch_in_batches(cursor, first, STREAM_BATCH_SIZE))
         
     except Error as e:
-        print('Payment history error:', e)
+        logger.exception('Payment history error')
         return jsonify({'error': str(e)}), 500
 
 def check_and_log_document_generation(user_id):
     """
     Check if user can generate a document and log the generation if allowed.
+    Runs inside the caller's transaction on the request connection and does not
+    commit: the user's row stays locked until the caller commits or rolls back,
+    so parallel requests for the same user are counted one at a time.
     Returns (can_generate, error_message)
     """
-    try:
-        is_paid, plan_type, _ = check_subscription_status(user_id)
+    # A cached paid status is trusted without locking: paid plans have no
+    # quota to race on. Free users are re-checked under the row lock.
+    cached = subscription_cache.get(user_id)
+    if cached is not None and cached[0]:
+        is_paid, plan_type, _ = cached
+    else:
+        is_paid, plan_type, _ = check_subscription_status(user_id, lock=True)
+    if plan_type is None:
+        return False, "User not found"
 
-        # If user has paid plan, they can always generate
-        if is_paid:
-            conn = mysql.connector.connect(**DB_CONFIG)
-            cursor = conn.cursor()
-            # Still log the generation but don't enforce limits
-            cursor.execute("""
-                INSERT INTO document_generation_logs (user_id)
-                VALUES (%s)
-            """, (user_id,))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True, None
+    cursor = get_db().cursor(dictionary=True)
 
-        # For free users, check daily limit
-        conn = mysql.connector.connect(**DB_CONFIG)
-        cursor = conn.cursor(dictionary=True)
+    # Paid plans can always generate; free plans are limited per day
+    if not is_paid:
+        generations_today = count_generations_today(cursor, user_id)
 
-        # Check today's generation count
-        cursor.execute("""
-            SELECT COUNT(*) as count
-            FROM document_generation_logs
-            WHERE user_id = %s
-            AND DATE(generated_at) = CURDATE()
-        """, (user_id,))
-        result = cursor.fetchone()
-        generations_today = result['count']
-
-        if generations_today >= 3:  # Free plan daily limit
+        if generations_today >= FREE_DAILY_LIMIT:
             cursor.close()
-            conn.close()
             return False, "Daily document generation limit reached for free plan. Upgrade to generate more documents!"
 
-        # Log the generation
-        cursor.execute("""
-            INSERT INTO document_generation_logs (user_id)
-            VALUES (%s)
-        """, (user_id,))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True, None
-
-    except Error as e:
-        print('Document generation check error:', e)
-        return False, str(e)
+    # Log the generation
+    cursor.execute("""
+        INSERT INTO document_generation_logs (user_id)
+        VALUES (%s)
+    """, (user_id,))
+    cursor.close()
+    return True, None
+
+def count_generations_today(cursor, user_id):
+    cursor.execute(GENERATIONS_TODAY_SQL, (user_id, *utc_day_bounds()))
+    return cursor.fetchone()['count']
+
+GENERATIONS_TODAY_SQL = """
+    SELECT COUNT(*) as count
+    FROM document_generation_logs
+    WHERE user_id = %s
+    AND generated_at >= %s
+    AND generated_at < %s
+"""
+
+def utc_day_bounds():
+    """Return the [start, end) datetimes of the current UTC day."""
+    day_start = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    return day_start, day_start + timedelta(days=1)
 
 @app.route('/api/update-profile', methods=['PUT'])
 def update_profile():
@@ -1155,7 +1687,10 @@ def update_profile():
         return jsonify({'error': 'Email and username are required'}), 400
     
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
+        # Hashed without holding a pooled connection
+        release_db()
+        password_hash = password_hasher.hash(password) if password else None
+        conn = get_db()
         cursor = conn.cursor(dictionary=True)
         
         # First, check if user exists
@@ -1164,7 +1699,6 @@ def update_profile():
         
         if not user:
             cursor.close()
-            conn.close()
             return jsonify({'error': 'User not found'}), 404
         
         user_id = user['id']
@@ -1176,7 +1710,7 @@ def update_profile():
                 UPDATE users 
                 SET username = %s, password = %s 
                 WHERE id = %s
-            """, (username, password, user_id))
+            """, (username, password_hash, user_id))
         else:
             # Update only username
             cursor.execute("""
@@ -1192,17 +1726,129 @@ def update_profile():
         updated_user = cursor.fetchone()
         
         cursor.close()
-        conn.close()
         
         return jsonify({
             'message': 'Profile updated successfully',
             'user': updated_user
         }), 200
         
-    except Error as e:
-        print('Profile update error:', e)
+    except PasswordHasherBusy:
+        return busy_response()
+    except Error:
+        logger.exception('Profile update error')
         return jsonify({'error': 'Failed to update profile'}), 500
 
+@app.route('/api/cron/expire-subscriptions', methods=['GET', 'POST'])
+def cron_expire_subscriptions():
+    if not CRON_SECRET or request.headers.get('Authorization') != f'Bearer {CRON_SECRET}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        expired = expire_subscriptions(get_db())
+        return jsonify({'message': 'Expired subscriptions downgraded', 'expired': expired}), 200
+    except Error as e:
+        logger.exception('Subscription expiry error')
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/cron/drain-email-outbox', methods=['GET', 'POST'])
+def cron_drain_email_outbox():
+    if not CRON_SECRET or request.headers.get('Authorization') != f'Bearer {CRON_SECRET}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    try:
+        handled = mailer.drain(limit=int(os.getenv('EMAIL_DRAIN_LIMIT', 100)))
+        return jsonify({'message': 'Email outbox drained', 'handled': handled}), 200
+    except Error as e:
+        logger.exception('Email outbox drain error')
+        return jsonify({'error': str(e)}), 500
+
+@app.cli.command('drain-email-outbox')
+@click.option('--limit', default=1000, help='Most messages to deliver.')
+def drain_email_outbox_command(limit):
+    """Deliver queued emails that are due, for when no worker is running."""
+    print(f'Handled {mailer.drain(limit)} queued email(s)')
+
+@app.cli.command('expire-subscriptions')
+def expire_subscriptions_command():
+    """Downgrade every user whose paid subscription has lapsed."""
+    with db_pool.connection() as conn:
+        expired = expire_subscriptions(conn)
+    print(f'Downgraded {expired} expired subscription(s)')
+
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True, help='List pending migrations without applying them.')
+def migrate_command(status):
+    """Apply pending database schema migrations."""
+    with db_pool.connection() as conn:
+        if status:
+            print(f'Schema version {migrations.current_version(conn)} of {migrations.latest_version()}')
+            for version, description in migrations.pending_migrations(conn):
+                print(f'  pending {version}: {description}')
+            return
+        applied = migrations.migrate(conn)
+    print(f'Applied {len(applied)} migration(s), schema is at version {migrations.latest_version()}')
+
+@app.cli.command('train-content-dictionary')
+@click.option('--sample', default=2000, help='Number of recent templates to learn from.')
+def train_content_dictionary_command(sample):
+    """Train a compression dictionary on recent templates for new writes."""
+    with db_pool.connection() as conn:
+        codec = ContentCodec(lambda: conn)
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT content, content_z FROM templates ORDER BY id DESC LIMIT %s", (sample,))
+        documents = [codec.decode_row(row)['content'] for row in cursor.fetchall()]
+        cursor.close()
+        dictionary = train_dictionary(documents)
+        if not dictionary:
+            print('Not enough shared text to train a dictionary')
+            return
+        dictionary_id = store_dictionary(conn, dictionary)
+    print(f'Stored dictionary {dictionary_id} ({len(dictionary)} bytes from {len(documents)} templates)')
+
+@app.cli.command('backfill-template-content')
+@click.option('--batch-size', default=500, help='Rows compressed per transaction.')
+def backfill_template_content_command(batch_size):
+    """Compress templates still stored as plain text."""
+    with db_pool.connection() as conn:
+        converted = backfill(conn, ContentCodec(lambda: conn), batch_size)
+    print(f'Compressed {converted} template(s)')
+
+def metrics_denied():
+    """The response for a diagnostics request without METRICS_SECRET, or None."""
+    if not METRICS_SECRET:
+        return jsonify({'error': 'Not found'}), 404
+    if request.headers.get('Authorization') != f'Bearer {METRICS_SECRET}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return None
+
+@app.route('/api/_stats', methods=['GET'])
+def get_runtime_stats():
+    denied = metrics_denied()
+    if denied:
+        return denied
+    return jsonify({
+        'db_pool': db_pool.metrics(),
+        'db_replicas': db_replicas.metrics() if db_replicas else None,
+        'daily_generations': daily_generations.stats(),
+        'subscriptions': subscription_cache.stats(),
+        'email': mailer.stats(),
+        'passwords': password_hasher.stats(),
+        'rate_limits': rate_limiter.stats(),
+        'logging': {'dropped': log_handler.dropped}
+    }), 200
+
+@app.route('/api/_metrics', methods=['GET'])
+def get_metrics():
+    denied = metrics_denied()
+    if denied:
+        return denied
+    gauges = {
+        f'legallyup_db_pool_{name}': (f'Connection pool {name.replace("_", " ")}.', value)
+        for name, value in db_pool.metrics().items()
+    }
+    for name, value in mailer.stats().items():
+        gauges[f'legallyup_email_dispatcher_{name}'] = (f'Email dispatcher {name}.', value)
+    gauges['legallyup_log_records_dropped'] = ('Log records dropped because the log queue was full.', log_handler.dropped)
+    return request_metrics.render(gauges), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 if __name__ == "__main__":
     # For local development only
     app.run(host="0.0.0.0", port=5000, debug=True) 
\ No newline at end of file
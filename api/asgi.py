@@ -0,0 +1,414 @@
+"""
+ASGI entry point for the LegallyUp API: the same routes served from an event loop.
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app --app-dir api --port 8000
+
+The read routes in ASYNC_ROUTES mostly wait on MySQL, so here they run as
+coroutines on an aiomysql pool: one process keeps ASYNC_DB_POOL_SIZE of them
+in flight instead of one per thread. Each runs inside a Flask request
+context pushed on its own task, so the app's before/after request hooks
+(CORS, tokens, metrics, logs, compression) and helpers (caller_user_id,
+not_modified, jsonify) behave exactly as in the sync app, and the SQL and
+response bodies are the ones app.py uses. The aiomysql pool connects to the
+primary only: DB_REPLICAS serve the threaded routes, so the async reads
+always see the latest writes and never need read-your-writes pinning.
+
+Every other request goes to the Flask app on a pool of WSGI_WORKERS threads,
+as do those routes when they need something that is only synchronous:
+unpaged template lists (streamed from a server-side cursor) and endpoints
+with rate limits configured. Email needs nothing here; routes only queue
+messages and the dispatcher's threads deliver them.
+"""
+import asyncio
+import io
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiomysql
+from aiomysql import Error
+from flask import jsonify, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Request
+
+import app as api
+from caches import utc_timestamp
+from content_store import DICTIONARY_SQL
+from tokens import NEW_REVOCATIONS_SQL, current_caller
+
+logger = logging.getLogger(__name__)
+
+flask_app = api.app
+
+
+class AsyncDatabase:
+    """aiomysql pool for the async routes; reads only, so autocommit is on."""
+
+    def __init__(self, config, size=10, max_idle=300, metrics=None):
+        self.config = config
+        self.size = size
+        self.max_idle = max_idle
+        self.metrics = metrics
+        self.pool = None
+
+    async def start(self):
+        self.pool = await aiomysql.create_pool(
+            host=self.config['host'], port=self.config['port'], user=self.config['user'],
+            password=self.config['password'], db=self.config['database'],
+            minsize=0, maxsize=self.size, pool_recycle=self.max_idle, autocommit=True
+        )
+
+    async def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            await self.pool.wait_closed()
+
+    async def fetchall(self, sql, params):
+        started = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(sql, params)
+                rows = await cursor.fetchall()
+        if self.metrics is not None:
+            self.metrics.record_query(time.perf_counter() - started)
+        return rows
+
+    async def fetchone(self, sql, params):
+        rows = await self.fetchall(sql, params)
+        return rows[0] if rows else None
+
+
+db = AsyncDatabase(
+    api.DB_CONFIG,
+    size=int(os.getenv('ASYNC_DB_POOL_SIZE', 20)),
+    max_idle=int(os.getenv('DB_POOL_MAX_IDLE', 300)),
+    metrics=api.request_metrics
+)
+
+
+async def subscription_status(user_id):
+    """api.subscription_status: from the token, the cache, else two async queries."""
+    caller = current_caller()
+    if caller is not None and caller.is_user(user_id):
+        return caller.subscription()
+    cached = api.subscription_cache.get(user_id)
+    if cached is not None:
+        return cached
+    try:
+        user = await db.fetchone(api.USER_PLAN_SQL, (user_id,))
+        latest_payment = None
+        if user and user['plan'] != 'free':
+            latest_payment = await db.fetchone(api.LATEST_PAID_PAYMENT_SQL, (user_id,))
+    except Error:
+        logger.exception('Subscription check error')
+        return False, 'free', None
+    status = api.subscription_from(user, latest_payment)
+    is_paid, plan_type, expiry_date = status
+    if plan_type is not None:
+        api.subscription_cache.set(
+            user_id, status, expires_at=utc_timestamp(expiry_date) if expiry_date else None
+        )
+    return status
+
+
+async def check_daily_limit():
+    user_id = api.caller_user_id(request.args.get('user_id'))
+
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+
+    try:
+        is_paid, plan_type, _ = await subscription_status(user_id)
+
+        if plan_type is None:
+            return jsonify({'error': 'User not found'}), 404
+
+        if is_paid:
+            return jsonify(api.daily_limit_body(True, 0)), 200
+
+        async def load_generations_today():
+            row = await db.fetchone(api.GENERATIONS_TODAY_SQL, (user_id, *api.utc_day_bounds()))
+            return row['count']
+
+        generations_today = await api.daily_generations.get_async(user_id, load_generations_today)
+        return jsonify(api.daily_limit_body(False, generations_today)), 200
+
+    except Error as e:
+        logger.exception('Check daily limit error')
+        return jsonify({'error': str(e)}), 500
+
+
+async def get_subscription_status():
+    user_id = api.caller_user_id(request.args.get('user_id'))
+
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+
+    return jsonify(api.subscription_status_body(await subscription_status(user_id))), 200
+
+
+async def get_payment_history():
+    user_id = api.caller_user_id(request.args.get('user_id'))
+
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+
+    try:
+        payments = await db.fetchall(api.PAYMENT_HISTORY_SQL, (user_id,))
+        return jsonify({'payments': payments}), 200
+    except Error as e:
+        logger.exception('Payment history error')
+        return jsonify({'error': str(e)}), 500
+
+
+async def list_templates(trashed, error_label):
+    """The paged form of api.list_templates."""
+    user_id = api.caller_user_id(request.args.get('user_id'))
+    if not user_id:
+        return jsonify({'error': 'Missing user_id'}), 400
+    try:
+        listing = api.template_list_query(request.args, user_id, trashed)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        version = await db.fetchone(api.TEMPLATE_LIST_VERSION_SQL, (user_id, trashed))
+        etag = api.template_list_etag(user_id, trashed, version, request.query_string.decode())
+        cached = api.not_modified(etag)
+        if cached:
+            return cached
+        rows = await db.fetchall(listing['sql'], listing['params'])
+        await load_dictionaries(rows)
+        templates = [api.present_template(row, listing) for row in rows]
+    except Error as e:
+        logger.exception(error_label)
+        return jsonify({'error': str(e)}), 500
+
+    return api.with_etag(jsonify(api.template_page(templates, listing['limit'])), etag)
+
+
+async def load_dictionaries(rows):
+    """Read the compression dictionaries rows need, so decoding them does not query."""
+    for dictionary_id in api.content_codec.missing_dictionaries(rows):
+        row = await db.fetchone(DICTIONARY_SQL, (dictionary_id,))
+        if row is not None:
+            api.content_codec.add_dictionary(dictionary_id, row['dictionary'])
+
+
+def paginated(args):
+    return 'limit' in args or 'cursor' in args
+
+
+# endpoint: (coroutine function, test of the query args for running it here)
+ASYNC_ROUTES = {
+    'check_daily_limit': (check_daily_limit, None),
+    'get_subscription_status': (get_subscription_status, None),
+    'get_payment_history': (get_payment_history, None),
+    'get_templates': (lambda: list_templates(False, 'Get templates error'), paginated),
+    'get_trashed_templates': (lambda: list_templates(True, 'Get trashed templates error'), paginated),
+}
+
+
+async def refresh_revocations():
+    """
+    Run a due token revocation refresh on the async pool, so the token hook
+    finds the list current and does not query through the sync pool.
+    """
+    params = api.token_revocations.start_refresh()
+    if params is None:
+        return
+    try:
+        rows = await db.fetchall(NEW_REVOCATIONS_SQL, params)
+    except Error:
+        logger.exception('Token revocation refresh error')
+        return
+    api.token_revocations.load(rows)
+
+
+def async_handler(environ):
+    """The coroutine function serving this request, or None to hand it to Flask."""
+    if environ['REQUEST_METHOD'] != 'GET':
+        return None
+    try:
+        endpoint, _ = flask_app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return None
+    if endpoint not in ASYNC_ROUTES or api.rate_limiter.limits.get(endpoint):
+        return None
+    handler, accepts = ASYNC_ROUTES[endpoint]
+    if accepts is not None and not accepts(Request(environ).args):
+        return None
+    return handler
+
+
+async def serve_async(handler, environ, send):
+    """
+    Run handler like Flask's full_dispatch_request, in a request context of
+    its own: flask's context variables are per task, so concurrent requests
+    on the loop do not see each other's request or g.
+    """
+    ctx = flask_app.request_context(environ)
+    ctx.push()
+    error = None
+    try:
+        try:
+            if 'HTTP_AUTHORIZATION' in environ:
+                await refresh_revocations()
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                rv = await handler()
+        except HTTPException as e:
+            rv = e.get_response()
+        response = flask_app.process_response(flask_app.make_response(rv))
+    except Exception as e:
+        error = e
+        logger.exception('Unhandled error in async route')
+        response = flask_app.make_response((jsonify({'error': 'Internal server error'}), 500))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': encode_headers(response.headers.items()),
+        })
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+    finally:
+        ctx.pop(error)
+
+
+class WSGIBridge:
+    """Runs the Flask app on a bounded thread pool, streaming its response back to the loop."""
+
+    def __init__(self, wsgi_app, workers):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wsgi')
+
+    async def __call__(self, environ, send):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self._run, environ, send, loop)
+
+    def _run(self, environ, send, loop):
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [int(status.split(' ', 1)[0]), encode_headers(headers)]
+
+        def start():
+            emit({'type': 'http.response.start', 'status': started[0], 'headers': started[1]})
+
+        result = self.wsgi_app(environ, start_response)
+        try:
+            sent = False
+            for chunk in result:
+                if not chunk:
+                    continue
+                if not sent:
+                    start()
+                    sent = True
+                emit({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not sent:
+                start()
+            emit({'type': 'http.response.body', 'body': b''})
+        finally:
+            # Ends the request context, returning its pooled connection
+            if hasattr(result, 'close'):
+                result.close()
+
+
+def build_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client')
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': '',
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0] if client else '',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        key = name if name in ('CONTENT_TYPE', 'CONTENT_LENGTH') else 'HTTP_' + name
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    # The body is already read in full, chunked or not
+    environ['CONTENT_LENGTH'] = str(len(body))
+    return environ
+
+
+def encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+
+
+async def read_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+
+class AsyncApp:
+    """The ASGI application: async routes on the loop, everything else through Flask."""
+
+    def __init__(self, database, bridge):
+        self.db = database
+        self.bridge = bridge
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+        body = await read_body(receive)
+        if body is None:
+            return
+        environ = build_environ(scope, body)
+        handler = async_handler(environ)
+        if handler is None:
+            await self.bridge(environ, send)
+        else:
+            # A task of its own, so the request context is not shared
+            await asyncio.create_task(serve_async(handler, environ, send))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.db.start()
+                    # Migrations and the schema check stay synchronous; done
+                    # here so no request on the loop has to wait for them
+                    await asyncio.get_running_loop().run_in_executor(
+                        self.bridge.executor, flask_app.extensions['schema_check']
+                    )
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.db.close()
+                self.bridge.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+app = AsyncApp(db, WSGIBridge(flask_app, workers=int(os.getenv('WSGI_WORKERS', 8))))
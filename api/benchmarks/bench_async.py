@@ -0,0 +1,117 @@
+"""
+Throughput and latency of the sync (WSGI) and async (asgi.py) servers side by side.
+
+Seeds the database configured by DB_HOST/DB_PORT/DB_USER/DB_PASSWORD/DB_NAME
+with loadtest.py's data set, then for each --concurrency level opens that
+many keep-alive connections to each server and sends the routes asgi.py
+serves on the event loop (daily limit, subscription status, payment history
+and a page of templates) for --seconds seconds. Start both servers against
+the same throwaway database first, e.g.
+
+    cd api
+    flask --app app run --port 5000 &
+    uvicorn asgi:app --port 8000 &
+    DB_HOST=127.0.0.1 DB_PORT=3306 DB_PASSWORD=root DB_NAME=legallyup \\
+        python benchmarks/bench_async.py --sync-url http://127.0.0.1:5000 --async-url http://127.0.0.1:8000
+
+The gap grows with database latency: put the database on another host, or
+add delay with tc/toxiproxy, to see what a remote MySQL does to each mode.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+from urllib.parse import urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from loadtest import seed  # noqa: E402
+
+PATHS = (
+    '/api/documents/check-daily-limit?user_id={id}',
+    '/api/payments/subscription-status?user_id={id}',
+    '/api/payments/history?user_id={id}',
+    '/api/templates?user_id={id}&limit=20',
+)
+
+
+async def fetch(reader, writer, host, path):
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nAccept-Encoding: gzip\r\n\r\n'.encode())
+    await writer.drain()
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {name.lower(): value.strip() for name, _, value in (line.partition(':') for line in lines[1:] if line)}
+    if headers.get('transfer-encoding') == 'chunked':
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.readexactly(int(headers.get('content-length', 0)))
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+async def client(url, users, stop_at, latencies, errors, rng):
+    parts = urlsplit(url)
+    loop = asyncio.get_running_loop()
+    writer = None
+    try:
+        while loop.time() < stop_at:
+            path = rng.choice(PATHS).format(id=rng.choice(users)['id'])
+            started = loop.time()
+            if writer is None:
+                reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+            status, keep_alive = await fetch(reader, writer, parts.netloc, path)
+            if status != 200:
+                errors.append(status)
+            latencies.append(loop.time() - started)
+            if not keep_alive:
+                # Streamed responses end with the connection on some servers
+                writer.close()
+                writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def measure(url, users, concurrency, seconds):
+    latencies, errors = [], []
+    stop_at = asyncio.get_running_loop().time() + seconds
+    await asyncio.gather(*[
+        client(url, users, stop_at, latencies, errors, random.Random(n)) for n in range(concurrency)
+    ])
+    ms = sorted(value * 1000 for value in latencies)
+    cuts = statistics.quantiles(ms, n=100) if len(ms) > 1 else ms * 99
+    return len(ms) / seconds, cuts[49], cuts[94], len(errors)
+
+
+async def run(args, users):
+    print(f"{'mode':<6} {'clients':>7} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'non-200':>8}")
+    for concurrency in (int(value) for value in args.concurrency.split(',')):
+        for mode, url in (('sync', args.sync_url), ('async', args.async_url)):
+            # Warm connections, caches and pools before measuring
+            await measure(url, users, concurrency, min(1.0, args.seconds))
+            rps, p50, p95, errors = await measure(url, users, concurrency, args.seconds)
+            print(f'{mode:<6} {concurrency:>7} {rps:>9.1f} {p50:>8.2f} {p95:>8.2f} {errors:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sync-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--async-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', default='1,10,50,200', help='comma-separated connection counts')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--templates-per-user', type=int, default=20)
+    args = parser.parse_args()
+
+    users = seed(args.users, args.templates_per_user, paid_ratio=0.3, logs_per_user=10, reseed=False)
+    asyncio.run(run(args, users))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+Cold-start cost of importing api/app.py and serving the first request.
+
+Each run is a fresh interpreter, like a new serverless instance. The
+import is timed on its own (it no longer touches the database), then the
+first request is timed, which is where the one-off schema version check
+happens unless SCHEMA_CHECK=off. Pass --init-db to also time applying every
+migration on each run, which approximates the old import-time init_db().
+Uses the database configured by DB_HOST/DB_PORT/DB_USER/DB_PASSWORD/DB_NAME;
+use a throwaway local MySQL (see bench_db_pool.py).
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints its timings as JSON
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app as api
+imported = time.perf_counter()
+if {init_db}:
+    import migrations
+    with api.db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DROP TABLE IF EXISTS schema_version")
+        conn.commit()
+        cursor.close()
+        migrations.migrate(conn)
+migrated = time.perf_counter()
+api.app.test_client().get('/api/_stats')
+served = time.perf_counter()
+print(json.dumps({{
+    'import': imported - started,
+    'init_db': migrated - imported,
+    'first_request': served - migrated,
+}}))
+"""
+
+
+def run_once(init_db, schema_check):
+    env = dict(os.environ, SCHEMA_CHECK=schema_check, EMAIL_TRANSPORT='memory')
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE.format(init_db=init_db)],
+        cwd=API_DIR, env=env, check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--schema-check', default='warn', choices=['migrate', 'warn', 'off'])
+    parser.add_argument('--init-db', action='store_true', help='re-apply every migration on each run')
+    args = parser.parse_args()
+
+    samples = [run_once(args.init_db, args.schema_check) for _ in range(args.runs)]
+    for phase in ('import', 'init_db', 'first_request'):
+        values = [sample[phase] * 1000 for sample in samples]
+        print(
+            f'{phase:<14} median={statistics.median(values):8.1f}ms '
+            f'min={min(values):8.1f}ms max={max(values):8.1f}ms'
+        )
+
+
+if __name__ == '__main__':
+    main()
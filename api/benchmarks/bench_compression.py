@@ -0,0 +1,86 @@
+"""
+Size and cost of compressing and streaming a large template list.
+
+Builds a {"templates": [...]} payload shaped like GET /api/templates (no
+paging) and compares, per encoding, the bytes sent and the time to compress
+them. Then compares the peak memory of serializing the list with jsonify
+against streaming it row by row with compression.stream_json. Brotli is
+measured only if the brotli package is installed.
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify  # noqa: E402
+
+from compression import brotli, stream_json  # noqa: E402
+
+CONTENT = 'This agreement is made between the parties named below. ' * 30
+
+
+def make_rows(count):
+    now = datetime.utcnow()
+    for n in range(count):
+        yield {
+            'id': n + 1, 'user_id': 1, 'title': f'Template {n}', 'content': CONTENT,
+            'is_trashed': False, 'created_at': now - timedelta(hours=n), 'updated_at': now,
+        }
+
+
+def timed(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def peak_memory(func):
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--level', type=int, default=6)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    with app.test_request_context():
+        body = jsonify({'templates': list(make_rows(args.rows))}).get_data()
+        encoders = {
+            'identity': lambda: body,
+            'gzip': lambda: gzip.compress(body, compresslevel=args.level, mtime=0),
+        }
+        if brotli is not None:
+            encoders['br'] = lambda: brotli.compress(body, quality=args.level)
+        print(f'{args.rows} templates, level {args.level}')
+        for name, encode in encoders.items():
+            data, seconds = timed(encode)
+            print(f'{name:<10} {len(data):>10} bytes {len(data) / len(body):>7.1%} {seconds * 1000:>8.2f} ms')
+
+        def buffered():
+            jsonify({'templates': list(make_rows(args.rows))}).get_data()
+
+        def streamed():
+            for _ in stream_json('templates', make_rows(args.rows)).response:
+                pass
+
+        for name, serialize in (('jsonify', buffered), ('stream_json', streamed)):
+            print(f'{name:<12} peak {peak_memory(serialize) / 1024:>10.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""
+Storage size and read/write latency of plain vs compressed template content.
+
+Generates --documents legal-style documents from shared boilerplate clauses
+plus per-document details, and writes each one to the database configured
+by DB_HOST/DB_PORT/DB_USER/DB_PASSWORD/DB_NAME three ways: as plain text
+(the old layout), compressed without a dictionary, and compressed with a
+dictionary trained on the other half of the corpus (kept in memory, not in
+content_dictionaries). Reports bytes stored and per-row insert and read
+latency, reads including decompression. Use a throwaway local MySQL (see
+bench_db_pool.py); the rows are deleted afterwards.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as api  # noqa: E402
+import migrations  # noqa: E402
+from content_store import compress, decompress, train_dictionary  # noqa: E402
+from search import index_terms  # noqa: E402
+
+BENCH_EMAIL = 'bench-content@example.com'
+CLAUSES = [
+    'This Agreement is entered into by and between the parties identified in the signature block below.',
+    'The Receiving Party shall hold and maintain the Confidential Information in strictest confidence.',
+    'This Agreement shall be governed by and construed in accordance with the laws of the State of {state}.',
+    'Any dispute arising out of or relating to this Agreement shall be resolved by binding arbitration.',
+    'Each party represents and warrants that it has full power and authority to enter into this Agreement.',
+    'All notices under this Agreement shall be in writing and delivered to the addresses set forth above.',
+    'The Tenant shall pay monthly rent of ${amount} on or before the first day of each calendar month.',
+    'Either party may terminate this Agreement upon {days} days written notice to the other party.',
+    'Neither party shall be liable for any failure to perform caused by circumstances beyond its control.',
+    'This Agreement constitutes the entire agreement between the parties and supersedes all prior agreements.',
+    'The Employee shall not, during the term of employment and for {days} days thereafter, solicit clients.',
+    'The Contractor shall deliver the services described in Schedule A no later than {date}.',
+]
+STATES = ['Delaware', 'California', 'New York', 'Texas', 'Karnataka', 'Maharashtra']
+
+
+def make_document(rng):
+    clauses = rng.sample(CLAUSES, rng.randint(6, len(CLAUSES)))
+    paragraphs = [
+        clause.format(state=rng.choice(STATES), amount=rng.randint(500, 5000), days=rng.choice([15, 30, 60, 90]),
+                      date=f'2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}')
+        for clause in clauses for _ in range(rng.randint(1, 3))
+    ]
+    paragraphs.insert(0, f'Agreement reference {rng.randint(10000, 99999)} prepared for client {rng.randint(1, 999)}.')
+    return '\n\n'.join(paragraphs)
+
+
+def seed_user(cursor):
+    cursor.execute("SELECT id FROM users WHERE email = %s", (BENCH_EMAIL,))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    cursor.execute(
+        "INSERT INTO users (username, email, password, verified) VALUES (%s, %s, %s, TRUE)",
+        ('bench-content', BENCH_EMAIL, 'bench')
+    )
+    return cursor.lastrowid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--documents', type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    corpus = [make_document(rng) for _ in range(args.documents * 2)]
+    training, documents = corpus[:args.documents], corpus[args.documents:]
+
+    with api.db_pool.connection() as conn:
+        migrations.migrate(conn)
+        cursor = conn.cursor()
+        user_id = seed_user(cursor)
+        conn.commit()
+        trained = train_dictionary(training)
+        layouts = {
+            'plain text': None,
+            'zlib': None,
+            'zlib + dictionary': trained,
+        }
+        print(f'{len(documents)} documents, {sum(map(len, documents)) / len(documents):.0f} characters on average, '
+              f'dictionary {len(trained)} bytes')
+        print(f"{'layout':<20} {'bytes':>10} {'ratio':>7} {'insert ms':>10} {'read ms':>8}")
+        baseline = None
+        for name, dictionary in layouts.items():
+            compressed = name != 'plain text'
+            writes, ids = [], []
+            for text in documents:
+                started = time.perf_counter()
+                if not compressed:
+                    cursor.execute(
+                        "INSERT INTO templates (user_id, title, content) VALUES (%s, %s, %s)",
+                        (user_id, 'Bench', text)
+                    )
+                else:
+                    cursor.execute(
+                        "INSERT INTO templates (user_id, title, content, content_z, search_terms) "
+                        "VALUES (%s, %s, '', %s, %s)",
+                        (user_id, 'Bench', compress(text, 1, dictionary), index_terms(text))
+                    )
+                conn.commit()
+                writes.append(time.perf_counter() - started)
+                ids.append(cursor.lastrowid)
+
+            reads = []
+            read_cursor = conn.cursor(dictionary=True)
+            for template_id in ids:
+                started = time.perf_counter()
+                read_cursor.execute("SELECT content, content_z FROM templates WHERE id = %s", (template_id,))
+                row = read_cursor.fetchone()
+                text = decompress(row['content_z'], dictionary) if compressed else row['content']
+                reads.append(time.perf_counter() - started)
+                assert text == documents[len(reads) - 1]
+            read_cursor.close()
+            conn.rollback()
+
+            cursor.execute(
+                "SELECT SUM(LENGTH(content)) + COALESCE(SUM(LENGTH(content_z)), 0) FROM templates "
+                "WHERE user_id = %s",
+                (user_id,)
+            )
+            stored = int(cursor.fetchone()[0])
+            baseline = baseline or stored
+            print(f'{name:<20} {stored:>10} {stored / baseline:>7.1%} {statistics.median(writes) * 1000:>10.3f} '
+                  f'{statistics.median(reads) * 1000:>8.3f}')
+            cursor.execute("DELETE FROM templates WHERE user_id = %s", (user_id,))
+            conn.commit()
+        cursor.close()
+
+
+if __name__ == '__main__':
+    main()
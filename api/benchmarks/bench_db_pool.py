@@ -0,0 +1,83 @@
+"""
+Connections opened per request with and without the connection pool.
+
+Runs the read-heavy dashboard routes through Flask's test client against the
+database configured by DB_HOST/DB_PORT/DB_USER/DB_PASSWORD/DB_NAME. Use a
+throwaway local MySQL, never production:
+
+    docker run --rm -d -p 3306:3306 -e MYSQL_ROOT_PASSWORD=root -e MYSQL_DATABASE=legallyup mysql:8
+    cd api
+    DB_HOST=127.0.0.1 DB_PORT=3306 DB_PASSWORD=root DB_NAME=legallyup flask --app app migrate
+    DB_HOST=127.0.0.1 DB_PORT=3306 DB_PASSWORD=root DB_NAME=legallyup python benchmarks/bench_db_pool.py
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as api  # noqa: E402
+from db import ConnectionPool  # noqa: E402
+
+BENCH_EMAIL = 'bench-pool@example.com'
+
+
+def seed_user():
+    with api.db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM users WHERE email = %s", (BENCH_EMAIL,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute(
+                "INSERT INTO users (username, email, password, verified) VALUES (%s, %s, %s, TRUE)",
+                ('bench', BENCH_EMAIL, 'bench'),
+            )
+            conn.commit()
+            row = (cursor.lastrowid,)
+        cursor.close()
+        return row[0]
+
+
+def run(label, pool, user_id, requests):
+    api.app.extensions['db_pool'] = pool
+    client = api.app.test_client()
+    paths = [
+        f'/api/templates?user_id={user_id}',
+        f'/api/templates/trash?user_id={user_id}',
+        f'/api/documents/check-daily-limit?user_id={user_id}',
+        f'/api/payments/subscription-status?user_id={user_id}',
+        f'/api/payments/history?user_id={user_id}',
+    ]
+    latencies = []
+    for i in range(requests):
+        started = time.perf_counter()
+        response = client.get(paths[i % len(paths)])
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.get_data(as_text=True)
+    metrics = pool.metrics()
+    pool.close_all()
+    latencies.sort()
+    print(
+        f'{label:<10} requests={requests} '
+        f'connections_opened={metrics["connections_opened"]} '
+        f'per_request={metrics["connections_opened"] / requests:.3f} '
+        f'p50={statistics.median(latencies):.1f}ms '
+        f'p95={latencies[int(len(latencies) * 0.95) - 1]:.1f}ms'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--pool-size', type=int, default=5)
+    args = parser.parse_args()
+
+    user_id = seed_user()
+    run('unpooled', ConnectionPool(api.DB_CONFIG, size=0), user_id, args.requests)
+    run('pooled', ConnectionPool(api.DB_CONFIG, size=args.pool_size), user_id, args.requests)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Per-message cost of rendering the OTP email.
+
+Compares the precompiled templates in email_templates.py (HTML plus the
+plain-text alternative) with the previous approach of rebuilding the styles
+and the whole HTML f-string for every message.
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from email_templates import render_email  # noqa: E402
+
+
+def legacy_render(otp, expiry_minutes):
+    # The body send_otp_email used to build on every call
+    styles = """
+        .container { font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto;
+            padding: 20px; background-color: #f9f9f9; border-radius: 10px; }
+        .header { text-align: center; padding: 20px 0; border-bottom: 2px solid #eee; }
+        .content { padding: 30px 0; text-align: center; }
+        .otp-code { font-size: 32px; font-weight: bold; color: #2563eb; letter-spacing: 5px;
+            padding: 20px; background-color: #ffffff; border-radius: 5px; margin: 20px 0;
+            display: inline-block; }
+        .footer { text-align: center; color: #666; font-size: 14px; padding-top: 20px;
+            border-top: 1px solid #eee; }
+    """
+    return f"""
+        <html>
+        <head>
+            <style>{styles}</style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="header">
+                    <h1>Welcome to LegallyUp!</h1>
+                </div>
+                <div class="content">
+                    <p>Thank you for registering with LegallyUp. To complete your registration, please use the following OTP code:</p>
+                    <div class="otp-code">{otp}</div>
+                    <p>This code will expire in {expiry_minutes} minutes.</p>
+                </div>
+                <div class="footer">
+                    <p>If you didn't request this registration, please ignore this email.</p>
+                    <p>© {datetime.now().year} LegallyUp. All rights reserved.</p>
+                </div>
+            </div>
+        </body>
+        </html>
+    """
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--number', type=int, default=100_000)
+    args = parser.parse_args()
+
+    cases = {
+        'legacy f-string (html only)': lambda: legacy_render('123456', 10),
+        'precompiled (html + text)': lambda: render_email('register_otp', otp='123456', expiry_minutes=10),
+    }
+    for label, render in cases.items():
+        render()
+        seconds = min(timeit.repeat(render, number=args.number, repeat=3))
+        print(f'{label:<28} {seconds / args.number * 1e6:.2f} us/message')
+
+
+if __name__ == '__main__':
+    main()
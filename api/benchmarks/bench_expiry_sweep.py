@@ -0,0 +1,93 @@
+"""
+Time the batch subscription expiry sweep on a seeded database.
+
+Seeds --users users (a third on paid plans with lapsed payments, a third on
+paid plans with current payments, the rest free), then times
+expire_subscriptions(). Runs against the database configured by DB_HOST/
+DB_PORT/DB_USER/DB_PASSWORD/DB_NAME; use a throwaway local MySQL (see
+bench_db_pool.py). Seeded rows are tagged by email and removed with --cleanup.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as api  # noqa: E402
+from subscriptions import expire_subscriptions  # noqa: E402
+
+EMAIL_DOMAIN = '@bench-sweep.example.com'
+BATCH = 5000
+
+
+def cleanup(conn):
+    cursor = conn.cursor()
+    seeded = "SELECT id FROM users WHERE email LIKE %s"
+    pattern = ('%' + EMAIL_DOMAIN,)
+    cursor.execute(f"DELETE FROM plan_changes WHERE user_id IN ({seeded})", pattern)
+    cursor.execute(f"DELETE FROM payments WHERE user_id IN ({seeded})", pattern)
+    cursor.execute("DELETE FROM users WHERE email LIKE %s", pattern)
+    conn.commit()
+    cursor.close()
+
+
+def seed(conn, users):
+    cursor = conn.cursor()
+    now = datetime.utcnow()
+    lapsed = now - timedelta(days=45)
+    current = now - timedelta(days=5)
+    for start in range(0, users, BATCH):
+        rows = []
+        for i in range(start, min(start + BATCH, users)):
+            plan = ('pro', 'attorney', 'free')[i % 3]
+            rows.append((f'bench{i}', f'user{i}{EMAIL_DOMAIN}', 'bench', plan))
+        cursor.executemany(
+            "INSERT INTO users (username, email, password, verified, plan) VALUES (%s, %s, %s, TRUE, %s)",
+            rows,
+        )
+        conn.commit()
+
+    cursor.execute("SELECT id, plan FROM users WHERE email LIKE %s AND plan != 'free'", ('%' + EMAIL_DOMAIN,))
+    paid = cursor.fetchall()
+    for start in range(0, len(paid), BATCH):
+        rows = []
+        for user_id, plan in paid[start:start + BATCH]:
+            paid_at = lapsed if user_id % 2 else current
+            rows.append((user_id, plan, paid_at, 29.99, 'success', f'BENCH-{user_id}'))
+        cursor.executemany(
+            "INSERT INTO payments (user_id, plan, payment_date, amount, status, transaction_id) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            rows,
+        )
+        conn.commit()
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--cleanup', action='store_true', help='remove seeded rows afterwards')
+    args = parser.parse_args()
+
+    with api.db_pool.connection() as conn:
+        cleanup(conn)
+        started = time.perf_counter()
+        seed(conn, args.users)
+        print(f'seeded {args.users} users in {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        expired = expire_subscriptions(conn)
+        print(f'sweep downgraded {expired} users in {(time.perf_counter() - started) * 1000:.0f}ms')
+
+        started = time.perf_counter()
+        expired = expire_subscriptions(conn)
+        print(f'idle sweep downgraded {expired} users in {(time.perf_counter() - started) * 1000:.0f}ms')
+
+        if args.cleanup:
+            cleanup(conn)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Parallel POST /api/templates for one free-plan user.
+
+Creates a fresh free user, fires --requests creates from --workers threads at
+once and reports latency plus any generations recorded beyond the daily
+limit. Runs against the database configured by DB_HOST/DB_PORT/DB_USER/
+DB_PASSWORD/DB_NAME; use a throwaway local MySQL (see bench_db_pool.py).
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as api  # noqa: E402
+
+
+def seed_free_user():
+    with api.db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO users (username, email, password, verified, plan) VALUES (%s, %s, %s, TRUE, 'free')",
+            ('bench', f'bench-gate-{uuid.uuid4().hex}@example.com', 'bench'),
+        )
+        conn.commit()
+        user_id = cursor.lastrowid
+        cursor.close()
+        return user_id
+
+
+def count_logged(user_id):
+    day_start, day_end = api.utc_day_bounds()
+    with api.db_pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COUNT(*) FROM document_generation_logs WHERE user_id = %s AND generated_at >= %s AND generated_at < %s",
+            (user_id, day_start, day_end),
+        )
+        logged = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM templates WHERE user_id = %s", (user_id,))
+        templates = cursor.fetchone()[0]
+        cursor.close()
+        return logged, templates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+
+    api.db_pool.size = max(api.db_pool.size, args.workers)
+    user_id = seed_free_user()
+    start = threading.Barrier(args.workers)
+
+    def create(i):
+        client = api.app.test_client()
+        if i < args.workers:
+            start.wait()
+        started = time.perf_counter()
+        response = client.post('/api/templates', json={
+            'user_id': user_id,
+            'title': f'Bench template {i}',
+            'content': 'Lorem ipsum dolor sit amet. ' * 40,
+        })
+        return response.status_code, (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(create, range(args.requests)))
+
+    latencies = sorted(ms for _, ms in results)
+    created = sum(1 for status, _ in results if status == 201)
+    rejected = sum(1 for status, _ in results if status == 403)
+    errors = len(results) - created - rejected
+    logged, templates = count_logged(user_id)
+    violations = max(0, max(created, logged) - api.FREE_DAILY_LIMIT)
+
+    print(
+        f'requests={args.requests} workers={args.workers} '
+        f'created={created} rejected={rejected} errors={errors} '
+        f'logged={logged} templates={templates} violations={violations}'
+    )
+    print(
+        f'p50={statistics.median(latencies):.1f}ms '
+        f'p95={latencies[int(len(latencies) * 0.95) - 1]:.1f}ms '
+        f'max={latencies[-1]:.1f}ms'
+    )
+    print(api.db_pool.metrics())
+
+
+if __name__ == '__main__':
+    main()
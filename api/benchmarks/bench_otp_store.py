@@ -0,0 +1,65 @@
+"""
+Set/get/evict throughput of the OTP store backends.
+
+The memory backend always runs. Pass --mysql to also measure the otp_codes
+table on the database configured by DB_HOST/DB_PORT/DB_USER/DB_PASSWORD/
+DB_NAME; use a throwaway local MySQL (see bench_db_pool.py).
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from otp_store import MemoryOTPStore, MySQLOTPStore  # noqa: E402
+
+
+def measure(label, store, keys):
+    emails = [f'user{i}@bench-otp.example.com' for i in range(keys)]
+    live = datetime.utcnow() + timedelta(minutes=10)
+
+    started = time.perf_counter()
+    for email in emails:
+        store.set(email, '123456', 'register', live)
+    set_rate = keys / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for email in emails:
+        assert store.get(email) is not None
+    get_rate = keys / (time.perf_counter() - started)
+
+    # Re-set every key to expire shortly, then purge them all in one go
+    soon = datetime.utcnow() + timedelta(seconds=2)
+    for email in emails:
+        store.set(email, '123456', 'register', soon)
+    time.sleep(max(0.0, (soon - datetime.utcnow()).total_seconds()) + 1)
+    started = time.perf_counter()
+    removed = store.purge_expired()
+    evict_rate = removed / (time.perf_counter() - started) if removed else 0.0
+
+    print(
+        f'{label:<7} keys={keys} set={set_rate:,.0f}/s get={get_rate:,.0f}/s '
+        f'evicted={removed} evict={evict_rate:,.0f}/s'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--keys', type=int, default=50_000)
+    parser.add_argument('--mysql', action='store_true', help='also benchmark the MySQL backend')
+    args = parser.parse_args()
+
+    measure('memory', MemoryOTPStore(max_entries=args.keys), args.keys)
+
+    if args.mysql:
+        import app as api
+
+        with api.db_pool.connection() as conn:
+            store = MySQLOTPStore(lambda: conn, purge_interval=float('inf'))
+            measure('mysql', store, min(args.keys, 5000))
+
+
+if __name__ == '__main__':
+    main()
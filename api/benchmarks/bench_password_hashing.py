@@ -0,0 +1,87 @@
+"""
+Login throughput and latency at different password hashing costs.
+
+For each --costs value (log2 of the scrypt N), --clients threads verify a
+password through a PasswordHasher with --workers workers for --seconds
+seconds, the part of POST /api/login that scales with the cost. Reports
+verifications per second and p50/p95 latency, plus how many attempts were
+turned away with 503 because the wait queue was full. Meanwhile one more
+thread does cheap in-process work in a loop, standing in for other routes:
+its p95 shows whether hashing starves them.
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from passwords import PasswordHasher, PasswordHasherBusy  # noqa: E402
+
+PASSWORD = 'correct horse battery staple'
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def measure(log_n, clients, workers, max_pending, seconds):
+    hasher = PasswordHasher(log_n=log_n, workers=workers, max_pending=max_pending)
+    stored = hasher.hash(PASSWORD)
+    latencies, rejected, other = [], [0], []
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + seconds
+
+    def client():
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                assert hasher.verify(PASSWORD, stored)
+            except PasswordHasherBusy:
+                with lock:
+                    rejected[0] += 1
+                time.sleep(0.01)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    def other_route():
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            sum(range(2000))
+            other.append(time.perf_counter() - started)
+            time.sleep(0.001)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)] + [threading.Thread(target=other_route)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(
+        f'{log_n:>4} {len(latencies) / seconds:>9.1f} {statistics.median(latencies) * 1000:>8.1f} '
+        f'{percentile(latencies, 0.95) * 1000:>8.1f} {rejected[0]:>8} {percentile(other, 0.95) * 1000:>10.3f}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--costs', default='12,13,14,15', help='comma-separated log2(N) values')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--max-pending', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    print(f'{args.clients} clients, {args.workers} workers, {os.cpu_count()} CPUs')
+    print(f"{'cost':>4} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'rejected':>8} {'other p95':>10}")
+    for log_n in (int(cost) for cost in args.costs.split(',')):
+        measure(log_n, args.clients, args.workers, args.max_pending, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
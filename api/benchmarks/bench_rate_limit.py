@@ -0,0 +1,57 @@
+"""
+Check throughput, per-key memory and eviction cost of the in-memory rate limiter.
+
+Spreads --checks hits over --keys buckets (a few hot keys hitting their
+limit, the rest idle after one or two requests, as with real client IPs),
+then measures the memory the buckets hold and how long purging them all
+takes once they have gone idle.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ratelimit import MemoryRateLimitStore  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--keys', type=int, default=100_000)
+    parser.add_argument('--checks', type=int, default=500_000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--window', type=int, default=60)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    hot = [f'login.ip:10.0.0.{n}' for n in range(10)]
+    buckets = [f'login.ip:192.168.{n // 256}.{n % 256}' for n in range(args.keys)]
+    sequence = [rng.choice(hot) if rng.random() < 0.2 else rng.choice(buckets) for _ in range(args.checks)]
+
+    tracemalloc.start()
+    store = MemoryRateLimitStore(max_keys=args.keys * 2, purge_interval=float('inf'))
+    started = time.perf_counter()
+    limited = 0
+    for bucket in sequence:
+        allowed, _ = store.hit(bucket, args.limit, args.window)
+        limited += not allowed
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{args.checks} checks over {len(store)} buckets: {args.checks / elapsed:,.0f} checks/s, '
+          f'{elapsed / args.checks * 1e6:.2f} us each, {limited} limited')
+    print(f'memory {size / 1024 / 1024:.1f} MB, {size / len(store):.0f} bytes per bucket')
+
+    # Every bucket has been idle for two windows
+    started = time.perf_counter()
+    with store._lock:
+        store._purge_locked(time.time() + 2 * args.window)
+    print(f'purge of {args.keys} idle buckets {(time.perf_counter() - started) * 1000:.1f} ms, {len(store)} left')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Storage and rebuild cost of template revision history.
+
+Simulates --edits successive edits to a document of --lines lines (a few
+lines inserted, removed or reworded per edit), records them the way
+revisions.record_revision does, and compares the bytes stored against
+keeping a full copy per revision. Then times rebuilding the newest, a
+middle and the oldest revision, which apply the most deltas.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from revisions import SNAPSHOT_INTERVAL, apply_delta, make_delta  # noqa: E402
+
+WORDS = 'the party shall pay notice within days of written agreement terms confidential'.split()
+
+
+def edit(rng, lines, changes):
+    for _ in range(changes):
+        roll = rng.random()
+        position = rng.randrange(len(lines))
+        sentence = ' '.join(rng.choices(WORDS, k=14)).capitalize() + '.\n'
+        if roll < 0.4:
+            lines.insert(position, sentence)
+        elif roll < 0.6 and len(lines) > 1:
+            lines.pop(position)
+        else:
+            lines[position] = sentence
+    return ''.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--lines', type=int, default=200)
+    parser.add_argument('--edits', type=int, default=50)
+    parser.add_argument('--changes', type=int, default=3, help='lines changed per edit')
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    lines = [' '.join(rng.choices(WORDS, k=14)).capitalize() + '.\n' for _ in range(args.lines)]
+    versions = [''.join(lines)]
+    for _ in range(args.edits):
+        versions.append(edit(rng, lines, args.changes))
+
+    # stored[n] is revision n + 1: a snapshot or a delta against the next version
+    stored = []
+    for n, (older, newer) in enumerate(zip(versions, versions[1:])):
+        delta = make_delta(newer, older)
+        if (n + 1) % SNAPSHOT_INTERVAL == 0 or len(delta) >= len(older):
+            stored.append(('snapshot', older))
+        else:
+            stored.append(('delta', delta))
+
+    def rebuild(revision):
+        index = revision - 1
+        end = next((i for i in range(index, len(stored)) if stored[i][0] == 'snapshot'), None)
+        content = versions[-1] if end is None else None
+        for kind, body in reversed(stored[index:len(stored) if end is None else end + 1]):
+            content = body if kind == 'snapshot' else apply_delta(content, body)
+        return content
+
+    full = sum(len(version) for version in versions[:-1])
+    kept = sum(len(body) for _, body in stored)
+    snapshots = sum(1 for kind, _ in stored if kind == 'snapshot')
+    print(f'{args.edits} revisions of a {len(versions[-1])}-character document, '
+          f'{snapshots} snapshot(s), interval {SNAPSHOT_INTERVAL}')
+    print(f'full copies   {full:>10} bytes')
+    print(f'deltas        {kept:>10} bytes  {kept / full:.1%}')
+    for revision in (len(stored), len(stored) // 2 or 1, 1):
+        assert rebuild(revision) == versions[revision - 1]
+        seconds = min(timeit.repeat(lambda: rebuild(revision), number=100, repeat=3)) / 100
+        print(f'rebuild revision {revision:<4} {seconds * 1000:>8.3f} ms')
+
+
+if __name__ == '__main__':
+    main()
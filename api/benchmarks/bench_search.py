@@ -0,0 +1,139 @@
+"""
+Template search latency on a large seeded library.
+
+Seeds --users users with --templates-per-user templates each (1M by
+default) of varied legal-sounding text into the database configured by
+DB_HOST/DB_PORT/DB_USER/DB_PASSWORD/DB_NAME, then times searches for
+common, rare, multi-word and prefix queries by random users through each
+search backend, next to the old approach of loading every template of the
+user and filtering in Python. Use a throwaway local MySQL (see
+bench_db_pool.py); seeding a million rows takes several minutes and is
+skipped on later runs unless --reseed is given:
+
+    cd api
+    DB_HOST=127.0.0.1 DB_PORT=3306 DB_PASSWORD=root DB_NAME=legallyup \\
+        python benchmarks/bench_search.py --queries 200
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as api  # noqa: E402
+import migrations  # noqa: E402
+from content_store import ContentCodec  # noqa: E402
+from search import MemoryTemplateSearch, MySQLTemplateSearch, search_terms  # noqa: E402
+
+EMAIL_DOMAIN = 'search-bench.example.com'
+# Roughly Zipf-distributed: early words are common, late ones rare
+VOCABULARY = (
+    'agreement party parties shall term terms payment notice confidential information services '
+    'company employee employer tenant landlord property rent deposit lease license liability '
+    'indemnify warranty breach termination governing jurisdiction arbitration dispute intellectual '
+    'ownership assignment severability amendment waiver counterparts force majeure subcontractor '
+    'invoice milestone deliverable escrow guarantor sublease easement covenant trademark royalty '
+    'noncompete nonsolicitation probation gratuity relocation sabbatical equity vesting cliff'
+).split()
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+QUERIES = {
+    'common': 'agreement',
+    'rare': 'sabbatical',
+    'two words': 'tenant deposit',
+    'prefix': 'confid',
+}
+
+
+def make_text(rng, words):
+    return ' '.join(rng.choices(VOCABULARY, WEIGHTS, k=words)).capitalize() + '.'
+
+
+def seed(users, templates_per_user, reseed):
+    rng = random.Random(42)
+    with api.db_pool.connection() as conn:
+        migrations.migrate(conn)
+        cursor = conn.cursor()
+        if reseed:
+            cursor.execute("DELETE FROM users WHERE email LIKE %s", (f'%@{EMAIL_DOMAIN}',))
+            conn.commit()
+        cursor.execute("SELECT COUNT(*) FROM users WHERE email LIKE %s", (f'%@{EMAIL_DOMAIN}',))
+        existing = cursor.fetchone()[0]
+        for start in range(existing, users, 100):
+            batch = range(start, min(users, start + 100))
+            cursor.executemany(
+                "INSERT INTO users (username, email, password, verified) VALUES (%s, %s, %s, TRUE)",
+                [(f'search{i}', f'user{i}@{EMAIL_DOMAIN}', 'x') for i in batch]
+            )
+            cursor.execute(
+                "SELECT id FROM users WHERE email LIKE %s ORDER BY id DESC LIMIT %s",
+                (f'%@{EMAIL_DOMAIN}', len(batch))
+            )
+            rows = [
+                (user_id, make_text(rng, 4), make_text(rng, rng.randint(200, 600)))
+                for (user_id,) in cursor.fetchall() for _ in range(templates_per_user)
+            ]
+            for i in range(0, len(rows), 1000):
+                cursor.executemany(
+                    "INSERT INTO templates (user_id, title, content) VALUES (%s, %s, %s)", rows[i:i + 1000]
+                )
+            conn.commit()
+            print(f'\rseeded {start + len(batch)}/{users} users', end='', flush=True)
+        if existing < users:
+            print()
+        cursor.execute("SELECT id FROM users WHERE email LIKE %s", (f'%@{EMAIL_DOMAIN}',))
+        user_ids = [user_id for (user_id,) in cursor.fetchall()]
+        cursor.close()
+    return user_ids
+
+
+def scan_all(conn, codec, user_id, terms):
+    # What a client did before the endpoint: fetch the whole library and filter
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM templates WHERE user_id = %s AND is_trashed = FALSE", (user_id,))
+    rows = [codec.decode_row(row) for row in cursor.fetchall()]
+    cursor.close()
+    return [
+        row for row in rows
+        if all(term in (row['title'] + ' ' + row['content']).lower() for term in terms)
+    ][:20]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--templates-per-user', type=int, default=100)
+    parser.add_argument('--queries', type=int, default=100, help='searches per query and backend')
+    parser.add_argument('--reseed', action='store_true')
+    args = parser.parse_args()
+
+    user_ids = seed(args.users, args.templates_per_user, args.reseed)
+    rng = random.Random(7)
+    with api.db_pool.connection() as conn:
+        codec = ContentCodec(lambda: conn)
+        backends = {
+            'fulltext': MySQLTemplateSearch(lambda: conn, codec).search,
+            'memory (cold index)': MemoryTemplateSearch(lambda: conn, codec, max_users=args.queries).search,
+            'fetch all + filter': lambda user_id, trashed, terms, limit: scan_all(conn, codec, user_id, terms),
+        }
+        print(f"{'query':<10} {'backend':<20} {'p50 ms':>8} {'p95 ms':>8} {'hits':>6}")
+        for label, query in QUERIES.items():
+            terms = search_terms(query)
+            users = rng.sample(user_ids, min(args.queries, len(user_ids)))
+            for name, search in backends.items():
+                timings, hits = [], 0
+                for user_id in users:
+                    started = time.perf_counter()
+                    hits += len(search(user_id, False, terms, 20))
+                    timings.append((time.perf_counter() - started) * 1000)
+                    conn.rollback()
+                cuts = statistics.quantiles(timings, n=20) if len(timings) > 1 else timings * 19
+                print(f'{label:<10} {name:<20} {statistics.median(timings):>8.2f} {cuts[18]:>8.2f} '
+                      f'{hits / len(users):>6.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Cost of authenticating a request with an access token vs reading the users table.
+
+Times issuing and verifying access tokens (signature, claims, revocation
+check against a list of --revoked sessions) in process. Pass --mysql to
+compare with the subscription lookup requests made before tokens
+(load_subscription_status: users, then payments for paid plans) on the
+database configured by DB_HOST/DB_PORT/DB_USER/DB_PASSWORD/DB_NAME; use a
+throwaway local MySQL (see bench_db_pool.py).
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tokens import Caller, RevocationList, TokenIssuer  # noqa: E402
+
+BENCH_EMAIL = 'bench-tokens@example.com'
+
+
+def per_call(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--number', type=int, default=20_000)
+    parser.add_argument('--revoked', type=int, default=10_000, help='revoked sessions held in memory')
+    parser.add_argument('--mysql', action='store_true', help='also time the users/payments lookup')
+    args = parser.parse_args()
+
+    issuer = TokenIssuer(['bench-secret', 'retired-secret'])
+    subscription = (True, 'pro', datetime.utcnow() + timedelta(days=20))
+    # Filled in memory directly; the database is never read
+    revocations = RevocationList(connect=None, refresh_interval=float('inf'))
+    revocations._next_refresh = float('inf')
+    now = time.time()
+    for n in range(args.revoked):
+        revocations._sessions[f'revoked-{n}'] = now + 3600
+    token = issuer.access_token(42, subscription, 'bench-session')
+
+    def authenticate():
+        claims = issuer.verify(token)
+        assert not revocations.is_revoked(claims)
+        return Caller(claims).subscription()
+
+    print(f'token length {len(token)} bytes, {len(revocations)} revoked sessions')
+    issue = per_call(lambda: issuer.access_token(42, subscription, 'bench-session'), args.number)
+    print(f"{'issue':<28} {issue * 1e6:>9.1f} us")
+    print(f"{'verify + revocation check':<28} {per_call(authenticate, args.number) * 1e6:>9.1f} us")
+
+    if args.mysql:
+        import app as api
+        import migrations
+
+        with api.db_pool.connection() as conn:
+            migrations.migrate(conn)
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM users WHERE email = %s", (BENCH_EMAIL,))
+            cursor.execute(
+                "INSERT INTO users (username, email, password, verified, plan) VALUES (%s, %s, %s, TRUE, 'pro')",
+                ('bench-tokens', BENCH_EMAIL, 'bench')
+            )
+            user_id = cursor.lastrowid
+            cursor.execute(
+                "INSERT INTO payments (user_id, plan, amount, status, transaction_id) "
+                "VALUES (%s, 'pro', 29.99, 'success', %s)",
+                (user_id, f'BENCH-{user_id}')
+            )
+            conn.commit()
+            cursor.close()
+            with api.app.app_context():
+                api.g.db_conn = conn
+                number = max(1, args.number // 20)
+                seconds = per_call(lambda: api.load_subscription_status(user_id), number)
+                api.g.pop('db_conn')
+            print(f"{'users + payments lookup':<28} {seconds * 1e6:>9.1f} us")
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM payments WHERE user_id = %s", (user_id,))
+            cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+            conn.commit()
+            cursor.close()
+
+
+if __name__ == '__main__':
+    main()
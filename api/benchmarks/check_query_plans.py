@@ -0,0 +1,332 @@
+"""
+Query-plan regression check: EXPLAIN every SQL statement in the API.
+
+Collects the statements passed to cursor.execute() in SOURCES (string
+literals, a literal assigned to a variable just before the call, or a
+module-level constant of any source, e.g. api.USER_PLAN_SQL in asgi.py),
+and those handed to helpers that pass their SQL argument on to execute(),
+such as asgi.py's db.fetchone() or EmailOutbox._update(). Then seeds the
+database configured by DB_HOST/DB_PORT/DB_USER/DB_PASSWORD/DB_NAME with
+loadtest.py's data set plus rows for the outbox, OTP, revocation and rate
+limit tables, and runs EXPLAIN on each statement with representative
+parameters. Exits with status 1 if any statement reads a table with a full
+scan (type ALL), so it can run in CI after migrations change. Full index
+scans (type index) and filesorts are reported but do not fail the check.
+
+Batch jobs that visit a whole class of rows by design may scan the tables
+listed for them in ALLOWED_SCANS; those scans are reported with the reason
+but do not fail the check, and a scan of any other table still does.
+
+Statements built at runtime (f-strings) cannot be read from the source;
+their shapes are listed in DYNAMIC_STATEMENTS, and an unlisted one fails
+the check so that new dynamic SQL gets a representative here as well.
+Use a throwaway local MySQL (see bench_db_pool.py). tests/test_query_plans.py
+runs the same check under pytest when DB_HOST is set.
+"""
+import argparse
+import ast
+import os
+import re
+import sys
+import hashlib
+from datetime import datetime, timedelta
+
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+from loadtest import EMAIL_DOMAIN, seed  # noqa: E402
+import app as api  # noqa: E402
+
+SOURCES = (
+    'app.py', 'asgi.py', 'search.py', 'revisions.py', 'content_store.py', 'tokens.py', 'ratelimit.py',
+    'mailer.py', 'otp_store.py', 'subscriptions.py',
+)
+
+# Every shape each runtime-built statement can take, keyed by function
+DYNAMIC_STATEMENTS = {
+    'list_templates': [
+        "SELECT id, title, created_at FROM templates WHERE user_id = %s AND is_trashed = %s "
+        "ORDER BY created_at DESC, id DESC",
+        "SELECT id, title, created_at FROM templates WHERE user_id = %s AND is_trashed = %s "
+        "ORDER BY created_at DESC, id DESC LIMIT %s",
+        "SELECT id, title, created_at FROM templates WHERE user_id = %s AND is_trashed = %s "
+        "AND (created_at < %s OR (created_at = %s AND id < %s)) ORDER BY created_at DESC, id DESC LIMIT %s",
+        "SELECT id, title, created_at, content, content_z FROM templates "
+        "WHERE user_id = %s AND is_trashed = %s ORDER BY created_at DESC, id DESC LIMIT %s",
+    ],
+    'get_templates_batch': [
+        "SELECT id, user_id, title, content, content_z, is_trashed, created_at FROM templates "
+        "WHERE user_id = %s AND id IN (%s, %s, %s)",
+    ],
+    'claim_due': [
+        "UPDATE email_outbox SET next_attempt_at = %s WHERE id IN (%s, %s, %s)",
+    ],
+    'update_templates_batch': [
+        "UPDATE templates SET is_trashed = TRUE WHERE user_id = %s AND id IN (%s, %s, %s)",
+        "DELETE FROM templates WHERE user_id = %s AND id IN (%s, %s, %s)",
+    ],
+}
+
+# (source, function): (tables that may be scanned, as EXPLAIN names them, and why)
+ALLOWED_SCANS = {
+    ('subscriptions.py', 'expire_subscriptions'): (
+        {'u', 'p', 'payments'},
+        "daily cron sweep: visits every paid user and aggregates their payments; when paid users are a "
+        "large share of the seed data a scan beats idx_users_plan",
+    ),
+}
+
+SEEDED_TABLES = (
+    'users', 'templates', 'payments', 'document_generation_logs', 'plan_changes',
+    'email_outbox', 'otp_codes', 'token_revocations', 'rate_limits',
+)
+DATE_COLUMNS = {
+    'created_at', 'generated_at', 'payment_date', 'changed_at', 'expires_at', 'next_attempt_at', 'last_paid',
+}
+PLACEHOLDER = re.compile(r'(\w+)?\s*(?:=|<|>|<=|>=|!=|\()?\s*%s', re.IGNORECASE)
+
+
+def collect_statements(paths):
+    """Return (path, function, line, sql) for every statement in the modules at paths, and the unlisted ones."""
+    trees = {}
+    for path in paths:
+        with open(path) as f:
+            trees[path] = ast.parse(f.read())
+    # Module-level SQL constants, shared between modules (asgi.py reads app.py's)
+    constants = {
+        node.targets[0].id: node.value for tree in trees.values() for node in tree.body
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+    }
+    functions = [(path, func) for path, tree in trees.items() for func in ast.walk(tree)
+                 if isinstance(func, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    passthrough = find_passthrough(functions)
+
+    statements = []
+    missing = []
+    for path, func in functions:
+        parameters = {arg.arg for arg in func.args.args}
+        assigned = {}
+        for node in sorted(own_nodes(func), key=lambda n: getattr(n, 'lineno', 0)):
+            if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+                assigned[node.targets[0].id] = node.value
+            if not is_sql_call(node, passthrough):
+                continue
+            arg = node.args[0]
+            if isinstance(arg, ast.Name) and arg.id in parameters and arg.id not in assigned:
+                # A helper passing its caller's SQL through; the callers are collected instead
+                continue
+            if isinstance(arg, ast.Name):
+                arg = assigned.get(arg.id, arg)
+            sql = literal_sql(arg, constants)
+            if sql is not None:
+                statements.append((path, func.name, node.lineno, sql))
+            elif func.name in DYNAMIC_STATEMENTS:
+                statements.extend((path, func.name, node.lineno, shape) for shape in DYNAMIC_STATEMENTS[func.name])
+            else:
+                missing.append((path, func.name, node.lineno))
+    return statements, missing
+
+
+def own_nodes(func):
+    """The nodes of func's body, leaving out nested functions (walked on their own)."""
+    pending = list(ast.iter_child_nodes(func))
+    while pending:
+        node = pending.pop()
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            continue
+        yield node
+        pending.extend(ast.iter_child_nodes(node))
+
+
+def is_sql_call(node, passthrough):
+    if not (isinstance(node, ast.Call) and node.args):
+        return False
+    name = node.func.attr if isinstance(node.func, ast.Attribute) else getattr(node.func, 'id', None)
+    return name == 'execute' or name in passthrough
+
+
+def find_passthrough(functions):
+    """Names of functions that hand one of their parameters to execute(), directly or through another."""
+    passthrough = set()
+    while True:
+        found = {
+            func.name for _, func in functions
+            if func.name not in passthrough and any(
+                is_sql_call(node, passthrough) and isinstance(node.args[0], ast.Name)
+                and node.args[0].id in {arg.arg for arg in func.args.args}
+                for node in own_nodes(func)
+            )
+        }
+        if not found:
+            return passthrough
+        passthrough |= found
+
+
+def literal_sql(node, constants=None):
+    if isinstance(node, ast.Name) and constants and node.id in constants:
+        return literal_sql(constants[node.id], constants)
+    # api.USER_PLAN_SQL and the like
+    if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and constants and node.attr in constants:
+        return literal_sql(constants[node.attr], constants)
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return ' '.join(node.value.split())
+    # """INSERT ... SELECT""" + _EXPIRED_USERS: both halves; 'SELECT ...' +
+    # (' FOR UPDATE' if lock else ''): the base statement
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left = literal_sql(node.left, constants)
+        right = literal_sql(node.right, constants)
+        return f'{left} {right}' if left is not None and right is not None else left
+    return None
+
+
+def sample_params(sql, sample):
+    """Pick a plausible value for each %s from the column or keyword in front of it."""
+    params = []
+    for match in PLACEHOLDER.finditer(sql):
+        word = (match.group(1) or '').lower()
+        if word == 'offset':
+            params.append(0)
+        elif word == 'limit':
+            params.append(21)
+        elif word in DATE_COLUMNS:
+            params.append(datetime.utcnow())
+        elif word == 'in':
+            params.append(sample['template_id'])
+        elif word == 'template_id':
+            params.append(sample['template_id'])
+        elif word in ('revision', 'between', 'and', 'attempts', 'window_index'):
+            params.append(1)
+        elif word == 'bucket':
+            params.append(hashlib.sha1(b'x').hexdigest())
+        elif word in ('id', 'user_id', 'payment_id'):
+            params.append(sample['template_id'] if 'templates' in sql and word == 'id' else sample['user_id'])
+        elif word == 'email':
+            params.append(sample['email'])
+        elif word == 'against':
+            params.append('+agreement*')
+        elif word == 'is_trashed':
+            params.append(False)
+        else:
+            params.append('x')
+    return tuple(params)
+
+
+def explain(conn, sql, params):
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute('EXPLAIN ' + sql, params)
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.rollback()
+    return rows
+
+
+def seed_support_tables(cursor, users, rows):
+    """
+    Fill the plan change, outbox, OTP, revocation and rate limit tables up
+    to rows rows each, part of them due or expired.
+    """
+    now = datetime.utcnow().replace(microsecond=0)
+    seeders = {
+        'plan_changes': (
+            "INSERT INTO plan_changes (user_id, old_plan, new_plan, change_reason, changed_at) "
+            "VALUES (%s, 'free', 'pro', %s, %s)",
+            lambda i: (users[i % len(users)]['id'], ('payment', 'expiration')[i % 2], now - timedelta(days=i % 400)),
+        ),
+        'email_outbox': (
+            "INSERT INTO email_outbox (to_email, subject, html_content, status, attempts, next_attempt_at) "
+            "VALUES (%s, 'Seeded', '<p>Seeded</p>', %s, 1, %s)",
+            lambda i: (f'user{i}@{EMAIL_DOMAIN}', 'pending' if i % 50 == 0 else 'sent',
+                       now + timedelta(minutes=i % 100 - 50)),
+        ),
+        'otp_codes': (
+            "INSERT INTO otp_codes (email, otp, purpose, expires_at) VALUES (%s, '123456', 'login', %s)",
+            lambda i: (f'otp{i}@{EMAIL_DOMAIN}', now + timedelta(minutes=i % 20 - 10)),
+        ),
+        'token_revocations': (
+            "INSERT INTO token_revocations (session_id, user_id, issued_before, expires_at) VALUES (%s, %s, NULL, %s)",
+            lambda i: (f'seeded{i}', i, now + timedelta(minutes=i % 60 - 30)),
+        ),
+        'rate_limits': (
+            "INSERT INTO rate_limits (bucket, window_index, hits, expires_at) VALUES (%s, %s, 1, %s)",
+            lambda i: (hashlib.sha1(str(i).encode()).hexdigest(), i % 10, now + timedelta(minutes=i % 20 - 10)),
+        ),
+    }
+    for table, (sql, row) in seeders.items():
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        existing = cursor.fetchone()[0]
+        for start in range(existing, rows, 1000):
+            cursor.executemany(sql, [row(i) for i in range(start, min(rows, start + 1000))])
+
+
+def check(users=2000, templates_per_user=10, verbose=False):
+    """
+    Seed the database, EXPLAIN every statement and print the findings.
+    Returns the (source, function, line) of statements that scan a table
+    and of dynamic statements missing from DYNAMIC_STATEMENTS.
+    """
+    statements, missing = collect_statements([os.path.join(API_DIR, source) for source in SOURCES])
+    users = seed(users, templates_per_user, paid_ratio=0.3, logs_per_user=5, reseed=False)
+    paid = next(user for user in users if user['plan'] != 'free')
+
+    failures = []
+    with api.db_pool.connection() as conn:
+        cursor = conn.cursor()
+        seed_support_tables(cursor, users, len(users) * 5)
+        conn.commit()
+        for table in SEEDED_TABLES:
+            cursor.execute(f"ANALYZE TABLE {table}")
+            cursor.fetchall()
+        cursor.execute("SELECT id FROM templates WHERE user_id = %s LIMIT 1", (paid['id'],))
+        template_id = cursor.fetchone()[0]
+        cursor.close()
+        sample = {'user_id': paid['id'], 'email': paid['email'], 'template_id': template_id}
+
+        for path, function, line, sql in statements:
+            if sql.upper().startswith('INSERT') and ' SELECT ' not in sql.upper():
+                continue
+            source = os.path.basename(path)
+            rows = explain(conn, sql, sample_params(sql, sample))
+            scans = [row for row in rows if row['type'] == 'ALL' and row['select_type'] != 'INSERT']
+            allowed_tables, reason = ALLOWED_SCANS.get((source, function), (set(), None))
+            allowed = [
+                row for row in scans
+                if allowed_tables and (row['table'] in allowed_tables or row['table'].startswith('<derived'))
+            ]
+            scans = [row for row in scans if row not in allowed]
+            notes = [
+                f"{row['table']}: full table scan" for row in allowed
+            ] + [
+                f"{row['table']}: full index scan" for row in rows if row['type'] == 'index'
+            ] + [
+                f"{row['table']}: filesort" for row in rows if 'filesort' in (row['Extra'] or '')
+            ]
+            status = 'FAIL' if scans else ('note' if notes else 'ok')
+            if scans or notes or verbose:
+                print(f'{status:<4} {source}:{line} {function}: {sql[:100]}')
+                for row in rows:
+                    print(f"       {row['table']} type={row['type']} key={row['key']} rows={row['rows']} "
+                          f"extra={row['Extra']}")
+                if allowed:
+                    print(f'       scan allowed: {reason}')
+            if scans:
+                failures.append((source, function, line))
+
+    missing = [(os.path.basename(path), function, line) for path, function, line in missing]
+    for source, function, line in missing:
+        print(f'FAIL {source}:{line} {function}: statement built at runtime; add its shapes to DYNAMIC_STATEMENTS')
+    print(f'{len(statements)} statement(s) checked against {EMAIL_DOMAIN} seed data, '
+          f'{len(failures)} full table scan(s), {len(missing)} unlisted dynamic statement(s)')
+    return failures + missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--templates-per-user', type=int, default=10)
+    parser.add_argument('--verbose', action='store_true', help='print the plan of every statement')
+    args = parser.parse_args()
+    sys.exit(1 if check(args.users, args.templates_per_user, args.verbose) else 0)
+
+
+if __name__ == '__main__':
+    main()
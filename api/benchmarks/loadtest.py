@@ -0,0 +1,275 @@
+"""
+Mixed-traffic load test of the API with throughput and latency percentiles.
+
+Seeds the database configured by DB_HOST/DB_PORT/DB_USER/DB_PASSWORD/DB_NAME
+with --users users (plus their templates, payments and generation logs),
+then drives a weighted mix of login, template listing, template creation,
+daily-limit and subscription-status requests from --workers threads through
+Flask's test client. Email goes to the in-memory transport instead of
+SendGrid. Use a throwaway local MySQL, never production (see
+bench_db_pool.py for a docker one-liner):
+
+    cd api
+    DB_HOST=127.0.0.1 DB_PORT=3306 DB_PASSWORD=root DB_NAME=legallyup \\
+        python benchmarks/loadtest.py --duration 30 --output results.json
+
+Pass --compare with an earlier results file to print the change per
+scenario. Seeded rows use @loadtest.example.com addresses and are reused
+between runs unless --reseed is given.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Must be set before the app is imported
+os.environ.setdefault('EMAIL_TRANSPORT', 'memory')
+os.environ.setdefault('SERVER_TIMING', '1')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+# Every worker logs in as a few users from one address, which the login and
+# OTP limits would answer with 429 long before the database is measured
+os.environ.setdefault('RATE_LIMITS', ','.join(
+    f'{endpoint}.{key}=off' for endpoint in ('login', 'send_otp', 'verify_otp') for key in ('ip', 'email')
+))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as api  # noqa: E402
+import migrations  # noqa: E402
+
+EMAIL_DOMAIN = 'loadtest.example.com'
+PASSWORD = 'loadtest-password'
+CONTENT = 'This agreement is made between the parties named below. ' * 30
+
+# Relative weights of each scenario in the mix
+MIX = {
+    'login': 30,
+    'list_templates': 30,
+    'create_template': 10,
+    'check_daily_limit': 15,
+    'subscription_status': 15,
+}
+
+QUERIES = re.compile(r'desc="(\d+) queries')
+
+
+def seed(users, templates_per_user, paid_ratio, logs_per_user, reseed):
+    with api.db_pool.connection() as conn:
+        migrations.migrate(conn)
+        cursor = conn.cursor()
+        if reseed:
+            delete_seeded(cursor)
+            conn.commit()
+        cursor.execute("SELECT COUNT(*) FROM users WHERE email LIKE %s", (f'%@{EMAIL_DOMAIN}',))
+        existing = cursor.fetchone()[0]
+        # One hash shared by every seeded user, so logins measure verification
+        # rather than the one-off rehash of a plaintext row
+        password_hash = api.password_hasher.hash(PASSWORD)
+        for start in range(existing, users, 1000):
+            batch = range(start, min(users, start + 1000))
+            cursor.executemany(
+                "INSERT INTO users (username, email, password, verified, plan) VALUES (%s, %s, %s, TRUE, %s)",
+                [(f'load{i}', f'user{i}@{EMAIL_DOMAIN}', password_hash, 'pro' if i < users * paid_ratio else 'free')
+                 for i in batch]
+            )
+            conn.commit()
+        cursor.execute(
+            "SELECT id, email, plan FROM users WHERE email LIKE %s ORDER BY id LIMIT %s",
+            (f'%@{EMAIL_DOMAIN}', users)
+        )
+        seeded = cursor.fetchall()
+        new_ids = [user_id for user_id, _, _ in seeded[existing:]]
+        now = datetime.utcnow()
+        for user_id in new_ids:
+            cursor.executemany(
+                "INSERT INTO templates (user_id, title, content, created_at) VALUES (%s, %s, %s, %s)",
+                [(user_id, f'Template {n}', CONTENT, now - timedelta(hours=n)) for n in range(templates_per_user)]
+            )
+            cursor.executemany(
+                "INSERT INTO document_generation_logs (user_id, generated_at, document_type) VALUES (%s, %s, %s)",
+                [(user_id, now - timedelta(days=n + 1), 'template') for n in range(logs_per_user)]
+            )
+        paid = [(user_id,) for user_id, _, plan in seeded[existing:] if plan != 'free']
+        if paid:
+            cursor.executemany(
+                "INSERT INTO payments (user_id, plan, amount, status, transaction_id) "
+                "VALUES (%s, 'pro', 19.99, 'success', CONCAT('loadtest-', UUID()))",
+                paid
+            )
+        conn.commit()
+        cursor.close()
+    return [{'id': user_id, 'email': email, 'plan': plan} for user_id, email, plan in seeded]
+
+
+def delete_seeded(cursor):
+    owned = f"(SELECT id FROM users WHERE email LIKE '%@{EMAIL_DOMAIN}')"
+    # payments has no ON DELETE CASCADE; the other tables do
+    cursor.execute(f"DELETE FROM payments WHERE user_id IN {owned}")
+    cursor.execute("DELETE FROM users WHERE email LIKE %s", (f'%@{EMAIL_DOMAIN}',))
+
+
+def make_requests(client, user):
+    return {
+        'login': lambda: client.post('/api/login', json={'email': user['email'], 'password': PASSWORD}),
+        'list_templates': lambda: client.get(f"/api/templates?user_id={user['id']}&limit=20"),
+        'create_template': lambda: client.post('/api/templates', json={
+            'user_id': user['id'], 'title': 'Load test template', 'content': CONTENT,
+        }),
+        'check_daily_limit': lambda: client.get(f"/api/documents/check-daily-limit?user_id={user['id']}"),
+        'subscription_status': lambda: client.get(f"/api/payments/subscription-status?user_id={user['id']}"),
+    }
+
+
+def run(users, workers, duration, warmup, seed_value):
+    names = list(MIX)
+    weights = [MIX[name] for name in names]
+    samples = defaultdict(list)
+    queries = defaultdict(list)
+    statuses = defaultdict(Counter)
+    lock = threading.Lock()
+    stop_at = [None]
+
+    def worker(index):
+        rng = random.Random(seed_value + index)
+        client = api.app.test_client()
+        done = 0
+        while True:
+            name = rng.choices(names, weights)[0]
+            request = make_requests(client, rng.choice(users))[name]
+            started = time.perf_counter()
+            response = request()
+            elapsed = time.perf_counter() - started
+            done += 1
+            if done <= warmup:
+                continue
+            match = QUERIES.search(response.headers.get('Server-Timing', ''))
+            with lock:
+                if stop_at[0] is None:
+                    stop_at[0] = time.perf_counter() + duration
+                elif time.perf_counter() >= stop_at[0]:
+                    return
+                samples[name].append(elapsed)
+                statuses[name][response.status_code] += 1
+                if match:
+                    queries[name].append(int(match.group(1)))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(worker, range(workers)))
+    wall = time.perf_counter() - started
+    measured = min(wall, duration)
+
+    scenarios = {name: summarize(samples[name], queries[name], statuses[name], measured) for name in names}
+    total = summarize(
+        [s for name in names for s in samples[name]],
+        [q for name in names for q in queries[name]],
+        sum(statuses.values(), Counter()),
+        measured,
+    )
+    return scenarios, total
+
+
+def summarize(latencies, query_counts, statuses, seconds):
+    if not latencies:
+        return {'requests': 0}
+    ms = sorted(value * 1000 for value in latencies)
+    cuts = statistics.quantiles(ms, n=100) if len(ms) > 1 else [ms[0]] * 99
+    return {
+        'requests': len(ms),
+        'rps': round(len(ms) / seconds, 1),
+        'p50_ms': round(cuts[49], 2),
+        'p95_ms': round(cuts[94], 2),
+        'p99_ms': round(cuts[98], 2),
+        'mean_ms': round(statistics.fmean(ms), 2),
+        'queries_per_request': round(statistics.fmean(query_counts), 2) if query_counts else None,
+        'statuses': {str(code): count for code, count in sorted(statuses.items())},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(scenarios, total, baseline=None):
+    print(f"{'scenario':<20} {'reqs':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'q/req':>6}  statuses")
+    for name, row in list(scenarios.items()) + [('total', total)]:
+        if not row['requests']:
+            print(f'{name:<20} {0:>7}')
+            continue
+        line = (
+            f"{name:<20} {row['requests']:>7} {row['rps']:>8.1f} {row['p50_ms']:>8.2f} "
+            f"{row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['queries_per_request'] or 0:>6.1f}  "
+            f"{row['statuses']}"
+        )
+        print(line)
+        before = (baseline or {}).get(name)
+        if before and before.get('requests'):
+            print(
+                f"{'  vs baseline':<20} {'':>7} {delta(before['rps'], row['rps']):>8} "
+                f"{delta(before['p50_ms'], row['p50_ms']):>8} {delta(before['p95_ms'], row['p95_ms']):>8} "
+                f"{delta(before['p99_ms'], row['p99_ms']):>8}"
+            )
+
+
+def delta(before, after):
+    if not before:
+        return '-'
+    return f'{(after - before) / before * 100:+.0f}%'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--templates-per-user', type=int, default=20)
+    parser.add_argument('--paid-ratio', type=float, default=0.3)
+    parser.add_argument('--logs-per-user', type=int, default=10)
+    parser.add_argument('--reseed', action='store_true', help='delete and recreate the seeded rows')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=20, help='seconds to measure for')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured requests per worker')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the request mix')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    api.db_pool.size = max(api.db_pool.size, args.workers)
+    users = seed(args.users, args.templates_per_user, args.paid_ratio, args.logs_per_user, args.reseed)
+    scenarios, total = run(users, args.workers, args.duration, args.warmup, args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        baseline = dict(previous['scenarios'], total=previous['total'])
+    print_table(scenarios, total, baseline)
+
+    if args.output:
+        results = {
+            'commit': git_commit(),
+            'finished_at': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+            'mix': MIX,
+            'scenarios': scenarios,
+            'total': total,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'Wrote {args.output}')
+
+
+if __name__ == '__main__':
+    main()
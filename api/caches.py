@@ -0,0 +1,214 @@
+"""
+In-process caches for hot read paths in the LegallyUp API.
+
+Each serverless instance keeps its own copy, so cached values only ever serve
+reads; anything that enforces a limit still goes to the database.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+class MemoryCounterBackend:
+    """
+    Process-local key/value store with per-key expiry.
+
+    A shared backend (e.g. Redis or memcached) can be swapped in by providing
+    the same get/set/add/incr methods; expires_at is a Unix timestamp.
+    """
+
+    def __init__(self, purge_interval=300):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._purge_interval = purge_interval
+        self._next_purge = time.time() + purge_interval
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            self._maybe_purge(now)
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= now:
+                return None
+            return entry[0]
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+
+    def add(self, key, value, expires_at):
+        """Set key unless it holds an unexpired value; returns whether it was set."""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                return False
+            self._data[key] = (value, expires_at)
+            return True
+
+    def incr(self, key, amount=1):
+        """Increment an existing key; returns None if the key is not cached."""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= now:
+                return None
+            value = entry[0] + amount
+            self._data[key] = (value, entry[1])
+            return value
+
+    def _maybe_purge(self, now):
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self._purge_interval
+        for key in [k for k, (_, expires_at) in self._data.items() if expires_at <= now]:
+            del self._data[key]
+
+
+class DailyCounterCache:
+    """
+    Per-user counters that reset at UTC midnight.
+
+    Keys are (user_id, date) so yesterday's counters can never be read back.
+    A miss calls the loader to rebuild the counter from the database. Events
+    counted by other instances, or missed by a load from a lagging replica,
+    are not seen here, so entries live at most ttl seconds (and never past
+    the end of their day).
+
+    A load that overlaps incr() for the same counter may have read the count
+    from before that event, so its result is returned but not cached; nor
+    does it replace an entry another request cached meanwhile.
+    """
+
+    def __init__(self, backend=None, ttl=60):
+        self.backend = backend or MemoryCounterBackend()
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, loader):
+        key, expires_at = self._key(user_id)
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        started = time.time()
+        value = loader()
+        self._store(key, value, started, expires_at)
+        return value
+
+    async def get_async(self, user_id, loader):
+        """get() for the async server: loader is a coroutine function."""
+        key, expires_at = self._key(user_id)
+        value = self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        self.misses += 1
+        started = time.time()
+        value = await loader()
+        self._store(key, value, started, expires_at)
+        return value
+
+    def incr(self, user_id):
+        """Count one more event for today if the counter is cached, and flag loads in flight."""
+        key, expires_at = self._key(user_id)
+        now = time.time()
+        self.backend.set(self._written_key(key), now, min(expires_at, now + self.ttl))
+        self.backend.incr(key)
+
+    def _store(self, key, value, started, expires_at):
+        written = self.backend.get(self._written_key(key))
+        if written is not None and written >= started:
+            return
+        self.backend.add(key, value, min(expires_at, time.time() + self.ttl))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+    @staticmethod
+    def _written_key(key):
+        return ('written',) + key
+
+    @staticmethod
+    def _key(user_id):
+        today = datetime.utcnow().date()
+        day_end = datetime.combine(today + timedelta(days=1), datetime.min.time())
+        return (str(user_id), today.isoformat()), utc_timestamp(day_end)
+
+
+class TTLCache:
+    """
+    Per-key values that expire after ttl seconds or at an explicit deadline,
+    whichever comes first, and can be invalidated when the source row changes.
+    """
+
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(str(key))
+            if entry is None or entry[1] <= now:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, expires_at=None):
+        """Cache value until now + ttl, or until expires_at if that is sooner."""
+        now = time.time()
+        deadline = now + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        if deadline <= now:
+            return
+        with self._lock:
+            if len(self._data) >= self.max_entries:
+                self._evict(now)
+            self._data[str(key)] = (value, deadline)
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(str(key), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'entries': len(self._data),
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+        }
+
+    def _evict(self, now):
+        # Drop expired entries; if that frees nothing, drop the soonest to expire
+        expired = [k for k, (_, deadline) in self._data.items() if deadline <= now]
+        if not expired:
+            expired = sorted(self._data, key=lambda k: self._data[k][1])[:max(1, self.max_entries // 10)]
+        for key in expired:
+            del self._data[key]
+
+
+def utc_timestamp(dt):
+    """Unix timestamp for a naive datetime in UTC."""
+    return (dt - datetime(1970, 1, 1)).total_seconds()
@@ -0,0 +1,135 @@
+"""
+Response compression and streamed JSON for the LegallyUp API.
+
+Responses are compressed with brotli or gzip, whichever the client prefers
+among those available, once they reach min_size bytes. Brotli is optional:
+without the brotli package only gzip is offered. Streamed responses are
+compressed chunk by chunk as they are produced.
+
+Compressing a response weakens its ETag (as nginx does), since the bytes
+differ from the uncompressed representation; If-None-Match still matches
+because conditional GETs use the weak comparison.
+"""
+import gzip
+import zlib
+
+from flask import Response, current_app, request, stream_with_context
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+
+def init_app(app, min_size=1024, level=6):
+    """Compress eligible responses after every request."""
+
+    @app.after_request
+    def compress_response(response):
+        if response.status_code == 304:
+            _match_weak_etag(response)
+            return response
+        if not _compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = _negotiate()
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = _compress_stream(response.response, encoding, level)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < min_size:
+                return response
+            response.set_data(_compress(data, encoding, level))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def stream_json(key, rows):
+    """
+    Stream {key: [rows...]} as JSON without building the whole list in memory.
+
+    rows is an iterable of dicts, typically read from a cursor in batches;
+    it is consumed while the response is sent, with the request context (and
+    its database connection) kept alive until the last row is written.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield '{' + dumps(key) + ': ['
+        for i, row in enumerate(rows):
+            yield (', ' if i else '') + dumps(row)
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+def fetch_in_batches(cursor, first_batch, size):
+    """Yield rows from an executed cursor, starting with an already fetched batch."""
+    batch = first_batch
+    while batch:
+        yield from batch
+        if len(batch) < size:
+            break
+        batch = cursor.fetchmany(size)
+    cursor.close()
+
+
+def _compressible(response):
+    if request.method == 'HEAD' or response.status_code != 200 or response.direct_passthrough:
+        return False
+    if 'Content-Encoding' in response.headers:
+        return False
+    return response.mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def _negotiate():
+    accepted = request.accept_encodings
+    offers = (['br'] if brotli is not None else []) + ['gzip']
+    best = accepted.best_match(offers)
+    if best is None or accepted.quality(best) <= 0:
+        return None
+    return best
+
+
+def _match_weak_etag(response):
+    # A 304 repeats the ETag the client holds, which is weak if it came
+    # with a compressed 200
+    etag, weak = response.get_etag()
+    if etag and not weak and not request.if_none_match.contains(etag):
+        response.set_etag(etag, weak=True)
+
+
+def _compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _compress_stream(chunks, encoding, level):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(level, 11))
+        for chunk in chunks:
+            out = compressor.process(_to_bytes(chunk))
+            if out:
+                yield out
+        yield compressor.finish()
+        return
+    # wbits=31: zlib deflate with a gzip header and trailer
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(_to_bytes(chunk))
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def _to_bytes(chunk):
+    return chunk.encode() if isinstance(chunk, str) else chunk
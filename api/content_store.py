@@ -0,0 +1,185 @@
+"""
+Compressed storage for templates.content.
+
+Template bodies are kept in templates.content_z as raw deflate data,
+compressed against a preset dictionary trained on our own documents: legal
+templates repeat the same boilerplate, which the dictionary lets even a
+short document reference instead of spelling out. The first byte of every
+blob is the id of its dictionary in content_dictionaries (0 for none), so
+old blobs stay readable after a new dictionary is trained.
+
+Rows written before compression keep their text in templates.content with
+content_z NULL until `flask backfill-template-content` converts them;
+readers go through ContentCodec.decode, which handles both. Routes select
+content_z only when the caller asked for content, and decompress row by
+row as results are sent.
+"""
+import re
+import time
+import zlib
+from collections import Counter
+
+from search import index_terms
+
+# The deflate window: a preset dictionary larger than this is never referenced
+MAX_DICTIONARY_SIZE = 32 * 1024
+SENTENCE = re.compile(r'[^.\n]+(?:[.\n]|$)')
+
+
+class ContentCodec:
+    """
+    Compresses and decompresses template content.
+
+    connect is a callable returning a connection (get_db inside a request).
+    Dictionaries never change once stored, so each is read once per process;
+    the newest one, used for writes, is looked up again at most every
+    refresh_interval seconds.
+    """
+
+    def __init__(self, connect, level=6, refresh_interval=300):
+        self._connect = connect
+        self.level = level
+        self.refresh_interval = refresh_interval
+        self._dictionaries = {0: None}
+        self._current = 0
+        self._next_refresh = 0.0
+
+    def encode(self, text):
+        dictionary_id = self._current_dictionary()
+        return compress(text, dictionary_id, self._dictionaries[dictionary_id], self.level)
+
+    def decode(self, content, content_z):
+        """The text of a row, given its content and content_z columns."""
+        if content_z is None:
+            return content
+        return decompress(content_z, self._dictionary(content_z[0]))
+
+    def decode_row(self, row):
+        """Replace the content/content_z pair of a selected row with the text."""
+        if 'content_z' in row:
+            row['content'] = self.decode(row['content'], row.pop('content_z'))
+        return row
+
+    def missing_dictionaries(self, rows):
+        """Ids of dictionaries the content_z of rows needs and this codec has not read yet."""
+        return {row['content_z'][0] for row in rows if row.get('content_z')} - self._dictionaries.keys()
+
+    def add_dictionary(self, dictionary_id, dictionary):
+        """Cache a dictionary read elsewhere (the async server reads its own)."""
+        self._dictionaries[dictionary_id] = bytes(dictionary)
+
+    def _current_dictionary(self):
+        if time.monotonic() >= self._next_refresh:
+            cursor = self._connect().cursor()
+            cursor.execute("SELECT MAX(id) FROM content_dictionaries")
+            latest = cursor.fetchone()[0]
+            cursor.close()
+            if latest is not None:
+                self._dictionary(latest)
+                self._current = latest
+            self._next_refresh = time.monotonic() + self.refresh_interval
+        return self._current
+
+    def _dictionary(self, dictionary_id):
+        if dictionary_id not in self._dictionaries:
+            cursor = self._connect().cursor()
+            cursor.execute(DICTIONARY_SQL, (dictionary_id,))
+            row = cursor.fetchone()
+            cursor.close()
+            if row is None:
+                raise LookupError(f'Unknown content dictionary {dictionary_id}')
+            self._dictionaries[dictionary_id] = bytes(row[0])
+        return self._dictionaries[dictionary_id]
+
+
+DICTIONARY_SQL = "SELECT dictionary FROM content_dictionaries WHERE id = %s"
+
+
+def compress(text, dictionary_id=0, dictionary=None, level=6):
+    """A content_z blob: the dictionary id, then raw deflate data."""
+    if dictionary is None:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    return bytes([dictionary_id]) + compressor.compress(text.encode()) + compressor.flush()
+
+
+def decompress(blob, dictionary=None):
+    """The text of a blob made by compress with the same dictionary."""
+    if dictionary is None:
+        decompressor = zlib.decompressobj(-15)
+    else:
+        decompressor = zlib.decompressobj(-15, zdict=dictionary)
+    return (decompressor.decompress(blob[1:]) + decompressor.flush()).decode()
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE):
+    """
+    Build a preset dictionary from sample documents.
+
+    Takes the sentences shared by the most documents until size bytes are
+    used, placing the most common last: deflate reaches the end of the
+    dictionary with the shortest distances.
+    """
+    counts = Counter()
+    for text in samples:
+        counts.update({sentence.strip() + ' ' for sentence in SENTENCE.findall(text) if len(sentence) > 8})
+    picked = []
+    used = 0
+    for sentence, documents in counts.most_common():
+        if documents < 2:
+            break
+        length = len(sentence.encode())
+        if used + length > size:
+            continue
+        picked.append(sentence)
+        used += length
+    return ''.join(reversed(picked)).encode()
+
+
+def store_dictionary(conn, dictionary):
+    """Save a trained dictionary; new writes use it from the next refresh. Returns its id."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM content_dictionaries FOR UPDATE")
+    dictionary_id = cursor.fetchone()[0] + 1
+    if dictionary_id > 255:
+        raise ValueError('Content dictionary ids are exhausted')
+    cursor.execute(
+        "INSERT INTO content_dictionaries (id, dictionary) VALUES (%s, %s)", (dictionary_id, dictionary)
+    )
+    conn.commit()
+    cursor.close()
+    return dictionary_id
+
+
+def backfill(conn, codec, batch_size=500):
+    """
+    Compress templates still stored as plain text, batch_size rows per transaction.
+
+    Resumable: only rows with content_z NULL are touched. updated_at is left
+    alone, since the text does not change. Returns the number of rows
+    converted.
+    """
+    cursor = conn.cursor(dictionary=True)
+    converted = 0
+    last_id = 0
+    while True:
+        cursor.execute("""
+            SELECT id, content FROM templates
+            WHERE id > %s AND content_z IS NULL
+            ORDER BY id
+            LIMIT %s
+        """, (last_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        cursor.executemany("""
+            UPDATE templates
+            SET content = '', content_z = %s, search_terms = %s, updated_at = updated_at
+            WHERE id = %s AND content_z IS NULL
+        """, [(codec.encode(row['content']), index_terms(row['content']), row['id']) for row in rows])
+        conn.commit()
+        converted += len(rows)
+        last_id = rows[-1]['id']
+    cursor.close()
+    return converted
@@ -0,0 +1,393 @@
+"""
+MySQL connection pooling for the LegallyUp API.
+
+Routes and helpers call get_db() to borrow a connection for the current
+request; the same connection is reused for every query in that request and
+is handed back to the pool when Flask tears down the app context.
+
+Read-only queries may call get_read_db() instead, which borrows from a read
+replica when DB_REPLICAS are configured (see ReplicaSet). Reads stay on the
+primary once the request has used it, and for pin_seconds after a caller's
+write request, so nobody reads back older data than they just wrote.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import mysql.connector
+from mysql.connector import Error
+from flask import current_app, g, request
+
+from caches import TTLCache
+
+
+class PoolExhaustedError(Error):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    Bounded pool of MySQL connections.
+
+    Idle connections are reused most-recently-used first so that rarely needed
+    ones age out; anything idle for longer than max_idle seconds is closed.
+    A connection that has sat idle for more than ping_interval seconds is
+    health-checked before it is handed out. A size of 0 disables pooling and
+    opens a fresh connection for every checkout (useful for benchmarking).
+    """
+
+    def __init__(self, config, size=5, timeout=5.0, max_idle=300, ping_interval=30, connect=None):
+        # Helpers share the request's connection, so a half-read result set
+        # must not make the next query fail with "Unread result found".
+        self.config = {'consume_results': True, **config}
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.ping_interval = ping_interval
+        self._connect = connect or mysql.connector.connect
+        self._idle = deque()
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._counters = {
+            'checkouts': 0,
+            'connections_opened': 0,
+            'connections_closed': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'health_check_failures': 0,
+            'idle_evictions': 0,
+            'peak_in_use': 0,
+        }
+
+    def acquire(self):
+        """Borrow a connection, opening one if the pool has spare capacity."""
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        stale = []
+        with self._cond:
+            while True:
+                stale += self._evict_idle()
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self.size <= 0 or self._in_use < self.size:
+                    conn, last_used = None, None
+                    break
+                if not waited:
+                    self._counters['waits'] += 1
+                    waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolExhaustedError(
+                        msg=f'No database connection available after {self.timeout}s'
+                    )
+                self._cond.wait(remaining)
+            self._in_use += 1
+            self._counters['checkouts'] += 1
+            self._counters['peak_in_use'] = max(self._counters['peak_in_use'], self._in_use)
+
+        for old in stale:
+            self._close(old)
+
+        try:
+            if conn is not None and time.monotonic() - last_used > self.ping_interval:
+                if not conn.is_connected():
+                    self._count('health_check_failures')
+                    self._close(conn)
+                    conn = None
+            if conn is None:
+                conn = self._open()
+        except Exception:
+            self._checkin(None)
+            raise
+        return conn
+
+    def release(self, conn):
+        """Return a borrowed connection, discarding it if it is no longer usable."""
+        reusable = self.size > 0
+        if reusable:
+            try:
+                if conn.unread_result:
+                    conn.consume_results()
+                if conn.in_transaction:
+                    conn.rollback()
+            except Error:
+                reusable = False
+        if not reusable:
+            self._close(conn)
+            conn = None
+        self._checkin(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection outside of a request (CLI commands, startup)."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def metrics(self):
+        with self._cond:
+            return dict(
+                self._counters,
+                size=self.size,
+                in_use=self._in_use,
+                idle=len(self._idle),
+            )
+
+    def close_all(self):
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._close(conn)
+
+    def _evict_idle(self):
+        # Called with the lock held; the oldest idle connections sit on the left.
+        cutoff = time.monotonic() - self.max_idle
+        stale = []
+        while self._idle and self._idle[0][1] < cutoff:
+            stale.append(self._idle.popleft()[0])
+            self._counters['idle_evictions'] += 1
+        return stale
+
+    def _checkin(self, conn):
+        with self._cond:
+            self._in_use -= 1
+            if conn is not None:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _open(self):
+        conn = self._connect(**self.config)
+        self._count('connections_opened')
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._count('connections_closed')
+
+    def _count(self, name):
+        with self._cond:
+            self._counters[name] += 1
+
+
+class ReplicaSet:
+    """
+    Read replicas of the primary, one ConnectionPool each.
+
+    acquire() picks a replica in turn (selection='round_robin') or the one
+    with the lowest recent round trip (selection='least_latency'), measured
+    with a SELECT 1 on a borrowed connection at most every probe_interval
+    seconds. A replica that fails to connect or answer the probe is skipped
+    for retry_interval seconds; with every replica down, reads go to the
+    primary.
+
+    Callers who wrote are pinned to the primary for pin_seconds, which
+    should exceed the usual replication lag. A caller goes by several keys
+    (user, client address): a write pins them all and a read is pinned if
+    any of them is. Pins are per instance.
+    """
+
+    SELECTIONS = ('round_robin', 'least_latency')
+
+    def __init__(self, pools, selection='round_robin', pin_seconds=5, probe_interval=10, retry_interval=30):
+        if selection not in self.SELECTIONS:
+            raise ValueError(f'Unknown replica selection: {selection}')
+        self.pools = pools
+        self.selection = selection
+        self.probe_interval = probe_interval
+        self.retry_interval = retry_interval
+        self._pins = TTLCache(ttl=pin_seconds)
+        # Per replica: smoothed probe round trip, next probe and down-until times
+        self._latency = [None] * len(pools)
+        self._next_probe = [0.0] * len(pools)
+        self._down_until = [0.0] * len(pools)
+        self._turn = 0
+        self._lock = threading.Lock()
+        self._counters = {'replica_reads': 0, 'primary_fallbacks': 0, 'replica_failures': 0, 'pinned_reads': 0}
+
+    def acquire(self):
+        """Borrow a replica connection as (replica index, conn), or None if none is available."""
+        for index in self._candidates():
+            pool = self.pools[index]
+            try:
+                conn = pool.acquire()
+            except PoolExhaustedError:
+                # Busy, not broken
+                continue
+            except Error:
+                self._mark_down(index)
+                continue
+            try:
+                if time.monotonic() >= self._next_probe[index]:
+                    self._probe(index, conn)
+            except Error:
+                pool.release(conn)
+                self._mark_down(index)
+                continue
+            self._count('replica_reads')
+            return index, conn
+        self._count('primary_fallbacks')
+        return None
+
+    def release(self, index, conn):
+        self.pools[index].release(conn)
+
+    def pin(self, keys):
+        """Send reads by any of keys to the primary for the next pin_seconds."""
+        for key in keys:
+            self._pins.set(key, True)
+
+    def is_pinned(self, keys):
+        if not any(self._pins.get(key) is not None for key in keys):
+            return False
+        self._count('pinned_reads')
+        return True
+
+    def metrics(self):
+        now = time.monotonic()
+        with self._lock:
+            replicas = [
+                dict(
+                    pool.metrics(),
+                    host=f"{pool.config['host']}:{pool.config.get('port', 3306)}",
+                    latency_ms=round(latency * 1000, 2) if latency is not None else None,
+                    down=down_until > now,
+                )
+                for pool, latency, down_until in zip(self.pools, self._latency, self._down_until)
+            ]
+            return dict(self._counters, selection=self.selection, pins=self._pins.stats()['entries'], replicas=replicas)
+
+    def close_all(self):
+        for pool in self.pools:
+            pool.close_all()
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self._lock:
+            up = [index for index in range(len(self.pools)) if self._down_until[index] <= now]
+            if self.selection == 'least_latency':
+                # Unprobed replicas first, so each gets measured
+                return sorted(up, key=lambda index: self._latency[index] or 0.0)
+            # Rotate over the replicas that are up, so a down one's share is spread evenly
+            self._turn += 1
+            start = self._turn % len(up) if up else 0
+            return up[start:] + up[:start]
+
+    def _probe(self, index, conn):
+        started = time.perf_counter()
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        cursor.close()
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            previous = self._latency[index]
+            self._latency[index] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+            self._next_probe[index] = time.monotonic() + self.probe_interval
+
+    def _mark_down(self, index):
+        with self._lock:
+            self._down_until[index] = time.monotonic() + self.retry_interval
+            self._counters['replica_failures'] += 1
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+def parse_hosts(spec, default_port=3306):
+    """Parse "host[:port],..." (DB_REPLICAS) into [(host, port)]."""
+    hosts = []
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        host, _, port = item.strip().partition(':')
+        hosts.append((host, int(port) if port else default_port))
+    return hosts
+
+
+def init_app(app, pool, replicas=None, pin_keys=None):
+    """
+    Attach the pool to the app and return request connections on teardown.
+
+    replicas is an optional ReplicaSet for get_read_db(); pin_keys returns
+    the keys a write request pins to the primary (None entries are skipped).
+    """
+    app.extensions['db_pool'] = pool
+    app.extensions['db_replicas'] = replicas
+    app.extensions['db_pin_keys'] = pin_keys
+    app.teardown_request(_pin_after_write)
+    app.teardown_appcontext(_release_request_connection)
+
+
+def get_pool():
+    return current_app.extensions['db_pool']
+
+
+def get_db():
+    """Return the current request's connection, borrowing one on first use."""
+    if 'db_conn' not in g:
+        g.db_conn = get_pool().acquire()
+        g.db_primary_used = True
+    return g.db_conn
+
+
+def get_read_db():
+    """
+    Return a connection for read-only queries: a replica's, unless there
+    are none (or none reachable), the request has already used the primary,
+    or the caller is pinned to it after a write.
+    """
+    if g.get('db_primary_used'):
+        return get_db()
+    if 'db_read_conn' in g:
+        return g.db_read_conn[1]
+    replicas = current_app.extensions.get('db_replicas')
+    if replicas is None or replicas.is_pinned(_pin_keys()):
+        return get_db()
+    borrowed = replicas.acquire()
+    if borrowed is None:
+        return get_db()
+    g.db_read_conn = borrowed
+    return borrowed[1]
+
+
+def release_db():
+    """
+    Hand the request's connection back early, before slow work that needs
+    no database (a later get_db borrows one again). Uncommitted work is
+    rolled back.
+    """
+    _release_request_connection(None)
+
+
+def _release_request_connection(exc):
+    borrowed = g.pop('db_read_conn', None)
+    if borrowed is not None:
+        current_app.extensions['db_replicas'].release(*borrowed)
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+def _pin_after_write(exc):
+    # A request that may have written reads it back from the primary
+    replicas = current_app.extensions.get('db_replicas')
+    if replicas is not None and g.get('db_primary_used') and request.method not in SAFE_METHODS:
+        replicas.pin(_pin_keys())
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _pin_keys():
+    pin_keys = current_app.extensions.get('db_pin_keys')
+    return [str(key) for key in pin_keys() if key is not None] if pin_keys is not None else []
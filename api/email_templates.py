@@ -0,0 +1,166 @@
+"""
+Transactional email templates.
+
+Each email is described once and compiled into an HTML body and a plain-text
+alternative. Compilation bakes in everything static (styles, layout, footer
+year) and splits the result into literal chunks and field slots, so rendering
+a message is a single join over pre-built strings. Compiled templates are
+cached per year so the footer stays current without rebuilding per message.
+"""
+from datetime import datetime
+from functools import lru_cache
+from html import escape
+from string import Formatter
+
+STYLES = """
+    .container {
+        font-family: Arial, sans-serif;
+        max-width: 600px;
+        margin: 0 auto;
+        padding: 20px;
+        background-color: #f9f9f9;
+        border-radius: 10px;
+    }
+    .header {
+        text-align: center;
+        padding: 20px 0;
+        border-bottom: 2px solid #eee;
+    }
+    .content {
+        padding: 30px 0;
+        text-align: center;
+    }
+    .otp-code {
+        font-size: 32px;
+        font-weight: bold;
+        color: #2563eb;
+        letter-spacing: 5px;
+        padding: 20px;
+        background-color: #ffffff;
+        border-radius: 5px;
+        margin: 20px 0;
+        display: inline-block;
+    }
+    .button {
+        display: inline-block;
+        padding: 12px 24px;
+        margin: 20px 0;
+        background-color: #2563eb;
+        color: #ffffff;
+        border-radius: 5px;
+        text-decoration: none;
+    }
+    .footer {
+        text-align: center;
+        color: #666;
+        font-size: 14px;
+        padding-top: 20px;
+        border-top: 1px solid #eee;
+    }
+"""
+
+# Field names in braces are filled per message; everything else is static.
+EMAILS = {
+    'register_otp': {
+        'subject': 'LegallyUp - Registration OTP',
+        'heading': 'Welcome to LegallyUp!',
+        'intro': 'Thank you for registering with LegallyUp. To complete your registration, please use the following OTP code:',
+        'code': '{otp}',
+        'outro': 'This code will expire in {expiry_minutes} minutes.',
+        'notice': "If you didn't request this registration, please ignore this email.",
+    },
+    'forgot_otp': {
+        'subject': 'LegallyUp - Password Reset OTP',
+        'heading': 'Password Reset Request',
+        'intro': 'You have requested to reset your password for your LegallyUp account. Please use the following OTP code to proceed:',
+        'code': '{otp}',
+        'outro': 'This code will expire in {expiry_minutes} minutes.',
+        'notice': "If you didn't request this password reset, please ignore this email.",
+    },
+    'reset_link': {
+        'subject': 'Password Reset Request',
+        'heading': 'Password Reset Request',
+        'intro': 'Hello {username}, you requested a password reset. Click the link below to reset your password:',
+        'link': '{reset_link}',
+        'link_text': 'Reset Password',
+        'notice': 'If you did not request this, please ignore this email.',
+    },
+}
+
+
+class CompiledTemplate:
+    """A format string pre-split into literal chunks and field slots."""
+
+    def __init__(self, source, escape_fields=False):
+        self._parts = [(literal, field) for literal, field, _, _ in Formatter().parse(source)]
+        self._escape = escape_fields
+
+    def render(self, fields):
+        out = []
+        for literal, field in self._parts:
+            out.append(literal)
+            if field is not None:
+                value = str(fields[field])
+                out.append(escape(value) if self._escape else value)
+        return ''.join(out)
+
+
+class EmailTemplate:
+    def __init__(self, spec, year):
+        self.subject = spec['subject']
+        self._html = CompiledTemplate(_html_source(spec, year), escape_fields=True)
+        self._text = CompiledTemplate(_text_source(spec, year))
+
+    def render(self, **fields):
+        """Return a message dict with subject, html and its plain-text alternative."""
+        return {
+            'subject': self.subject,
+            'html': self._html.render(fields),
+            'text': self._text.render(fields),
+        }
+
+
+def render_email(name, **fields):
+    return compiled_templates(datetime.utcnow().year)[name].render(**fields)
+
+
+@lru_cache(maxsize=2)
+def compiled_templates(year):
+    return {name: EmailTemplate(spec, year) for name, spec in EMAILS.items()}
+
+
+def _literal(text):
+    # Static text must not be mistaken for field slots by the formatter
+    return text.replace('{', '{{').replace('}', '}}')
+
+
+def _html_source(spec, year):
+    body = [f"<p>{spec['intro']}</p>"]
+    if 'code' in spec:
+        body.append(f"<div class=\"otp-code\">{spec['code']}</div>")
+    if 'link' in spec:
+        body.append(f"<a class=\"button\" href=\"{spec['link']}\">{spec['link_text']}</a>")
+    if 'outro' in spec:
+        body.append(f"<p>{spec['outro']}</p>")
+    return (
+        "<html><head><style>" + _literal(STYLES) + "</style></head><body>"
+        "<div class=\"container\">"
+        f"<div class=\"header\"><h1>{spec['heading']}</h1></div>"
+        "<div class=\"content\">" + ''.join(body) + "</div>"
+        "<div class=\"footer\">"
+        f"<p>{spec['notice']}</p>"
+        f"<p>&copy; {year} LegallyUp. All rights reserved.</p>"
+        "</div></div></body></html>"
+    )
+
+
+def _text_source(spec, year):
+    lines = [spec['heading'], '', spec['intro'], '']
+    if 'code' in spec:
+        lines += ['    ' + spec['code'], '']
+    if 'link' in spec:
+        lines += [spec['link'], '']
+    if 'outro' in spec:
+        lines += [spec['outro'], '']
+    lines += ['--', spec['notice'], f'(c) {year} LegallyUp. All rights reserved.']
+    return '\n'.join(lines) + '\n'
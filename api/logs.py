@@ -0,0 +1,210 @@
+"""
+Structured logging for the LegallyUp API.
+
+Log records are written as one JSON object per line. Request threads only
+put records on a bounded in-memory queue; a background listener thread
+formats them and writes to stdout, so a slow log sink never holds up a
+request. If the queue fills up, records are dropped and counted rather than
+blocking.
+
+Configuration (all optional):
+
+    LOG_LEVEL          default level, INFO unless set
+    LOG_ROUTE_LEVELS   per-route overrides, e.g. "/api/login=DEBUG,/api/_metrics=WARNING"
+    LOG_SAMPLE         keep only a fraction of below-WARNING records on busy
+                       routes, e.g. "/api/templates=0.1"
+    LOG_QUEUE_SIZE     records buffered before dropping, default 10000
+
+Routes are Flask URL rules as written in app.py (/api/templates/<int:template_id>).
+Fields whose name contains one of REDACTED_FIELDS (case-insensitively, so
+newPassword and refresh_token count) are masked wherever they appear in the
+structured fields of a record, including nested request payloads.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import secrets
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+REDACTED_FIELDS = ('password', 'otp', 'token', 'secret', 'authorization')
+REDACTED = '[redacted]'
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = REDACTED if is_redacted(key) else redact(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of raising when its queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Resolve anything that depends on the caller's frame or mutable
+        # arguments now; formatting into JSON happens on the listener thread.
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Adds request fields to records and applies per-route levels and sampling.
+
+    Runs on the request thread, before the record is queued, so it can read
+    flask.request and flask.g.
+    """
+
+    def __init__(self, level, route_levels=None, sample_rates=None):
+        super().__init__()
+        self.level = level
+        self.route_levels = route_levels or {}
+        self.sample_rates = sample_rates or {}
+
+    def filter(self, record):
+        if not has_request_context():
+            return record.levelno >= self.level
+        route = request.url_rule.rule if request.url_rule is not None else None
+        if record.levelno < self.route_levels.get(route, self.level):
+            return False
+        rate = self.sample_rates.get(route)
+        if rate is not None and record.levelno < logging.WARNING:
+            if random.random() >= rate:
+                return False
+            record.sample_rate = rate
+        record.request_id = request_id()
+        record.method = request.method
+        record.route = route or request.path
+        return True
+
+    def minimum_level(self):
+        return min([self.level, *self.route_levels.values()])
+
+
+def is_redacted(key):
+    key = str(key).lower()
+    return any(field in key for field in REDACTED_FIELDS)
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if is_redacted(key) else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+def request_id():
+    """The caller's X-Request-ID, or a random one, fixed for the rest of the request."""
+    if 'request_id' not in g:
+        g.request_id = request.headers.get('X-Request-ID') or secrets.token_hex(8)
+    return g.request_id
+
+
+def parse_levels(spec):
+    """Parse "route=LEVEL,route=LEVEL" into {route: levelno}."""
+    levels = {}
+    for route, level in _pairs(spec):
+        levelno = logging.getLevelName(level.upper())
+        if not isinstance(levelno, int):
+            raise ValueError(f'Unknown log level for {route}: {level}')
+        levels[route] = levelno
+    return levels
+
+
+def parse_rates(spec):
+    """Parse "route=0.1,route=0.5" into {route: rate}."""
+    return {route: min(1.0, max(0.0, float(rate))) for route, rate in _pairs(spec)}
+
+
+def _pairs(spec):
+    for item in (spec or '').split(','):
+        if item.strip():
+            route, _, value = item.strip().rpartition('=')
+            yield route.strip(), value.strip()
+
+
+def setup_logging(app, level='INFO', route_levels=None, sample_rates=None, queue_size=10000, stream=None):
+    """
+    Route every logger through the JSON queue pipeline and log one line per request.
+
+    Returns the queue handler, whose dropped attribute counts lost records.
+    """
+    level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    context = RequestContextFilter(level, route_levels, sample_rates)
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JSONFormatter())
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(context)
+    listener = QueueListener(handler.queue, output)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    # Loggers must let through the most verbose per-route level; the filter
+    # then applies the level that actually holds for the current route.
+    root.setLevel(context.minimum_level())
+    app.logger.handlers.clear()
+    app.logger.propagate = True
+    app.extensions['log_handler'] = handler
+
+    access_log = logging.getLogger('legallyup.access')
+
+    @app.before_request
+    def start_access_timer():
+        g.log_started = time.perf_counter()
+
+    @app.after_request
+    def log_request(response):
+        started = g.pop('log_started', None)
+        if started is not None:
+            access_log.info('%s %s %s', request.method, request.path, response.status_code, extra={
+                'status': response.status_code,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+            })
+        return response
+
+    return handler
@@ -0,0 +1,302 @@
+"""
+Outbound email dispatch for the LegallyUp API.
+
+Routes hand messages to an EmailDispatcher and return immediately; a small
+pool of worker threads delivers them through a pluggable transport, retrying
+failures with exponential backoff. Every message is first written to the
+email_outbox table, so anything an instance could not deliver (a cold start
+that was frozen or recycled mid-send) is picked up again by whichever
+instance polls the outbox next. Idle workers poll it every poll_interval
+seconds; where background threads freeze between requests (serverless),
+drain() delivers whatever is due from a cron job or the CLI instead.
+
+Messages are dicts with 'to', 'subject', 'html' and an optional 'text'
+plain-text alternative.
+"""
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+
+import sendgrid
+from flask import has_request_context
+from sendgrid.helpers.mail import Mail
+
+logger = logging.getLogger(__name__)
+
+
+class SendGridTransport:
+    """Delivers through SendGrid, reusing one API client for every message."""
+
+    def __init__(self, api_key, from_email):
+        self.from_email = from_email
+        self._client = sendgrid.SendGridAPIClient(api_key=api_key)
+
+    def send(self, message):
+        mail = Mail(
+            from_email=self.from_email,
+            to_emails=message['to'],
+            subject=message['subject'],
+            html_content=message['html'],
+            plain_text_content=message.get('text')
+        )
+        self._client.send(mail)
+
+
+class MemoryTransport:
+    """Keeps messages in memory instead of sending them (local runs, tests, benchmarks)."""
+
+    def __init__(self):
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        with self._lock:
+            self.sent.append(message)
+
+
+def create_transport(name, api_key=None, from_email=None):
+    """Build the transport named by EMAIL_TRANSPORT ('sendgrid' or 'memory')."""
+    if name == 'sendgrid':
+        return SendGridTransport(api_key, from_email)
+    if name == 'memory':
+        return MemoryTransport()
+    raise ValueError(f'Unknown email transport: {name}')
+
+
+class EmailOutbox:
+    """
+    Durable record of outgoing messages in the email_outbox table.
+
+    A row being worked on has its next_attempt_at pushed lease_seconds into
+    the future, so other instances polling the outbox leave it alone unless
+    the instance holding it disappears.
+
+    connect, if given, returns the current request's connection: add() called
+    from a route writes (and commits) on it rather than holding a second pool
+    connection alongside the request's. Workers and CLI commands use the pool.
+    """
+
+    def __init__(self, pool, lease_seconds=60, connect=None):
+        self.pool = pool
+        self.lease_seconds = lease_seconds
+        self._connect = connect
+
+    def add(self, message):
+        if self._connect is not None and has_request_context():
+            return self._insert(self._connect(), message)
+        with self.pool.connection() as conn:
+            return self._insert(conn, message)
+
+    def _insert(self, conn, message):
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO email_outbox (to_email, subject, html_content, text_content, next_attempt_at)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (message['to'], message['subject'], message['html'], message.get('text'), self._lease_end()))
+        conn.commit()
+        outbox_id = cursor.lastrowid
+        cursor.close()
+        return outbox_id
+
+    def claim_due(self, limit=50):
+        """Lease up to limit pending messages that are due; returns (id, message, attempts) tuples."""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT id, to_email, subject, html_content, text_content, attempts
+                FROM email_outbox
+                WHERE status = 'pending' AND next_attempt_at <= %s
+                ORDER BY next_attempt_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (datetime.utcnow(), limit))
+            rows = cursor.fetchall()
+            if rows:
+                placeholders = ', '.join(['%s'] * len(rows))
+                cursor.execute(
+                    f"UPDATE email_outbox SET next_attempt_at = %s WHERE id IN ({placeholders})",
+                    (self._lease_end(), *[row['id'] for row in rows])
+                )
+            conn.commit()
+            cursor.close()
+        return [
+            (row['id'], {
+                'to': row['to_email'],
+                'subject': row['subject'],
+                'html': row['html_content'],
+                'text': row['text_content'],
+            }, row['attempts'])
+            for row in rows
+        ]
+
+    def mark_sent(self, outbox_id, attempts):
+        self._update(
+            "UPDATE email_outbox SET status = 'sent', attempts = %s, sent_at = %s WHERE id = %s",
+            (attempts, datetime.utcnow(), outbox_id)
+        )
+
+    def mark_retry(self, outbox_id, attempts, delay, error):
+        # The local retry fires after delay; other instances wait out the lease on top
+        self._update(
+            "UPDATE email_outbox SET attempts = %s, next_attempt_at = %s, last_error = %s WHERE id = %s",
+            (attempts, self._lease_end() + timedelta(seconds=delay), error[:1000], outbox_id)
+        )
+
+    def mark_failed(self, outbox_id, attempts, error):
+        self._update(
+            "UPDATE email_outbox SET status = 'failed', attempts = %s, last_error = %s WHERE id = %s",
+            (attempts, error[:1000], outbox_id)
+        )
+
+    def _update(self, sql, params):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            conn.commit()
+            cursor.close()
+
+    def _lease_end(self):
+        return datetime.utcnow() + timedelta(seconds=self.lease_seconds)
+
+
+class EmailDispatcher:
+    """
+    Bounded queue of outgoing messages drained by background worker threads.
+
+    Workers start on the first send() so nothing is spawned at import time.
+    With asynchronous=False messages are delivered inline instead, for
+    platforms that freeze the process as soon as a response is returned.
+    """
+
+    def __init__(self, transport, outbox=None, workers=2, queue_size=1000,
+                 max_attempts=5, backoff=2.0, poll_interval=30, asynchronous=True):
+        self.transport = transport
+        self.outbox = outbox
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.poll_interval = poll_interval
+        self.asynchronous = asynchronous
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'sent': 0, 'retried': 0, 'failed': 0, 'deferred': 0, 'dropped': 0}
+
+    def send(self, message):
+        """Queue a message for delivery and return without waiting for it."""
+        if not self.asynchronous:
+            self.transport.send(message)
+            self._count('sent')
+            return
+        self._ensure_started()
+        outbox_id = None
+        if self.outbox is not None:
+            try:
+                outbox_id = self.outbox.add(message)
+            except Exception:
+                logger.exception('Email outbox insert error')
+        self._count('enqueued')
+        self._put((outbox_id, message, 0))
+
+    def drain(self, limit=100):
+        """
+        Deliver up to limit due outbox messages inline, without the workers.
+        Failures are left in the outbox for a later drain or poll. Returns
+        the number of messages handled.
+        """
+        if self.outbox is None:
+            return 0
+        handled = 0
+        while handled < limit:
+            items = self.outbox.claim_due(min(50, limit - handled))
+            if not items:
+                break
+            for item in items:
+                self._deliver(*item, retry_locally=False)
+            handled += len(items)
+        return handled
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats, queued=self._queue.qsize(), workers=len(self._threads))
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            if item[0] is not None:
+                # Still in the outbox; a later poll delivers it once the lease runs out
+                self._count('deferred')
+            else:
+                self._count('dropped')
+                logger.error('Email queue full, dropping message', extra={'to': item[1]['to']})
+
+    def _ensure_started(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'email-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.poll_interval)
+            except queue.Empty:
+                self._poll_outbox()
+                continue
+            self._deliver(*item)
+
+    def _poll_outbox(self):
+        if self.outbox is None:
+            return
+        try:
+            for item in self.outbox.claim_due():
+                self._put(item)
+        except Exception:
+            logger.exception('Email outbox poll error')
+
+    def _deliver(self, outbox_id, message, attempts, retry_locally=True):
+        attempts += 1
+        try:
+            self.transport.send(message)
+        except Exception as e:
+            self._handle_failure(outbox_id, message, attempts, e, retry_locally)
+            return
+        self._count('sent')
+        if outbox_id is not None:
+            try:
+                self.outbox.mark_sent(outbox_id, attempts)
+            except Exception:
+                logger.exception('Email outbox update error')
+
+    def _handle_failure(self, outbox_id, message, attempts, error, retry_locally=True):
+        try:
+            if attempts >= self.max_attempts:
+                self._count('failed')
+                logger.error('Email delivery failed for good', extra={'to': message['to'], 'error': str(error)})
+                if outbox_id is not None:
+                    self.outbox.mark_failed(outbox_id, attempts, str(error))
+                return
+            delay = self.backoff * 2 ** (attempts - 1)
+            self._count('retried')
+            if outbox_id is not None:
+                self.outbox.mark_retry(outbox_id, attempts, delay, str(error))
+        except Exception:
+            logger.exception('Email outbox update error')
+            return
+        if not retry_locally:
+            return
+        timer = threading.Timer(delay, self._put, ((outbox_id, message, attempts),))
+        timer.daemon = True
+        timer.start()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
@@ -0,0 +1,328 @@
+"""
+Request and database instrumentation for the LegallyUp API.
+
+Every request is timed into a per-route latency histogram. Connections
+opened through instrumented_connect() and email sent through TimedTransport
+report their time to the current request (when there is one) and to
+process-wide totals. /api/_metrics serves everything in the Prometheus text
+format to scrapers holding METRICS_SECRET; with SERVER_TIMING=1 each response also carries a Server-Timing
+header breaking down that request's time.
+
+Numbers are per process. Each serverless instance keeps its own, so scrape
+or sum them across instances accordingly.
+"""
+import threading
+import time
+
+from flask import g, has_request_context, request
+
+# Seconds; roughly doubling from 5ms to 10s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style, one series per label set."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0, 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), count, total) for labels, (counts, count, total) in self._series.items()}
+
+
+class Counter:
+    """Monotonic float counters keyed by label tuples."""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class RequestTimings:
+    """What one request spent, kept on flask.g while it runs."""
+
+    __slots__ = ('started', 'db_connections', 'db_queries', 'db_seconds', 'email_sends', 'email_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_connections = 0
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.email_sends = 0
+        self.email_seconds = 0.0
+
+
+class Metrics:
+    def __init__(self):
+        self.request_seconds = Histogram()
+        self.db_query_seconds = Histogram()
+        self.email_send_seconds = Histogram()
+        self.db_connections_opened = Counter()
+        self.db_queries = Counter()
+        self.db_seconds = Counter()
+        self.email_sends = Counter()
+        self.email_seconds = Counter()
+
+    def record_connect(self, seconds):
+        route = _current_route()
+        self.db_connections_opened.inc((route,))
+        self.db_seconds.inc((route,), seconds)
+        timings = _current_timings()
+        if timings is not None:
+            timings.db_connections += 1
+            timings.db_seconds += seconds
+
+    def record_query(self, seconds):
+        route = _current_route()
+        self.db_queries.inc((route,))
+        self.db_seconds.inc((route,), seconds)
+        self.db_query_seconds.observe((route,), seconds)
+        timings = _current_timings()
+        if timings is not None:
+            timings.db_queries += 1
+            timings.db_seconds += seconds
+
+    def record_fetch(self, seconds):
+        # Rows streamed after execute() still count as time spent in MySQL
+        route = _current_route()
+        self.db_seconds.inc((route,), seconds)
+        timings = _current_timings()
+        if timings is not None:
+            timings.db_seconds += seconds
+
+    def record_email(self, transport, seconds, ok):
+        self.email_sends.inc((transport, 'ok' if ok else 'error'))
+        self.email_seconds.inc((transport, 'ok' if ok else 'error'), seconds)
+        self.email_send_seconds.observe((transport,), seconds)
+        timings = _current_timings()
+        if timings is not None:
+            timings.email_sends += 1
+            timings.email_seconds += seconds
+
+    def record_request(self, method, route, status, seconds):
+        self.request_seconds.observe((method, route, str(status)), seconds)
+
+    def render(self, gauges=None):
+        """Everything recorded so far in the Prometheus text exposition format."""
+        lines = []
+        _render_histogram(lines, 'legallyup_http_request_duration_seconds',
+                          'Request latency by route.', ('method', 'route', 'status'), self.request_seconds)
+        _render_counter(lines, 'legallyup_db_connections_opened_total',
+                        'MySQL connections opened.', ('route',), self.db_connections_opened)
+        _render_counter(lines, 'legallyup_db_queries_total',
+                        'MySQL statements executed.', ('route',), self.db_queries)
+        _render_counter(lines, 'legallyup_db_seconds_total',
+                        'Time spent connecting to, querying and reading from MySQL.', ('route',), self.db_seconds)
+        _render_histogram(lines, 'legallyup_db_query_duration_seconds',
+                          'Statement execution latency.', ('route',), self.db_query_seconds)
+        _render_counter(lines, 'legallyup_email_sends_total',
+                        'Email delivery attempts.', ('transport', 'result'), self.email_sends)
+        _render_counter(lines, 'legallyup_email_seconds_total',
+                        'Time spent handing email to the transport.', ('transport', 'result'), self.email_seconds)
+        _render_histogram(lines, 'legallyup_email_send_duration_seconds',
+                          'Email delivery latency.', ('transport',), self.email_send_seconds)
+        for name, (help_text, value) in sorted((gauges or {}).items()):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times execute and fetch calls."""
+
+    def __init__(self, cursor, metrics):
+        self._cursor = cursor
+        self._metrics = metrics
+
+    def execute(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(*args, **kwargs)
+        finally:
+            self._metrics.record_query(time.perf_counter() - started)
+
+    def executemany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(*args, **kwargs)
+        finally:
+            self._metrics.record_query(time.perf_counter() - started)
+
+    def fetchone(self):
+        return self._timed_fetch(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._timed_fetch(self._cursor.fetchall)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._timed_fetch(self._cursor.fetchmany, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _timed_fetch(self, fetch, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fetch(*args, **kwargs)
+        finally:
+            self._metrics.record_fetch(time.perf_counter() - started)
+
+
+class InstrumentedConnection:
+    """Connection proxy whose cursors are timed; everything else passes through."""
+
+    def __init__(self, conn, metrics):
+        self._conn = conn
+        self._metrics = metrics
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs), self._metrics)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def instrumented_connect(connect, metrics):
+    """Wrap a connect function (mysql.connector.connect) for ConnectionPool(connect=...)."""
+    def open_connection(**config):
+        started = time.perf_counter()
+        conn = connect(**config)
+        metrics.record_connect(time.perf_counter() - started)
+        return InstrumentedConnection(conn, metrics)
+    return open_connection
+
+
+class TimedTransport:
+    """Email transport wrapper that records how long each delivery takes."""
+
+    def __init__(self, transport, metrics):
+        self.transport = transport
+        self._metrics = metrics
+        self._name = type(transport).__name__
+
+    def send(self, message):
+        started = time.perf_counter()
+        ok = False
+        try:
+            self.transport.send(message)
+            ok = True
+        finally:
+            self._metrics.record_email(self._name, time.perf_counter() - started, ok)
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
+
+
+def init_app(app, metrics, server_timing=False):
+    """
+    Time every request; optionally add a Server-Timing header to responses.
+
+    Call this before registering other before_request hooks so their time
+    is included.
+    """
+    app.extensions['metrics'] = metrics
+
+    @app.before_request
+    def start_request_timer():
+        g.request_timings = RequestTimings()
+
+    @app.after_request
+    def record_request_timings(response):
+        timings = g.pop('request_timings', None)
+        if timings is None:
+            return response
+        elapsed = time.perf_counter() - timings.started
+        metrics.record_request(request.method, _current_route(), response.status_code, elapsed)
+        if server_timing:
+            response.headers['Server-Timing'] = server_timing_header(timings, elapsed)
+        return response
+
+    @app.teardown_request
+    def record_failed_request(exc):
+        # after_request is skipped when a view raises; count those as 500s
+        timings = g.pop('request_timings', None)
+        if timings is not None:
+            metrics.record_request(request.method, _current_route(), 500, time.perf_counter() - timings.started)
+
+
+def server_timing_header(timings, elapsed):
+    parts = [
+        f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.db_queries} queries, '
+        f'{timings.db_connections} connects"'
+    ]
+    if timings.email_sends:
+        parts.append(f'email;dur={timings.email_seconds * 1000:.1f};desc="{timings.email_sends} sends"')
+    parts.append(f'total;dur={elapsed * 1000:.1f}')
+    return ', '.join(parts)
+
+
+def _current_timings():
+    if not has_request_context():
+        return None
+    return g.get('request_timings')
+
+
+def _current_route():
+    if not has_request_context():
+        return 'background'
+    # The URL rule, not the raw path, keeps label cardinality bounded
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+def _render_histogram(lines, name, help_text, label_names, histogram):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for labels, (counts, count, total) in sorted(histogram.snapshot().items()):
+        base = _labels(label_names, labels)
+        for bound, value in zip(histogram.buckets, counts):
+            lines.append(f'{name}_bucket{{{base},le="{bound}"}} {value}')
+        lines.append(f'{name}_bucket{{{base},le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{{base}}} {_number(total)}')
+        lines.append(f'{name}_count{{{base}}} {count}')
+
+
+def _render_counter(lines, name, help_text, label_names, counter):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} counter')
+    for labels, value in sorted(counter.snapshot().items()):
+        lines.append(f'{name}{{{_labels(label_names, labels)}}} {_number(value)}')
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
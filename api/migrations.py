@@ -0,0 +1,442 @@
+"""
+Versioned schema migrations for the LegallyUp API.
+
+Each migration runs once per database and is recorded in the schema_version
+table. Apply them out-of-band with `flask --app app migrate` (see
+README.md) as a deploy step before the new code serves traffic; importing
+the app never touches the database. With SCHEMA_CHECK=warn (the default)
+the first request an instance serves reads the recorded version once and
+logs a schema that is behind. SCHEMA_CHECK=migrate applies anything pending
+there instead, which keeps fresh local databases working without a separate
+step, and SCHEMA_CHECK=off skips the check entirely.
+
+MySQL commits DDL implicitly, so migrations must be safe to re-run if a
+previous attempt died between a statement and its schema_version row; the
+early ones also have to accept databases created by the old import-time
+init_db().
+"""
+import logging
+import threading
+from datetime import datetime
+
+from mysql.connector import Error
+
+logger = logging.getLogger(__name__)
+
+# Serializes migrators across instances; see _run_locked()
+LOCK_NAME = 'legallyup_schema_migrations'
+LOCK_TIMEOUT = 60
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register the decorated function as the migration for version."""
+    def register(fn):
+        if MIGRATIONS and version <= MIGRATIONS[-1][0]:
+            raise ValueError(f'Migration {version} is out of order')
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+@migration(1, 'Core tables')
+def create_core_tables(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(255) NOT NULL,
+            email VARCHAR(255) NOT NULL UNIQUE,
+            password VARCHAR(255) NOT NULL,
+            verified BOOLEAN DEFAULT FALSE,
+            plan VARCHAR(32) DEFAULT 'free',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS templates (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            title VARCHAR(255) NOT NULL,
+            content TEXT NOT NULL,
+            is_trashed BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_generation_logs (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            document_type VARCHAR(255),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS consultations (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            user_name VARCHAR(255),
+            user_email VARCHAR(255),
+            attorney_id VARCHAR(32),
+            attorney_name VARCHAR(255),
+            full_name VARCHAR(255),
+            email VARCHAR(255),
+            phone VARCHAR(20),
+            preferred_date DATE,
+            preferred_time TIME,
+            reason_for_consult TEXT,
+            case_type VARCHAR(255),
+            status VARCHAR(255),
+            metadata TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS contact_forms (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            name VARCHAR(255) NOT NULL,
+            email VARCHAR(255) NOT NULL,
+            subject VARCHAR(255),
+            message TEXT NOT NULL,
+            submitted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE SET NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS payments (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            plan ENUM('free', 'pro', 'attorney') NOT NULL,
+            payment_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            amount DECIMAL(10, 2) NOT NULL,
+            status ENUM('success', 'failed') NOT NULL,
+            transaction_id VARCHAR(100) UNIQUE NOT NULL,
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS plan_changes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            old_plan VARCHAR(32) NOT NULL,
+            new_plan VARCHAR(32) NOT NULL,
+            payment_id INT,
+            change_reason ENUM('payment', 'system', 'expiration', 'user_request') NOT NULL,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (payment_id) REFERENCES payments(id) ON DELETE SET NULL
+        )
+    ''')
+
+
+@migration(2, 'Index daily generation lookups')
+def index_generation_logs(cursor):
+    # Daily quota lookups filter by user and a generated_at range
+    ensure_index(cursor, 'document_generation_logs', 'idx_generation_logs_user_time', 'user_id, generated_at')
+
+
+@migration(3, 'Index template listings for keyset pagination')
+def index_template_listings(cursor):
+    # Keyset pagination of a user's library, newest first
+    ensure_index(cursor, 'templates', 'idx_templates_user_trashed_created', 'user_id, is_trashed, created_at, id')
+
+
+@migration(4, 'Shared OTP store')
+def create_otp_codes(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS otp_codes (
+            email VARCHAR(255) PRIMARY KEY,
+            otp VARCHAR(12) NOT NULL,
+            purpose VARCHAR(16) NOT NULL,
+            expires_at DATETIME NOT NULL,
+            INDEX idx_otp_codes_expires (expires_at)
+        )
+    ''')
+
+
+@migration(5, 'Email outbox')
+def create_email_outbox(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            to_email VARCHAR(255) NOT NULL,
+            subject VARCHAR(255) NOT NULL,
+            html_content MEDIUMTEXT NOT NULL,
+            text_content MEDIUMTEXT,
+            status ENUM('pending', 'sent', 'failed') NOT NULL DEFAULT 'pending',
+            attempts INT NOT NULL DEFAULT 0,
+            next_attempt_at DATETIME NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at DATETIME NULL,
+            INDEX idx_email_outbox_due (status, next_attempt_at)
+        )
+    ''')
+
+
+@migration(6, 'Index payment lookups')
+def index_payments(cursor):
+    # Latest successful payment per user, newest first (subscription status)
+    ensure_index(cursor, 'payments', 'idx_payments_user_status_date', 'user_id, status, payment_date')
+    # Payment history and user-plan, newest first
+    ensure_index(cursor, 'payments', 'idx_payments_user_date', 'user_id, payment_date')
+
+
+@migration(7, 'Track template modification times')
+def add_template_updated_at(cursor):
+    # Maintained by MySQL on every update that changes the row (edit, trash,
+    # restore), so ETags follow the row without the routes having to set it
+    ensure_column(
+        cursor, 'templates', 'updated_at',
+        'TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)'
+    )
+    # Lets the listing ETag probe (COUNT, MAX(updated_at)) read only the index
+    ensure_index(cursor, 'templates', 'idx_templates_user_trashed_updated', 'user_id, is_trashed, updated_at')
+
+
+@migration(8, 'Full-text index for template search')
+def index_template_text(cursor):
+    # Backs /api/templates/search (MATCH ... AGAINST in boolean mode). The
+    # first FULLTEXT index rebuilds the table to add FTS_DOC_ID, so on a big
+    # templates table this takes a while.
+    ensure_index(cursor, 'templates', 'ft_templates_title_content', 'title, content', kind='FULLTEXT')
+
+
+@migration(9, 'Template revision history')
+def create_template_revisions(cursor):
+    # Past versions of templates.content, see revisions.py; body holds a
+    # full snapshot or a delta against the next newer version
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS template_revisions (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            template_id INT NOT NULL,
+            revision INT NOT NULL,
+            title VARCHAR(255) NOT NULL,
+            kind ENUM('snapshot', 'delta') NOT NULL,
+            body MEDIUMTEXT NOT NULL,
+            content_length INT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uq_template_revisions (template_id, revision),
+            FOREIGN KEY (template_id) REFERENCES templates(id) ON DELETE CASCADE
+        )
+    ''')
+
+
+@migration(10, 'Compressed template content')
+def compress_template_content(cursor):
+    # See content_store.py. content keeps the text of rows written before
+    # this until `flask backfill-template-content` compresses them.
+    ensure_column(cursor, 'templates', 'content_z', 'MEDIUMBLOB NULL')
+    ensure_column(cursor, 'templates', 'search_terms', 'TEXT NULL')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS content_dictionaries (
+            id TINYINT UNSIGNED PRIMARY KEY,
+            dictionary BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Search covers plain rows through content and compressed ones through
+    # their distinct words
+    drop_index(cursor, 'templates', 'ft_templates_title_content')
+    ensure_index(cursor, 'templates', 'ft_templates_search', 'title, content, search_terms', kind='FULLTEXT')
+
+
+
+@migration(11, 'Access token revocations')
+def create_token_revocations(cursor):
+    # See tokens.py: a row revokes one session, or (session_id NULL) every
+    # token issued to user_id before issued_before. Rows are useless once
+    # expires_at has passed.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS token_revocations (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            session_id VARCHAR(32) NULL,
+            user_id INT NULL,
+            issued_before DATETIME NULL,
+            expires_at DATETIME NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_token_revocations_expires (expires_at)
+        )
+    ''')
+
+
+@migration(12, 'Shared rate limit counters')
+def create_rate_limits(cursor):
+    # Used by RATE_LIMIT_STORE=mysql, see ratelimit.py; bucket is a SHA-1 hex
+    # digest and window_index the start of the window divided by its length
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            bucket CHAR(40) NOT NULL,
+            window_index BIGINT NOT NULL,
+            hits INT NOT NULL,
+            expires_at DATETIME NOT NULL,
+            PRIMARY KEY (bucket, window_index),
+            INDEX idx_rate_limits_expires (expires_at)
+        )
+    ''')
+
+
+@migration(13, 'Index subscription expiry sweeps')
+def index_subscription_expiry(cursor):
+    # The sweep's UPDATE joins back on the plan_changes rows it just wrote
+    ensure_index(cursor, 'plan_changes', 'idx_plan_changes_reason_changed', 'change_reason, changed_at')
+    # Paid users (plan != 'free'), a small share of users, as a range scan
+    ensure_index(cursor, 'users', 'idx_users_plan', 'plan')
+
+
+def ensure_column(cursor, table, name, definition):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """, (table, name))
+    if cursor.fetchone() is None:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+
+def ensure_index(cursor, table, name, columns, kind=''):
+    # MySQL has no CREATE INDEX IF NOT EXISTS
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, name))
+    if cursor.fetchone() is None:
+        cursor.execute(f"CREATE {kind + ' ' if kind else ''}INDEX {name} ON {table} ({columns})")
+
+
+def drop_index(cursor, table, name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, name))
+    if cursor.fetchone() is not None:
+        cursor.execute(f"DROP INDEX {name} ON {table}")
+
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(conn):
+    """Return the highest applied version, or 0 for a database without schema_version."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(version) FROM schema_version")
+        row = cursor.fetchone()
+    except Error as e:
+        if e.errno == 1146:  # ER_NO_SUCH_TABLE
+            return 0
+        raise
+    finally:
+        cursor.close()
+        # End the read snapshot so a later re-read sees other instances' work
+        conn.commit()
+    return row[0] or 0
+
+
+def pending_migrations(conn):
+    version = current_version(conn)
+    return [(v, description) for v, description, _ in MIGRATIONS if v > version]
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations up to target (default: all); returns the versions applied."""
+    return _run_locked(conn, lambda: _apply(conn, target))
+
+
+def _apply(conn, target):
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at DATETIME NOT NULL
+        )
+    ''')
+    # Re-read under the lock; another instance may have just finished
+    version = current_version(conn)
+    applied = []
+    for v, description, fn in MIGRATIONS:
+        if v <= version or (target is not None and v > target):
+            continue
+        fn(cursor)
+        cursor.execute(
+            "INSERT INTO schema_version (version, description, applied_at) VALUES (%s, %s, %s)",
+            (v, description, datetime.utcnow())
+        )
+        conn.commit()
+        applied.append(v)
+    cursor.close()
+    return applied
+
+
+def _run_locked(conn, fn):
+    # DDL commits implicitly, so a transaction cannot keep two instances from
+    # migrating at once; a named lock held by this session does instead.
+    cursor = conn.cursor()
+    cursor.execute("SELECT GET_LOCK(%s, %s)", (LOCK_NAME, LOCK_TIMEOUT))
+    (locked,) = cursor.fetchone()
+    if locked != 1:
+        cursor.close()
+        raise Error(msg=f'Timed out waiting for the {LOCK_NAME} lock')
+    try:
+        return fn()
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+        cursor.fetchone()
+        cursor.close()
+
+
+class SchemaCheck:
+    """
+    One schema version check per process, done on the first request.
+
+    Once the database is known to be current no further queries are made.
+    A failed check is retried on the next request.
+    """
+
+    def __init__(self, pool, mode='warn'):
+        if mode not in ('migrate', 'warn', 'off'):
+            raise ValueError(f'Unknown SCHEMA_CHECK mode: {mode}')
+        self.pool = pool
+        self.mode = mode
+        self.checked = mode == 'off'
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self.checked:
+            return
+        with self._lock:
+            if self.checked:
+                return
+            try:
+                with self.pool.connection() as conn:
+                    self._check(conn)
+                self.checked = True
+            except Error:
+                logger.exception('Schema check error')
+
+    def _check(self, conn):
+        if current_version(conn) >= latest_version():
+            return
+        if self.mode == 'warn':
+            logger.warning(
+                'Database schema is behind; run `flask --app app migrate`',
+                extra={'pending': pending_migrations(conn)}
+            )
+            return
+        applied = migrate(conn)
+        if applied:
+            logger.info('Applied schema migrations', extra={'versions': applied})
+
+
+def init_app(app, pool, mode='warn'):
+    """Check the schema version once, before the first request this process serves."""
+    check = SchemaCheck(pool, mode)
+    app.extensions['schema_check'] = check
+    app.before_request(check)
+    return check
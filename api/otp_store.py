@@ -0,0 +1,171 @@
+"""
+Storage backends for one-time passwords.
+
+send-otp, verify-otp, register and reset-password can land on different
+serverless instances, so production uses the MySQL backend; the in-memory
+backend suits local development and single-process deployments.
+Records are dicts with 'otp', 'purpose' and 'expires' (a naive UTC datetime).
+"""
+import heapq
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+
+class OTPStore(ABC):
+    """Interface shared by the OTP backends."""
+
+    @abstractmethod
+    def set(self, email, otp, purpose, expires):
+        """Store a record for email, replacing any earlier one."""
+
+    @abstractmethod
+    def get(self, email):
+        """Return the live record for email, or None if missing or expired."""
+
+    @abstractmethod
+    def delete(self, email):
+        """Remove email's record, if any."""
+
+    @abstractmethod
+    def purge_expired(self):
+        """Remove expired records; returns how many were removed."""
+
+
+class MemoryOTPStore(OTPStore):
+    """
+    Process-local store with TTL eviction and a size cap.
+
+    Expiry times sit in a min-heap next to the records, so purging only looks
+    at entries that are actually due. A record that was overwritten leaves a
+    stale heap entry behind, which is skipped when it surfaces.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._records = {}
+        self._expiry_heap = []
+        self._lock = threading.Lock()
+
+    def set(self, email, otp, purpose, expires):
+        record = {'otp': otp, 'purpose': purpose, 'expires': expires}
+        with self._lock:
+            self._purge_locked(datetime.utcnow())
+            if email not in self._records and len(self._records) >= self.max_entries:
+                self._evict_soonest_locked()
+            self._records[email] = record
+            heapq.heappush(self._expiry_heap, (expires, email))
+
+    def get(self, email):
+        with self._lock:
+            record = self._records.get(email)
+            if record is None:
+                return None
+            if record['expires'] < datetime.utcnow():
+                del self._records[email]
+                return None
+            return dict(record)
+
+    def delete(self, email):
+        with self._lock:
+            self._records.pop(email, None)
+
+    def purge_expired(self):
+        with self._lock:
+            return self._purge_locked(datetime.utcnow())
+
+    def __len__(self):
+        return len(self._records)
+
+    def _purge_locked(self, now):
+        removed = 0
+        while self._expiry_heap and self._expiry_heap[0][0] < now:
+            expires, email = heapq.heappop(self._expiry_heap)
+            record = self._records.get(email)
+            if record is not None and record['expires'] == expires:
+                del self._records[email]
+                removed += 1
+        return removed
+
+    def _evict_soonest_locked(self):
+        while self._expiry_heap:
+            expires, email = heapq.heappop(self._expiry_heap)
+            record = self._records.get(email)
+            if record is not None and record['expires'] == expires:
+                del self._records[email]
+                return
+
+
+class MySQLOTPStore(OTPStore):
+    """
+    Store backed by the otp_codes table, shared by every instance.
+
+    connect is a callable returning a connection (get_db inside a request).
+    Expired rows are removed in bulk at most once per purge_interval seconds
+    per instance, using the index on expires_at.
+    """
+
+    def __init__(self, connect, purge_interval=300, purge_batch=1000):
+        self._connect = connect
+        self.purge_interval = purge_interval
+        self.purge_batch = purge_batch
+        self._next_purge = 0.0
+
+    def set(self, email, otp, purpose, expires):
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO otp_codes (email, otp, purpose, expires_at)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE otp = VALUES(otp), purpose = VALUES(purpose), expires_at = VALUES(expires_at)
+        """, (email, otp, purpose, expires))
+        conn.commit()
+        cursor.close()
+        if time.monotonic() >= self._next_purge:
+            self.purge_expired()
+
+    def get(self, email):
+        conn = self._connect()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT otp, purpose, expires_at AS expires
+            FROM otp_codes
+            WHERE email = %s AND expires_at >= %s
+        """, (email, datetime.utcnow()))
+        record = cursor.fetchone()
+        cursor.close()
+        return record
+
+    def delete(self, email):
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM otp_codes WHERE email = %s", (email,))
+        conn.commit()
+        cursor.close()
+
+    def purge_expired(self):
+        self._next_purge = time.monotonic() + self.purge_interval
+        conn = self._connect()
+        cursor = conn.cursor()
+        removed = 0
+        while True:
+            cursor.execute(
+                "DELETE FROM otp_codes WHERE expires_at < %s LIMIT %s",
+                (datetime.utcnow(), self.purge_batch),
+            )
+            conn.commit()
+            removed += cursor.rowcount
+            if cursor.rowcount < self.purge_batch:
+                break
+        cursor.close()
+        return removed
+
+
+def create_otp_store(backend, connect=None):
+    """Build the backend named by OTP_STORE ('mysql' or 'memory')."""
+    if backend == 'memory':
+        return MemoryOTPStore()
+    if backend == 'mysql':
+        return MySQLOTPStore(connect)
+    raise ValueError(f'Unknown OTP store backend: {backend}')
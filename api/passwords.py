@@ -0,0 +1,123 @@
+"""
+Password hashing for users.password.
+
+Passwords are hashed with scrypt and stored as
+
+    scrypt$<log2 N>$<r>$<p>$<salt>$<hash>
+
+with the salt and hash base64-encoded. Rows from before hashing hold the
+plaintext password; verify still accepts them, and login rewrites them (and
+any hash made with other cost parameters) once the password has checked out.
+
+scrypt is deliberately slow and memory hungry, so hashing runs on a small
+worker pool rather than in the request thread: at most `workers` hashes run
+at once, which bounds the CPU and memory logins can take from other routes
+(hashlib.scrypt releases the GIL, so those requests keep being served). At
+most `max_pending` more wait for a worker; beyond that PasswordHasherBusy is
+raised straight away instead of queueing requests that would time out.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+PREFIX = 'scrypt'
+
+
+class PasswordHasherBusy(Exception):
+    """Every worker is busy and the wait queue is full."""
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords on a bounded pool of worker threads.
+
+    log_n is the scrypt cost: each increment doubles the time and memory a
+    hash takes (2**14 with r=8 is about 16 MB).
+    """
+
+    def __init__(self, log_n=14, r=8, p=1, workers=2, max_pending=32):
+        self.log_n = log_n
+        self.r = r
+        self.p = p
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hasher')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._counters = {'hashes': 0, 'verifications': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+        self._decoy_hash = None
+
+    def hash(self, password):
+        """Return the stored form of password."""
+        salt = os.urandom(16)
+        key = self._run('hashes', password, salt, self.log_n, self.r, self.p)
+        return '$'.join((PREFIX, str(self.log_n), str(self.r), str(self.p), _b64(salt), _b64(key)))
+
+    def verify(self, password, stored):
+        """
+        Check password against a stored hash or legacy plaintext value.
+
+        stored None (no such user) is checked against a decoy hash, so it
+        takes as long as a wrong password, and fails.
+        """
+        if stored is None:
+            self.verify(password, self._decoy())
+            return False
+        if not is_hashed(stored):
+            return hmac.compare_digest(password.encode(), stored.encode())
+        try:
+            _, log_n, r, p, salt, expected = stored.split('$')
+            log_n, r, p = int(log_n), int(r), int(p)
+            salt, expected = _unb64(salt), _unb64(expected)
+        except ValueError:
+            return False
+        key = self._run('verifications', password, salt, log_n, r, p)
+        return hmac.compare_digest(key, expected)
+
+    def needs_rehash(self, stored):
+        """True for plaintext rows and hashes made with other cost parameters."""
+        return not stored.startswith(f'{PREFIX}${self.log_n}${self.r}${self.p}$')
+
+    def stats(self):
+        with self._lock:
+            return {**self._counters, 'workers': self.workers, 'log_n': self.log_n}
+
+    def _decoy(self):
+        if self._decoy_hash is None:
+            self._decoy_hash = self.hash(os.urandom(16).hex())
+        return self._decoy_hash
+
+    def _run(self, counter, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counters['rejected'] += 1
+            raise PasswordHasherBusy('Too many password checks in progress')
+        try:
+            result = self._executor.submit(_scrypt, *args).result()
+        finally:
+            self._slots.release()
+        with self._lock:
+            self._counters[counter] += 1
+        return result
+
+
+def is_hashed(stored):
+    return stored.startswith(PREFIX + '$')
+
+
+def _scrypt(password, salt, log_n, r, p):
+    n = 1 << log_n
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, dklen=32,
+        maxmem=128 * r * (n + p + 2) + 1024 * 1024
+    )
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _unb64(value):
+    return base64.b64decode(value + '=' * (-len(value) % 4))
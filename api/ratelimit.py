@@ -0,0 +1,325 @@
+"""
+Request rate limiting for the LegallyUp API.
+
+Endpoints that send email or check credentials (send-otp, login, contact,
+...) are limited per client IP, per email address and/or per user. A
+request over any of its endpoint's limits is answered with 429 and a
+Retry-After header from a before_request hook, so it never reaches the
+route's queries or the mail queue.
+
+Limits are sliding windows, approximated the usual way from two fixed
+windows: the count of the current window plus the previous window's count
+weighted by how much of it still overlaps the sliding one. That needs three
+numbers per key, is O(1) per check and is never off by more than the
+previous window's share. All of an endpoint's limits are checked before
+any is counted, and a rejected request is counted against none of them: a
+client that backs off gets through again, and hammering one email address
+does not use up the IP's allowance for other addresses.
+
+The memory store is per instance; the MySQL store shares the counts between
+serverless instances at the cost of two queries per limited request.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+from flask import jsonify, request
+from mysql.connector import Error
+
+from tokens import current_caller
+
+logger = logging.getLogger(__name__)
+
+
+def client_ip(proxies=1):
+    """
+    The client address, taken from X-Forwarded-For when the app runs behind
+    proxies (Vercel adds one entry): the entry that many hops from the
+    right, which the client cannot forge.
+    """
+    forwarded = [part.strip() for part in request.headers.get('X-Forwarded-For', '').split(',') if part.strip()]
+    if proxies and len(forwarded) >= proxies:
+        return forwarded[-proxies]
+    return request.remote_addr
+
+
+def request_email():
+    body = request.get_json(silent=True)
+    email = body.get('email') if isinstance(body, dict) else None
+    return email.strip().lower() if isinstance(email, str) and email.strip() else None
+
+
+def request_user_id():
+    caller = current_caller()
+    if caller is not None:
+        return str(caller.user_id)
+    body = request.get_json(silent=True)
+    user_id = body.get('user_id') if isinstance(body, dict) else None
+    user_id = user_id or request.args.get('user_id')
+    return str(user_id) if user_id else None
+
+
+class RateLimitStore(ABC):
+    """Interface shared by the rate limit backends."""
+
+    def hit(self, bucket, limit, window):
+        """
+        Count a request against bucket if it is within limit per window
+        seconds. Returns (allowed, retry_after seconds).
+        """
+        retry_after, = self.hit_all([(bucket, limit, window)])
+        return retry_after == 0, retry_after
+
+    @abstractmethod
+    def hit_all(self, rules):
+        """
+        Count a request against every (bucket, limit, window seconds) in
+        rules if it is within all of them, and against none otherwise.
+        Returns, per rule, the seconds until it would let the request
+        through (0 where it already does).
+        """
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    Per-process counts: {bucket: (window index, count, previous count, expires)}.
+
+    Buckets idle for two windows are dropped at most every purge_interval
+    seconds; past max_keys the ones closest to expiring go first.
+    """
+
+    def __init__(self, max_keys=100000, purge_interval=60):
+        self.max_keys = max_keys
+        self.purge_interval = purge_interval
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + purge_interval
+
+    def hit_all(self, rules):
+        now = time.time()
+        with self._lock:
+            if time.monotonic() >= self._next_purge or len(self._buckets) >= self.max_keys:
+                self._purge_locked(now)
+            decisions = []
+            for bucket, limit, window in rules:
+                index = int(now // window)
+                count, previous = _roll(self._buckets.get(bucket), index)
+                _, retry_after = _decide(count, previous, limit, window, now)
+                decisions.append((bucket, window, index, count, previous, retry_after))
+            if not any(decision[-1] for decision in decisions):
+                for bucket, window, index, count, previous, _ in decisions:
+                    self._buckets[bucket] = (index, count + 1, previous, (index + 2) * window)
+            return [decision[-1] for decision in decisions]
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _purge_locked(self, now):
+        self._next_purge = time.monotonic() + self.purge_interval
+        self._buckets = {bucket: entry for bucket, entry in self._buckets.items() if entry[3] > now}
+        if len(self._buckets) >= self.max_keys:
+            soonest = sorted(self._buckets, key=lambda bucket: self._buckets[bucket][3])
+            for bucket in soonest[:max(1, self.max_keys // 10)]:
+                del self._buckets[bucket]
+
+
+class MySQLRateLimitStore(RateLimitStore):
+    """
+    Counts in the rate_limits table, shared by every instance.
+
+    connect is a callable returning a connection (get_db inside a request).
+    Buckets are stored as SHA-1 digests, so no addresses or emails are
+    kept. Concurrent requests may overshoot a limit by the number racing.
+    """
+
+    def __init__(self, connect, purge_interval=300, purge_batch=1000):
+        self._connect = connect
+        self.purge_interval = purge_interval
+        self.purge_batch = purge_batch
+        self._next_purge = 0.0
+
+    def hit_all(self, rules):
+        now = time.time()
+        conn = self._connect()
+        cursor = conn.cursor()
+        decisions = []
+        for bucket, limit, window in rules:
+            index = int(now // window)
+            digest = hashlib.sha1(bucket.encode()).hexdigest()
+            cursor.execute("""
+                SELECT window_index, hits FROM rate_limits
+                WHERE bucket = %s AND window_index IN (%s, %s)
+            """, (digest, index - 1, index))
+            counts = dict(cursor.fetchall())
+            _, retry_after = _decide(counts.get(index, 0), counts.get(index - 1, 0), limit, window, now)
+            decisions.append((digest, window, index, retry_after))
+        if not any(decision[-1] for decision in decisions):
+            for digest, window, index, _ in decisions:
+                cursor.execute("""
+                    INSERT INTO rate_limits (bucket, window_index, hits, expires_at)
+                    VALUES (%s, %s, 1, %s)
+                    ON DUPLICATE KEY UPDATE hits = hits + 1
+                """, (digest, index, datetime.utcfromtimestamp((index + 2) * window)))
+        conn.commit()
+        cursor.close()
+        if time.monotonic() >= self._next_purge:
+            self.purge_expired()
+        return [decision[-1] for decision in decisions]
+
+    def purge_expired(self):
+        self._next_purge = time.monotonic() + self.purge_interval
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM rate_limits WHERE expires_at < %s LIMIT %s", (datetime.utcnow(), self.purge_batch)
+        )
+        conn.commit()
+        removed = cursor.rowcount
+        cursor.close()
+        return removed
+
+
+def _roll(entry, index):
+    """(count, previous count) of a bucket as of window index."""
+    if entry is None or entry[0] < index - 1:
+        return 0, 0
+    if entry[0] == index - 1:
+        return 0, entry[1]
+    return entry[1], entry[2]
+
+
+def _decide(count, previous, limit, window, now):
+    """Whether one more request fits, and if not how long until it would."""
+    elapsed = (now % window) / window
+    if previous * (1 - elapsed) + count + 1 <= limit:
+        return True, 0
+    if count + 1 <= limit:
+        # Wait for the previous window's weight to shrink enough
+        wait = (1 - (limit - count - 1) / previous) - elapsed
+    else:
+        # Wait for this window to become the previous one and shrink
+        wait = (1 - elapsed) + max(0.0, 1 - (limit - 1) / count)
+    # Rounded first so float noise (1 - 2/3 = 0.33333333333333337) adds no extra second
+    return False, max(1, math.ceil(round(wait * window, 6)))
+
+
+def parse_limits(spec):
+    """
+    Parse "endpoint.key=limit/window,..." into {endpoint: {key: (limit, window)}}.
+
+    key is ip, email or user_id and window is in seconds; "endpoint.key=off"
+    removes a default limit.
+    """
+    limits = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        name, _, value = item.strip().rpartition('=')
+        endpoint, _, key = name.strip().rpartition('.')
+        if key not in KEY_FUNCTIONS or not endpoint:
+            raise ValueError(f'Unknown rate limit key: {name}')
+        if value.strip() == 'off':
+            limits.setdefault(endpoint, {})[key] = None
+            continue
+        limit, _, window = value.partition('/')
+        limit, window = int(limit), int(window)
+        if limit < 1 or window < 1:
+            raise ValueError(f'Invalid rate limit for {name}: {value}')
+        limits.setdefault(endpoint, {})[key] = (limit, window)
+    return limits
+
+
+class RateLimiter:
+    """
+    Applies per-endpoint limits, keyed as in KEY_FUNCTIONS.
+
+    limits is {endpoint: {key: (limit, window seconds)}}; a None entry
+    disables that key. overrides (from parse_limits) are merged over it.
+    """
+
+    def __init__(self, store, limits, overrides=None, proxies=1):
+        self.store = store
+        self.proxies = proxies
+        merged = {endpoint: dict(keys) for endpoint, keys in limits.items()}
+        for endpoint, keys in (overrides or {}).items():
+            merged.setdefault(endpoint, {}).update(keys)
+        self.limits = {
+            endpoint: [(key, rule) for key, rule in keys.items() if rule is not None]
+            for endpoint, keys in merged.items()
+        }
+        self._counters = {'allowed': 0, 'limited': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+    def check(self, endpoint):
+        """None if the request may go ahead, else seconds until it may be retried."""
+        rules = self.limits.get(endpoint)
+        if not rules:
+            return None
+        keyed = []
+        for key, (limit, window) in rules:
+            value = client_ip(self.proxies) if key == 'ip' else KEY_FUNCTIONS[key]()
+            if value is not None:
+                keyed.append((key, (f'{endpoint}.{key}:{value}', limit, window)))
+        if not keyed:
+            self._count('allowed')
+            return None
+        try:
+            waits = self.store.hit_all([rule for _, rule in keyed])
+        except Error:
+            # Better to serve the request than to fail it for the limiter
+            logger.exception('Rate limit store error')
+            self._count('errors')
+            return None
+        retry_after = max(waits)
+        if retry_after:
+            self._count('limited')
+            limited = ','.join(key for (key, _), wait in zip(keyed, waits) if wait)
+            logger.info('Rate limited', extra={'limit_key': limited, 'retry_after': retry_after})
+            return retry_after
+        self._count('allowed')
+        return None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+KEY_FUNCTIONS = {
+    'ip': client_ip,
+    'email': request_email,
+    'user_id': request_user_id,
+}
+
+
+def create_rate_limit_store(backend, connect=None):
+    """Build the backend named by RATE_LIMIT_STORE ('memory' or 'mysql')."""
+    if backend == 'memory':
+        return MemoryRateLimitStore()
+    if backend == 'mysql':
+        return MySQLRateLimitStore(connect)
+    raise ValueError(f'Unknown rate limit store backend: {backend}')
+
+
+def init_app(app, limiter):
+    """Reject requests over their endpoint's limits before the route runs."""
+    app.extensions['rate_limiter'] = limiter
+
+    @app.before_request
+    def enforce_rate_limits():
+        if request.method == 'OPTIONS':
+            return None
+        retry_after = limiter.check(request.endpoint)
+        if retry_after is None:
+            return None
+        response = jsonify({'error': 'Too many requests, please retry later'})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
@@ -0,0 +1,131 @@
+"""
+Revision history for template content.
+
+Every update_template call that changes a template first records the
+version it replaces in template_revisions. The current version lives only
+in the templates row; past versions are stored as reverse deltas, RCS
+style: revision n holds the edits that turn revision n + 1 (or the current
+content, for the newest revision) back into revision n. Recording a
+revision therefore only diffs the old content against the new one, and
+the most recent drafts, the ones usually restored, are the cheapest to
+rebuild.
+
+Every SNAPSHOT_INTERVAL-th revision is stored in full, so rebuilding any
+revision applies at most SNAPSHOT_INTERVAL deltas. Nothing depends on
+older revisions, so retention just deletes the oldest ones.
+
+A delta is a JSON list over the lines of the newer text: a positive int
+copies that many lines, a negative int skips that many, and a string is
+inserted as is.
+"""
+import difflib
+import json
+
+SNAPSHOT_INTERVAL = 16
+
+
+def make_delta(newer, older):
+    """Encode the edits that turn newer into older."""
+    newer_lines = newer.splitlines(keepends=True)
+    older_lines = older.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, newer_lines, older_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(-(i2 - i1))
+        if j2 > j1:
+            ops.append(''.join(older_lines[j1:j2]))
+    return json.dumps(ops, separators=(',', ':'))
+
+
+def apply_delta(newer, delta):
+    """Rebuild the older text from newer and a delta made by make_delta."""
+    lines = newer.splitlines(keepends=True)
+    out = []
+    position = 0
+    for op in json.loads(delta):
+        if isinstance(op, str):
+            out.append(op)
+        elif op > 0:
+            out.extend(lines[position:position + op])
+            position += op
+        else:
+            position -= op
+    return ''.join(out)
+
+
+def record_revision(conn, template_id, title, content, new_content, keep):
+    """
+    Store the version (title, content) being replaced by new_content.
+
+    Must run in the transaction that updates the template, after its row
+    has been locked, so revision numbers cannot collide. Keeps the newest
+    keep revisions. Returns the new revision number.
+    """
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(
+        "SELECT COALESCE(MAX(revision), 0) AS latest FROM template_revisions WHERE template_id = %s",
+        (template_id,)
+    )
+    revision = cursor.fetchone()['latest'] + 1
+    delta = make_delta(new_content, content)
+    if revision % SNAPSHOT_INTERVAL == 0 or len(delta) >= len(content):
+        kind, body = 'snapshot', content
+    else:
+        kind, body = 'delta', delta
+    cursor.execute("""
+        INSERT INTO template_revisions (template_id, revision, title, kind, body, content_length)
+        VALUES (%s, %s, %s, %s, %s, %s)
+    """, (template_id, revision, title, kind, body, len(content)))
+    if revision > keep:
+        cursor.execute(
+            "DELETE FROM template_revisions WHERE template_id = %s AND revision <= %s",
+            (template_id, revision - keep)
+        )
+    cursor.close()
+    return revision
+
+
+def materialize(conn, template_id, revision, codec):
+    """
+    Return {'title', 'content'} of a revision, or None if it does not exist.
+
+    Reads the nearest snapshot at or above the revision (or the current
+    content, decompressed by codec, if there is none) and the deltas in
+    between.
+    """
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("""
+        SELECT MIN(revision) AS snapshot FROM template_revisions
+        WHERE template_id = %s AND revision >= %s AND kind = 'snapshot'
+    """, (template_id, revision))
+    snapshot = cursor.fetchone()['snapshot']
+    content = None
+    if snapshot is None:
+        cursor.execute("SELECT content, content_z FROM templates WHERE id = %s", (template_id,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.close()
+            return None
+        content = codec.decode(row['content'], row['content_z'])
+        cursor.execute("""
+            SELECT revision, title, kind, body FROM template_revisions
+            WHERE template_id = %s AND revision >= %s
+            ORDER BY revision DESC
+        """, (template_id, revision))
+    else:
+        cursor.execute("""
+            SELECT revision, title, kind, body FROM template_revisions
+            WHERE template_id = %s AND revision BETWEEN %s AND %s
+            ORDER BY revision DESC
+        """, (template_id, revision, snapshot))
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows or rows[-1]['revision'] != revision:
+        return None
+    for row in rows:
+        content = row['body'] if row['kind'] == 'snapshot' else apply_delta(content, row['body'])
+    return {'title': rows[-1]['title'], 'content': content}
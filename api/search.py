@@ -0,0 +1,216 @@
+"""
+Full-text search over a user's templates.
+
+Production uses the FULLTEXT index on templates (title, content,
+search_terms) in boolean mode: every query word is required and matches as a prefix, so "confid agree"
+finds "confidentiality agreement". The in-memory backend builds a per-user
+inverted index from the same rows for local development against databases
+without FULLTEXT support. It tokenizes and ranks the way InnoDB does closely
+enough for testing, not identically.
+
+Compressed templates (see content_store.py) keep their distinct words in
+search_terms for the index; plain-text rows not yet backfilled are still
+indexed through content. Each word counts once per compressed document, so
+their ranking depends on how rare the words are, not how often they occur.
+
+Hits are dicts with the template's id, title, content, is_trashed,
+created_at, updated_at and a relevance score, best match first.
+"""
+import html
+import math
+import re
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
+
+# InnoDB's defaults: innodb_ft_min_token_size and the built-in stopword list
+MIN_TERM_LENGTH = 3
+STOPWORDS = frozenset({
+    'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for', 'from', 'how', 'i',
+    'in', 'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'what', 'when',
+    'where', 'who', 'will', 'with', 'und', 'www',
+})
+MAX_TERMS = 10
+
+WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return [
+        word for word in WORD.findall((text or '').lower())
+        if len(word) >= MIN_TERM_LENGTH and word not in STOPWORDS
+    ]
+
+
+def search_terms(query):
+    """The distinct searchable words of a user's query, in order, at most MAX_TERMS."""
+    return list(dict.fromkeys(tokenize(query)))[:MAX_TERMS]
+
+
+def index_terms(text):
+    """The distinct indexable words of a document, for templates.search_terms."""
+    return ' '.join(sorted(set(tokenize(text))))
+
+
+def highlight(text, terms, width=200):
+    """
+    An HTML-escaped excerpt of text around the first match, matches wrapped in <mark>.
+
+    Falls back to the start of text when no term occurs in it (a title-only
+    match).
+    """
+    text = text or ''
+    pattern = re.compile(r'\b(?:' + '|'.join(map(re.escape, terms)) + r')\w*', re.IGNORECASE)
+    first = pattern.search(text)
+    start = max(0, first.start() - width // 4) if first else 0
+    if start:
+        # Begin at a word boundary
+        space = text.find(' ', start, first.start())
+        if space != -1:
+            start = space + 1
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.rfind(' ', start, end)
+        end = space if space > start else end
+    excerpt = text[start:end]
+    parts = []
+    last = 0
+    for match in pattern.finditer(excerpt):
+        parts.append(html.escape(excerpt[last:match.start()]))
+        parts.append('<mark>' + html.escape(match.group()) + '</mark>')
+        last = match.end()
+    parts.append(html.escape(excerpt[last:]))
+    return ('…' if start else '') + ''.join(parts) + ('…' if end < len(text) else '')
+
+
+class TemplateSearch(ABC):
+    """Interface shared by the search backends."""
+
+    @abstractmethod
+    def search(self, user_id, trashed, terms, limit, offset=0):
+        """Return up to limit hits matching every term, skipping the first offset."""
+
+
+class MySQLTemplateSearch(TemplateSearch):
+    """
+    Search through the ft_templates_search FULLTEXT index.
+
+    connect is a callable returning a connection (get_db inside a request);
+    codec is the ContentCodec that decompresses content.
+    """
+
+    def __init__(self, connect, codec):
+        self._connect = connect
+        self._codec = codec
+
+    def search(self, user_id, trashed, terms, limit, offset=0):
+        against = ' '.join(f'+{term}*' for term in terms)
+        cursor = self._connect().cursor(dictionary=True)
+        cursor.execute("""
+            SELECT id, title, content, content_z, is_trashed, created_at, updated_at,
+                MATCH(title, content, search_terms) AGAINST (%s IN BOOLEAN MODE) AS score
+            FROM templates
+            WHERE user_id = %s AND is_trashed = %s
+            AND MATCH(title, content, search_terms) AGAINST (%s IN BOOLEAN MODE)
+            ORDER BY score DESC, id DESC
+            LIMIT %s OFFSET %s
+        """, (against, user_id, trashed, against, limit, offset))
+        hits = [self._codec.decode_row(row) for row in cursor.fetchall()]
+        cursor.close()
+        return hits
+
+
+class _UserIndex:
+    def __init__(self, rows):
+        self.docs = {row['id']: row for row in rows}
+        self.postings = defaultdict(dict)
+        for row in rows:
+            for word, count in Counter(tokenize(row['title']) + tokenize(row['content'])).items():
+                self.postings[word][row['id']] = count
+        self.vocabulary = sorted(self.postings)
+
+    def expand(self, term):
+        """Indexed words starting with term."""
+        i = bisect_left(self.vocabulary, term)
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(term):
+            yield self.vocabulary[i]
+            i += 1
+
+    def search(self, terms):
+        scores = None
+        for term in terms:
+            term_scores = defaultdict(float)
+            for word in self.expand(term):
+                docs = self.postings[word]
+                # InnoDB's ranking: term frequency times idf squared
+                idf = math.log10(len(self.docs) / len(docs))
+                for doc_id, count in docs.items():
+                    term_scores[doc_id] += count * idf * idf
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {doc_id: score + term_scores[doc_id] for doc_id, score in scores.items()
+                          if doc_id in term_scores}
+            if not scores:
+                return []
+        ranked = sorted((scores or {}).items(), key=lambda item: (-item[1], -item[0]))
+        return [dict(self.docs[doc_id], score=score) for doc_id, score in ranked]
+
+
+class MemoryTemplateSearch(TemplateSearch):
+    """
+    Per-user inverted indexes built on demand from the templates table.
+
+    An index is rebuilt when the user's row count or newest updated_at
+    changes (the same probe as the template list ETag), and at most
+    max_users indexes are kept, least recently used first out.
+    """
+
+    def __init__(self, connect, codec, max_users=256):
+        self._connect = connect
+        self._codec = codec
+        self.max_users = max_users
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def search(self, user_id, trashed, terms, limit, offset=0):
+        hits = self._index(user_id, trashed).search(terms)
+        return hits[offset:offset + limit]
+
+    def _index(self, user_id, trashed):
+        key = (str(user_id), bool(trashed))
+        cursor = self._connect().cursor(dictionary=True)
+        cursor.execute("""
+            SELECT COUNT(*) AS total, MAX(updated_at) AS last_updated
+            FROM templates WHERE user_id = %s AND is_trashed = %s
+        """, (user_id, trashed))
+        version = cursor.fetchone()
+        version = (version['total'], version['last_updated'])
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is not None and cached[0] == version:
+                self._indexes.move_to_end(key)
+                cursor.close()
+                return cached[1]
+        cursor.execute("""
+            SELECT id, title, content, content_z, is_trashed, created_at, updated_at
+            FROM templates WHERE user_id = %s AND is_trashed = %s
+        """, (user_id, trashed))
+        index = _UserIndex([self._codec.decode_row(row) for row in cursor.fetchall()])
+        cursor.close()
+        with self._lock:
+            self._indexes[key] = (version, index)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+
+def create_template_search(backend, connect, codec):
+    """Build the backend named by TEMPLATE_SEARCH ('mysql' or 'memory')."""
+    if backend == 'memory':
+        return MemoryTemplateSearch(connect, codec)
+    if backend == 'mysql':
+        return MySQLTemplateSearch(connect, codec)
+    raise ValueError(f'Unknown template search backend: {backend}')
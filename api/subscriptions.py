@@ -0,0 +1,64 @@
+"""
+Batch maintenance jobs for subscriptions.
+
+Runs from the `flask expire-subscriptions` CLI command and from the
+/api/cron/expire-subscriptions endpoint, so request handlers never have to
+write when they discover a lapsed plan.
+"""
+from datetime import datetime, timedelta
+
+SUBSCRIPTION_DAYS = 30
+
+# Users on a paid plan whose latest successful paid payment is older than the
+# cutoff (or who have no such payment at all).
+_EXPIRED_USERS = """
+    FROM users u
+    LEFT JOIN (
+        SELECT user_id, MAX(payment_date) AS last_paid
+        FROM payments
+        WHERE status = 'success'
+        AND plan != 'free'
+        GROUP BY user_id
+    ) p ON p.user_id = u.id
+    WHERE u.plan != 'free'
+    AND (p.last_paid IS NULL OR p.last_paid < %s)
+"""
+
+
+def expire_subscriptions(conn, now=None):
+    """
+    Downgrade every lapsed paid subscription to the free plan in one transaction.
+
+    The affected users are first recorded in plan_changes with a shared
+    changed_at marker; the UPDATE then joins on those rows (through
+    idx_plan_changes_reason_changed), so the audit trail and the downgrades
+    always cover exactly the same users.
+    Returns the number of users downgraded.
+    """
+    now = (now or datetime.utcnow()).replace(microsecond=0)
+    cutoff = now - timedelta(days=SUBSCRIPTION_DAYS)
+    cursor = conn.cursor()
+    try:
+        conn.start_transaction()
+        cursor.execute("""
+            INSERT INTO plan_changes (user_id, old_plan, new_plan, change_reason, changed_at)
+            SELECT u.id, u.plan, 'free', 'expiration', %s
+        """ + _EXPIRED_USERS, (now, cutoff))
+        logged = cursor.rowcount
+        if logged:
+            cursor.execute("""
+                UPDATE users u
+                JOIN plan_changes pc
+                    ON pc.user_id = u.id
+                    AND pc.change_reason = 'expiration'
+                    AND pc.changed_at = %s
+                SET u.plan = 'free'
+                WHERE u.plan != 'free'
+            """, (now,))
+        conn.commit()
+        return logged
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
@@ -0,0 +1,79 @@
+import pytest
+
+import caches
+from caches import DailyCounterCache, MemoryCounterBackend
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Noon UTC, so the day does not end during a test
+    clock = FakeClock(1_700_000_000 - 1_700_000_000 % 86400 + 43200)
+    monkeypatch.setattr(caches.time, 'time', clock.time)
+    return clock
+
+
+def test_counter_is_cached_and_incremented(clock):
+    cache = DailyCounterCache(ttl=60)
+    assert cache.get(1, lambda: 2) == 2
+    cache.incr(1)
+    assert cache.get(1, lambda: pytest.fail('should be cached')) == 3
+    assert cache.stats()['hits'] == 1
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = DailyCounterCache(ttl=60)
+    cache.get(1, lambda: 2)
+    clock.now += 61
+    # A generation recorded by another instance shows up once the entry expires
+    assert cache.get(1, lambda: 3) == 3
+
+
+def test_load_overlapping_incr_is_not_cached(clock):
+    cache = DailyCounterCache(ttl=60)
+
+    def stale_load():
+        # The generation commits (and is counted) while this load reads the old count
+        cache.incr(1)
+        return 0
+
+    assert cache.get(1, stale_load) == 0
+    clock.now += 1
+    assert cache.get(1, lambda: 1) == 1
+    assert cache.get(1, lambda: pytest.fail('should be cached')) == 1
+
+
+def test_load_does_not_replace_newer_entry(clock):
+    cache = DailyCounterCache(ttl=60)
+
+    def slow_load():
+        # Another request loads and caches the current count meanwhile
+        cache.get(1, lambda: 5)
+        return 4
+
+    assert cache.get(1, slow_load) == 4
+    assert cache.get(1, lambda: pytest.fail('should be cached')) == 5
+
+
+def test_incr_without_entry_does_nothing(clock):
+    cache = DailyCounterCache(ttl=60)
+    cache.incr(1)
+    clock.now += 1
+    assert cache.get(1, lambda: 7) == 7
+
+
+def test_backend_add(clock):
+    backend = MemoryCounterBackend()
+    assert backend.add('k', 1, clock.now + 10)
+    assert not backend.add('k', 2, clock.now + 10)
+    assert backend.get('k') == 1
+    clock.now += 11
+    assert backend.add('k', 3, clock.now + 10)
+    assert backend.get('k') == 3
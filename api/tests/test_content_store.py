@@ -0,0 +1,109 @@
+import pytest
+
+from content_store import ContentCodec, compress, decompress, train_dictionary
+
+DOCUMENTS = [
+    f'This Agreement is entered into by and between the parties named below. '
+    f'The Receiving Party shall hold the Confidential Information in strict confidence. '
+    f'This Agreement shall be governed by the laws of the State of Delaware. '
+    f'Payment of {n * 100} dollars is due within {n} days.\n'
+    for n in range(1, 20)
+]
+
+
+class FakeConnection:
+    """Serves content_dictionaries lookups from a dict of id -> dictionary."""
+
+    def __init__(self, dictionaries):
+        self.dictionaries = dictionaries
+        self.queries = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.row = None
+
+    def execute(self, sql, params=()):
+        self.conn.queries += 1
+        if sql.startswith('SELECT MAX(id)'):
+            self.row = (max(self.conn.dictionaries, default=None),)
+        else:
+            dictionary = self.conn.dictionaries.get(params[0])
+            self.row = (dictionary,) if dictionary is not None else None
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+def codec_for(dictionaries):
+    conn = FakeConnection(dictionaries)
+    return ContentCodec(lambda: conn), conn
+
+
+@pytest.mark.parametrize('text', ['', 'short', DOCUMENTS[0], 'Café ☕ — “quoted”\n' * 50])
+def test_compress_round_trip_without_dictionary(text):
+    blob = compress(text)
+    assert blob[0] == 0
+    assert decompress(blob) == text
+
+
+def test_compress_round_trip_with_dictionary():
+    dictionary = train_dictionary(DOCUMENTS)
+    blob = compress(DOCUMENTS[3], 7, dictionary)
+    assert blob[0] == 7
+    assert decompress(blob, dictionary) == DOCUMENTS[3]
+
+
+def test_dictionary_shrinks_short_documents():
+    dictionary = train_dictionary(DOCUMENTS)
+    text = DOCUMENTS[-1]
+    assert len(compress(text, 1, dictionary)) < len(compress(text)) / 2
+
+
+def test_train_dictionary_respects_size():
+    assert len(train_dictionary(DOCUMENTS, size=100)) <= 100
+    assert train_dictionary(['only one document. nothing shared.']) == b''
+
+
+def test_codec_without_dictionary():
+    codec, _ = codec_for({})
+    blob = codec.encode(DOCUMENTS[0])
+    assert blob[0] == 0
+    assert codec.decode(None, blob) == DOCUMENTS[0]
+
+
+def test_codec_decodes_plain_rows():
+    codec, conn = codec_for({})
+    assert codec.decode('legacy text', None) == 'legacy text'
+    assert codec.decode_row({'id': 1, 'content': 'legacy text', 'content_z': None}) == {
+        'id': 1, 'content': 'legacy text'
+    }
+    assert conn.queries == 0
+
+
+def test_codec_with_dictionary():
+    dictionaries = {1: b'unused', 2: train_dictionary(DOCUMENTS)}
+    writer, _ = codec_for(dictionaries)
+    blob = writer.encode(DOCUMENTS[5])
+    assert blob[0] == 2
+
+    reader, conn = codec_for(dictionaries)
+    assert reader.missing_dictionaries([{'content_z': blob}, {'content_z': None}]) == {2}
+    assert reader.decode(None, blob) == DOCUMENTS[5]
+    assert reader.decode(None, blob) == DOCUMENTS[5]
+    # Each dictionary is read once
+    assert conn.queries == 1
+    assert reader.missing_dictionaries([{'content_z': blob}]) == set()
+
+
+def test_codec_unknown_dictionary():
+    codec, _ = codec_for({})
+    with pytest.raises(LookupError):
+        codec.decode(None, compress('text', 9, b'some dictionary'))
@@ -0,0 +1,68 @@
+import pytest
+
+from passwords import PasswordHasher, PasswordHasherBusy, is_hashed
+
+# Cheap parameters; the format and logic do not depend on the cost
+LOG_N = 4
+
+
+@pytest.fixture
+def hasher():
+    return PasswordHasher(log_n=LOG_N, workers=1, max_pending=0)
+
+
+def test_hash_and_verify(hasher):
+    stored = hasher.hash('correct horse')
+    assert stored.startswith(f'scrypt${LOG_N}$8$1$')
+    assert is_hashed(stored)
+    assert hasher.verify('correct horse', stored)
+    assert not hasher.verify('correct horsE', stored)
+
+
+def test_hashes_are_salted(hasher):
+    assert hasher.hash('same') != hasher.hash('same')
+
+
+def test_unknown_user_fails(hasher):
+    assert not hasher.verify('anything', None)
+
+
+def test_malformed_hash_fails(hasher):
+    assert not hasher.verify('x', 'scrypt$not$a$hash')
+
+
+def test_needs_rehash(hasher):
+    stored = hasher.hash('pw')
+    assert not hasher.needs_rehash(stored)
+    assert PasswordHasher(log_n=LOG_N + 1).needs_rehash(stored)
+    assert PasswordHasher(log_n=LOG_N, r=4).needs_rehash(stored)
+    assert hasher.needs_rehash('plaintext')
+
+
+def test_old_cost_hash_still_verifies(hasher):
+    stored = PasswordHasher(log_n=LOG_N + 1).hash('pw')
+    assert hasher.verify('pw', stored)
+
+
+def test_plaintext_upgrade(hasher):
+    # A row from before hashing: accepted once, then replaced by a hash
+    stored = 'legacy-password'
+    assert not is_hashed(stored)
+    assert hasher.verify('legacy-password', stored)
+    assert not hasher.verify('wrong', stored)
+    assert hasher.needs_rehash(stored)
+    upgraded = hasher.hash('legacy-password')
+    assert hasher.verify('legacy-password', upgraded)
+    assert not hasher.needs_rehash(upgraded)
+
+
+def test_busy_when_no_slot_is_free(hasher):
+    hasher._slots.acquire()
+    try:
+        with pytest.raises(PasswordHasherBusy):
+            hasher.hash('pw')
+    finally:
+        hasher._slots.release()
+    assert hasher.stats()['rejected'] == 1
+    hasher.hash('pw')
+    assert hasher.stats()['hashes'] == 1
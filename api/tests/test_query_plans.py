@@ -0,0 +1,18 @@
+"""
+Runs benchmarks/check_query_plans.py against the MySQL configured by DB_HOST
+and friends; skipped without one. Point it at a throwaway database: it seeds
+loadtest.py's data set.
+"""
+import os
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not os.getenv('DB_HOST'), reason='DB_HOST is not set')
+
+
+def test_no_full_table_scans():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+    import check_query_plans
+
+    assert check_query_plans.check(users=500, templates_per_user=5) == []
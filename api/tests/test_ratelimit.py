@@ -0,0 +1,149 @@
+import random
+
+import pytest
+from flask import Flask
+
+import ratelimit
+from ratelimit import MemoryRateLimitStore, RateLimiter, _decide, _roll, parse_limits
+
+WINDOW = 60
+START = 1_000_020  # 1_000_020 // 60 * 60 == START: the start of a window
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock(START)
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+def test_decide_allows_under_limit():
+    assert _decide(0, 0, 3, WINDOW, START) == (True, 0)
+    assert _decide(2, 0, 3, WINDOW, START) == (True, 0)
+
+
+def test_decide_full_window():
+    # Three hits at the start of a window: the fourth waits for this window to
+    # become the previous one and shrink to two hits' weight
+    assert _decide(3, 0, 3, WINDOW, START) == (False, 80)
+
+
+def test_decide_weights_previous_window():
+    # Halfway through, ten hits in the previous window count as five
+    assert _decide(0, 10, 10, WINDOW, START + 30) == (True, 0)
+    # A tenth of the way in they count as nine; one more would make 10.5
+    assert _decide(1, 10, 10, WINDOW, START + 6) == (False, 6)
+
+
+def test_decide_retry_after_is_enough():
+    rng = random.Random(5)
+    for _ in range(2000):
+        limit = rng.randint(1, 20)
+        now = START + rng.uniform(0, WINDOW - 0.001)
+        count = rng.randint(0, limit)
+        previous = rng.randint(0, 2 * limit)
+        allowed, retry_after = _decide(count, previous, limit, WINDOW, now)
+        if allowed:
+            continue
+        later = now + retry_after
+        entry = (int(now // WINDOW), count, previous, None)
+        assert _decide(*_roll(entry, int(later // WINDOW)), limit, WINDOW, later)[0], (count, previous, limit, now)
+
+
+def test_memory_store_limits_and_reports_retry_after(clock):
+    store = MemoryRateLimitStore()
+    assert [store.hit('login.ip:1.2.3.4', 3, WINDOW)[0] for _ in range(3)] == [True, True, True]
+    assert store.hit('login.ip:1.2.3.4', 3, WINDOW) == (False, 80)
+    # Other buckets are counted separately
+    assert store.hit('login.ip:5.6.7.8', 3, WINDOW) == (True, 0)
+
+    clock.now += 79
+    assert not store.hit('login.ip:1.2.3.4', 3, WINDOW)[0]
+    clock.now += 1
+    assert store.hit('login.ip:1.2.3.4', 3, WINDOW) == (True, 0)
+
+
+def test_memory_store_does_not_count_rejections(clock):
+    store = MemoryRateLimitStore()
+    for _ in range(3):
+        store.hit('bucket', 3, WINDOW)
+    for _ in range(10):
+        assert not store.hit('bucket', 3, WINDOW)[0]
+    clock.now += 80
+    assert store.hit('bucket', 3, WINDOW)[0]
+
+
+def test_memory_store_counts_all_rules_or_none(clock):
+    store = MemoryRateLimitStore()
+    ip = ('login.ip:1.2.3.4', 5, WINDOW)
+    assert store.hit_all([ip, ('login.email:a@example.com', 2, WINDOW)]) == [0, 0]
+    assert store.hit_all([ip, ('login.email:a@example.com', 2, WINDOW)]) == [0, 0]
+    for _ in range(10):
+        waits = store.hit_all([ip, ('login.email:a@example.com', 2, WINDOW)])
+        assert waits[0] == 0 and waits[1] > 0
+    # The rejected requests were not charged to the IP: three more fit
+    for n in range(3):
+        assert store.hit_all([ip, (f'login.email:{n}@example.com', 2, WINDOW)]) == [0, 0]
+    assert store.hit_all([ip, ('login.email:x@example.com', 2, WINDOW)])[0] > 0
+
+
+def test_limiter_reports_longest_wait_and_spares_other_keys(clock):
+    app = Flask(__name__)
+    store = MemoryRateLimitStore()
+    limiter = RateLimiter(store, {'login': {'ip': (5, WINDOW), 'email': (1, WINDOW)}}, proxies=0)
+
+    def attempt(email):
+        with app.test_request_context('/api/login', method='POST', json={'email': email},
+                                      environ_base={'REMOTE_ADDR': '1.2.3.4'}):
+            return limiter.check('login')
+
+    assert attempt('a@example.com') is None
+    assert attempt('a@example.com') == 120
+    assert attempt('a@example.com') == 120
+    # Only the one accepted request counts against the IP
+    assert [attempt(f'{n}@example.com') for n in range(4)] == [None] * 4
+    assert attempt('z@example.com') > 0
+    assert limiter.stats() == {'allowed': 5, 'limited': 3, 'errors': 0}
+    assert limiter.check('unlimited') is None
+
+
+def test_memory_store_drops_idle_buckets(clock):
+    store = MemoryRateLimitStore(purge_interval=60)
+    store.hit('idle', 3, WINDOW)
+    clock.now += 2 * WINDOW + 1
+    store.hit('active', 3, WINDOW)
+    assert len(store) == 1
+
+
+def test_memory_store_evicts_soonest_expiring_past_max_keys(clock):
+    store = MemoryRateLimitStore(max_keys=10, purge_interval=3600)
+    # Longer windows expire later, so bucket 0 expires first
+    for n in range(10):
+        store.hit(f'bucket{n}', 3, 10 * (n + 1))
+    assert len(store) == 10
+    store.hit('bucket10', 3, 1000)
+    assert len(store) == 10
+    assert 'bucket0' not in store._buckets
+    assert 'bucket10' in store._buckets
+
+
+def test_parse_limits():
+    assert parse_limits('login.ip=60/60, send_otp.email=off') == {
+        'login': {'ip': (60, 60)}, 'send_otp': {'email': None}
+    }
+    assert parse_limits('') == {}
+    with pytest.raises(ValueError):
+        parse_limits('login.cookie=1/60')
+    with pytest.raises(ValueError):
+        parse_limits('login.ip=0/60')
@@ -0,0 +1,144 @@
+import random
+
+import pytest
+
+from revisions import SNAPSHOT_INTERVAL, apply_delta, make_delta, materialize, record_revision
+
+BASE = ''.join(f'Clause {n}: the parties agree to term {n}.\n' for n in range(40))
+
+
+class PlainCodec:
+    def decode(self, content, content_z):
+        return content
+
+
+class FakeConnection:
+    """Just enough of a MySQL connection for revisions.py's statements on one template."""
+
+    def __init__(self, content):
+        self.content = content
+        self.revisions = []
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def execute(self, sql, params):
+        sql = ' '.join(sql.split())
+        rows = self.conn.revisions
+        if sql.startswith('SELECT COALESCE(MAX(revision), 0)'):
+            self.result = [{'latest': max((row['revision'] for row in rows), default=0)}]
+        elif sql.startswith('INSERT INTO template_revisions'):
+            _, revision, title, kind, body, _ = params
+            rows.append({'revision': revision, 'title': title, 'kind': kind, 'body': body})
+        elif sql.startswith('DELETE FROM template_revisions'):
+            self.conn.revisions = [row for row in rows if row['revision'] > params[1]]
+        elif sql.startswith('SELECT MIN(revision) AS snapshot'):
+            snapshots = [row['revision'] for row in rows if row['revision'] >= params[1] and row['kind'] == 'snapshot']
+            self.result = [{'snapshot': min(snapshots, default=None)}]
+        elif sql.startswith('SELECT content, content_z FROM templates'):
+            self.result = [{'content': self.conn.content, 'content_z': None}]
+        elif 'BETWEEN' in sql:
+            low, high = params[1], params[2]
+            self.result = sorted((row for row in rows if low <= row['revision'] <= high),
+                                 key=lambda row: -row['revision'])
+        else:
+            self.result = sorted((row for row in rows if row['revision'] >= params[1]),
+                                 key=lambda row: -row['revision'])
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return list(self.result)
+
+    def close(self):
+        pass
+
+
+def edit(text, rng):
+    lines = text.splitlines(keepends=True)
+    for _ in range(rng.randint(1, 3)):
+        position = rng.randrange(len(lines) + 1)
+        action = rng.choice(('insert', 'delete', 'change'))
+        if action == 'insert' or not lines:
+            lines.insert(position, f'New clause {rng.random()}.\n')
+        elif action == 'delete':
+            del lines[min(position, len(lines) - 1)]
+        else:
+            lines[min(position, len(lines) - 1)] = f'Amended clause {rng.random()}.\n'
+    return ''.join(lines)
+
+
+@pytest.mark.parametrize('newer, older', [
+    (BASE, BASE),
+    (BASE, BASE + 'Signed.\n'),
+    (BASE + 'Signed.\n', BASE),
+    (BASE, BASE.replace('term 7.', 'term seven.')),
+    ('', BASE),
+    (BASE, ''),
+    ('one\ntwo', 'one\ntwo\nthree'),
+    ('no newline at all', 'still none'),
+    ('Café ☕\n', 'Cafe\n'),
+])
+def test_delta_round_trip(newer, older):
+    assert apply_delta(newer, make_delta(newer, older)) == older
+
+
+def test_delta_round_trip_random_edits():
+    rng = random.Random(7)
+    older = BASE
+    for _ in range(200):
+        newer = edit(older, rng)
+        assert apply_delta(newer, make_delta(newer, older)) == older
+        older = newer
+
+
+def test_small_edit_makes_small_delta():
+    delta = make_delta(BASE, BASE.replace('term 20.', 'term twenty.'))
+    assert len(delta) < len(BASE) / 10
+
+
+def record_history(conn, count, keep=1000):
+    rng = random.Random(3)
+    history = []
+    for n in range(count):
+        new_content = edit(conn.content, rng)
+        history.append(conn.content)
+        record_revision(conn, 1, f'Title {n}', conn.content, new_content, keep)
+        conn.content = new_content
+    return history
+
+
+def test_every_snapshot_interval_revision_is_a_snapshot():
+    conn = FakeConnection(BASE)
+    record_history(conn, SNAPSHOT_INTERVAL * 3 + 5)
+    for row in conn.revisions:
+        expected = 'snapshot' if row['revision'] % SNAPSHOT_INTERVAL == 0 else 'delta'
+        assert row['kind'] == expected, row['revision']
+
+
+def test_delta_larger_than_content_is_stored_as_snapshot():
+    conn = FakeConnection('completely different\n')
+    record_revision(conn, 1, 'Title', 'a\n', 'completely different\n', keep=10)
+    assert conn.revisions[0]['kind'] == 'snapshot'
+
+
+def test_materialize_rebuilds_every_revision():
+    conn = FakeConnection(BASE)
+    history = record_history(conn, SNAPSHOT_INTERVAL * 2 + 3)
+    for revision, content in enumerate(history, start=1):
+        assert materialize(conn, 1, revision, PlainCodec()) == {'title': f'Title {revision - 1}', 'content': content}
+
+
+def test_retention_drops_oldest_revisions():
+    conn = FakeConnection(BASE)
+    history = record_history(conn, 30, keep=10)
+    assert [row['revision'] for row in conn.revisions] == list(range(21, 31))
+    assert materialize(conn, 1, 20, PlainCodec()) is None
+    assert materialize(conn, 1, 21, PlainCodec())['content'] == history[20]
@@ -0,0 +1,231 @@
+from datetime import datetime
+
+import pytest
+from flask import Flask, g, jsonify
+
+import tokens
+from tokens import RevocationList, TokenError, TokenIssuer, init_app
+
+START = 1_700_000_000
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock(START)
+    monkeypatch.setattr(tokens, 'time', clock)
+    return clock
+
+
+class FakeConnection:
+    """Keeps token_revocations rows in a list shared by every RevocationList."""
+
+    def __init__(self):
+        self.rows = []
+
+    def cursor(self, dictionary=False):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.result = []
+
+    def execute(self, sql, params=()):
+        if sql.strip().startswith('INSERT'):
+            session_id, user_id, issued_before, expires_at = params
+            self.conn.rows.append({
+                'id': len(self.conn.rows) + 1, 'session_id': session_id, 'user_id': user_id,
+                'issued_before': issued_before, 'expires_at': expires_at,
+            })
+        elif sql.strip().startswith('SELECT'):
+            self.result = [row for row in self.conn.rows if row['id'] > params[0]]
+        # DELETE: expired rows are left in place; load() drops them
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def issuer():
+    return TokenIssuer(['secret'])
+
+
+FREE = (False, 'free', None)
+
+
+def test_issue_and_verify(clock, issuer):
+    pair = issuer.issue(7, (True, 'pro', datetime(2030, 1, 1)))
+    claims = issuer.verify(pair['access_token'])
+    assert claims['sub'] == 7
+    assert (claims['plan'], claims['paid'], claims['pexp']) == ('pro', True, 1893456000)
+    assert claims['exp'] == START + issuer.access_ttl
+    refresh = issuer.verify(pair['refresh_token'], kind='refresh')
+    assert refresh['sid'] == claims['sid']
+    assert refresh['exp'] == START + issuer.refresh_ttl
+
+
+def test_token_kinds_are_not_interchangeable(clock, issuer):
+    pair = issuer.issue(7, FREE)
+    with pytest.raises(TokenError, match='Not an access token'):
+        issuer.verify(pair['refresh_token'])
+    with pytest.raises(TokenError, match='Not a refresh token'):
+        issuer.verify(pair['access_token'], kind='refresh')
+
+
+def test_forged_tokens_fail(clock, issuer):
+    token = issuer.issue(7, FREE)['access_token']
+    payload, signature = token.split('.')
+    # Claims swapped for another user's under the original signature
+    other = TokenIssuer(['secret']).access_token(8, FREE, 'sid').split('.')[0]
+    with pytest.raises(TokenError, match='signature'):
+        issuer.verify(f'{other}.{signature}')
+    with pytest.raises(TokenError, match='signature'):
+        TokenIssuer(['another secret']).verify(token)
+    for malformed in ['', 'no-dot', f'{payload}.{signature}.extra', f'{payload}.!!']:
+        with pytest.raises(TokenError):
+            issuer.verify(malformed)
+
+
+def test_expired_tokens_fail(clock, issuer):
+    pair = issuer.issue(7, FREE)
+    clock.now += issuer.access_ttl - 1
+    issuer.verify(pair['access_token'])
+    clock.now += 1
+    with pytest.raises(TokenError, match='expired'):
+        issuer.verify(pair['access_token'])
+    issuer.verify(pair['refresh_token'], kind='refresh')
+    clock.now = START + issuer.refresh_ttl
+    with pytest.raises(TokenError, match='expired'):
+        issuer.verify(pair['refresh_token'], kind='refresh')
+
+
+def test_key_rotation(clock):
+    old = TokenIssuer(['old'])
+    rotated = TokenIssuer(['new', 'old'])
+    token = old.issue(7, FREE)['access_token']
+    assert rotated.verify(token)['sub'] == 7
+    # New tokens are signed with the first key only
+    with pytest.raises(TokenError):
+        old.verify(rotated.issue(7, FREE)['access_token'])
+
+
+def test_refresh_rotation_and_reuse(clock, issuer):
+    conn = FakeConnection()
+    revocations = RevocationList(lambda: conn)
+    first = issuer.issue(7, FREE)
+    claims = issuer.verify(first['refresh_token'], kind='refresh')
+    assert not revocations.is_revoked(claims)
+
+    # What the refresh route does: revoke the old session, start a new one
+    revocations.revoke_session(claims['sid'], claims['exp'])
+    second = issuer.issue(7, FREE)
+    assert issuer.verify(second['access_token'])['sid'] != claims['sid']
+
+    # The used refresh token still verifies but is revoked, with its access token
+    reused = issuer.verify(first['refresh_token'], kind='refresh')
+    assert revocations.is_revoked(reused)
+    assert revocations.is_revoked(issuer.verify(first['access_token']))
+    assert not revocations.is_revoked(issuer.verify(second['refresh_token'], kind='refresh'))
+
+
+def test_revoke_user_covers_tokens_issued_until_now(clock, issuer):
+    revocations = RevocationList(lambda: FakeConnection())
+    before = issuer.verify(issuer.issue(7, FREE)['access_token'])
+    revocations.revoke_user(7)
+    # Same second as the revocation: iat cannot tell it apart, so it goes too
+    assert revocations.is_revoked(issuer.verify(issuer.issue(7, FREE)['access_token']))
+    assert revocations.is_revoked(before)
+    clock.now += 1
+    assert not revocations.is_revoked(issuer.verify(issuer.issue(7, FREE)['access_token']))
+    assert not revocations.is_revoked(issuer.verify(issuer.issue(8, FREE)['access_token']))
+
+
+def test_revocations_reach_other_instances(clock, issuer):
+    conn = FakeConnection()
+    here = RevocationList(lambda: conn, refresh_interval=30)
+    there = RevocationList(lambda: conn, refresh_interval=30)
+    session = issuer.verify(issuer.issue(7, FREE)['access_token'])
+    user = issuer.verify(issuer.issue(8, FREE)['access_token'])
+    assert not there.is_revoked(session)
+
+    here.revoke_session(session['sid'], session['exp'])
+    here.revoke_user(8)
+    # Not read again until the interval has passed
+    assert not there.is_revoked(session)
+    clock.now += 30
+    assert there.is_revoked(session)
+    assert there.is_revoked(user)
+    assert len(there) == 2
+
+
+def test_start_refresh_and_load(clock, issuer):
+    conn = FakeConnection()
+    RevocationList(lambda: conn).revoke_session('gone', START + 60)
+    revocations = RevocationList(lambda: pytest.fail('should not query'), refresh_interval=30)
+
+    last_id, _ = revocations.start_refresh()
+    assert last_id == 0
+    # Claimed: other callers skip until the interval has passed
+    assert revocations.start_refresh() is None
+    revocations.load(conn.rows)
+    assert revocations.is_revoked({'sid': 'gone', 'sub': 7, 'iat': START}, refresh=False)
+
+    clock.now += 30
+    assert revocations.start_refresh()[0] == 1
+    # Entries are dropped once every token they could match has expired
+    clock.now = START + 60
+    revocations.load([])
+    assert len(revocations) == 0
+
+
+def test_init_app_rejects_bad_tokens(clock, issuer):
+    app = Flask(__name__)
+    conn = FakeConnection()
+    revocations = RevocationList(lambda: conn)
+    init_app(app, issuer, revocations, exempt=('login',))
+
+    @app.route('/whoami')
+    def whoami():
+        caller = g.get('caller')
+        return jsonify({'user_id': caller.user_id if caller else None})
+
+    @app.route('/login')
+    def login():
+        return jsonify({})
+
+    client = app.test_client()
+    pair = issuer.issue(7, FREE)
+
+    def get(path, token):
+        return client.get(path, headers={'Authorization': f'Bearer {token}'})
+
+    assert client.get('/whoami').get_json() == {'user_id': None}
+    assert get('/whoami', pair['access_token']).get_json() == {'user_id': 7}
+    forged = get('/whoami', TokenIssuer(['guess']).issue(1, FREE)['access_token'])
+    assert forged.status_code == 401
+    assert forged.headers['WWW-Authenticate'] == 'Bearer error="invalid_token"'
+    assert get('/whoami', pair['refresh_token']).status_code == 401
+    assert get('/login', 'anything').status_code == 200
+
+    revocations.revoke_session(issuer.verify(pair['access_token'])['sid'], START + issuer.refresh_ttl)
+    response = get('/whoami', pair['access_token'])
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'Token revoked'}
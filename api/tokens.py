@@ -0,0 +1,306 @@
+"""
+Signed session tokens for the LegallyUp API.
+
+Login issues a short-lived access token and a longer-lived refresh token.
+Both are HMAC-SHA256 signed, so any instance holding TOKEN_SECRET can verify
+them without a database round trip. The access token carries the caller's
+subscription (plan, whether it is paid, and when it lapses), which is what
+most routes used to read from users and payments on every request.
+
+A token is base64url(JSON claims) + "." + base64url(signature). Claims:
+
+    sub   user id               typ   "access" or "refresh"
+    sid   session id            iat   issued at (Unix time)
+    exp   expires at            plan, paid, pexp   subscription (access only)
+
+Revoking a session (logout, refresh) or every session of a user (password
+reset) writes to token_revocations. Each instance keeps the live entries in
+memory and reads new ones at most every refresh_interval seconds, so a
+revocation takes effect everywhere within that interval while requests
+themselves never query the table. Entries are dropped once every token they
+could match has expired.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import g, jsonify, request
+from mysql.connector import Error
+
+from caches import utc_timestamp
+
+logger = logging.getLogger(__name__)
+
+ACCESS_TTL = 15 * 60
+REFRESH_TTL = 30 * 24 * 3600
+
+
+class TokenError(Exception):
+    """The token is malformed, forged, expired, revoked or of the wrong type."""
+
+
+class Caller:
+    """The authenticated user of the current request, from access token claims."""
+
+    def __init__(self, claims):
+        self.user_id = claims['sub']
+        self.session_id = claims['sid']
+        self.plan = claims['plan']
+        self.subscription_expires = claims['pexp']
+        # A paid plan lapses at pexp even if the token outlives it
+        self.is_paid = bool(claims['paid']) and (claims['pexp'] is None or time.time() < claims['pexp'])
+
+    def subscription(self):
+        """(is_paid, plan_type, expiry_date) as check_subscription_status returns it."""
+        if not self.is_paid:
+            return False, 'free', None
+        expiry = None
+        if self.subscription_expires is not None:
+            expiry = datetime.fromtimestamp(self.subscription_expires, timezone.utc).replace(tzinfo=None)
+        return True, self.plan, expiry
+
+    def is_user(self, user_id):
+        return str(self.user_id) == str(user_id)
+
+
+class TokenIssuer:
+    """
+    Signs and verifies tokens.
+
+    keys is a list of secrets: the first signs, any of them verifies, so a
+    new secret can be rolled out ahead of the old one being retired.
+    """
+
+    def __init__(self, keys, access_ttl=ACCESS_TTL, refresh_ttl=REFRESH_TTL):
+        if not keys:
+            raise ValueError('At least one token key is required')
+        self._keys = [key.encode() if isinstance(key, str) else key for key in keys]
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+
+    def issue(self, user_id, subscription, session_id=None):
+        """
+        Start (or continue) a session: a new access and refresh token pair.
+
+        subscription is (is_paid, plan_type, expiry_date) from
+        check_subscription_status.
+        """
+        session_id = session_id or secrets.token_urlsafe(16)
+        now = int(time.time())
+        refresh = {'sub': user_id, 'sid': session_id, 'typ': 'refresh', 'iat': now, 'exp': now + self.refresh_ttl}
+        return {
+            'access_token': self.access_token(user_id, subscription, session_id),
+            'refresh_token': self._encode(refresh),
+            'token_type': 'Bearer',
+            'expires_in': self.access_ttl,
+        }
+
+    def access_token(self, user_id, subscription, session_id):
+        """A new access token for an existing session, e.g. after a plan change."""
+        is_paid, plan, expiry = subscription
+        now = int(time.time())
+        return self._encode({
+            'sub': user_id, 'sid': session_id, 'typ': 'access', 'iat': now, 'exp': now + self.access_ttl,
+            'plan': plan, 'paid': is_paid, 'pexp': int(utc_timestamp(expiry)) if expiry else None,
+        })
+
+    def verify(self, token, kind='access'):
+        """Return the claims of a valid, unexpired token of the given kind; raises TokenError."""
+        try:
+            payload, signature = token.encode().split(b'.')
+            signature = _unb64(signature)
+        except (ValueError, UnicodeError):
+            raise TokenError('Malformed token')
+        if not any(hmac.compare_digest(self._sign(payload, key), signature) for key in self._keys):
+            raise TokenError('Invalid token signature')
+        try:
+            claims = json.loads(_unb64(payload))
+        except ValueError:
+            raise TokenError('Malformed token')
+        if claims.get('typ') != kind:
+            raise TokenError(f'Not an {kind} token' if kind == 'access' else f'Not a {kind} token')
+        if claims.get('exp', 0) <= time.time():
+            raise TokenError('Token expired')
+        return claims
+
+    def _encode(self, claims):
+        payload = _b64(json.dumps(claims, separators=(',', ':')).encode())
+        return (payload + b'.' + _b64(self._sign(payload, self._keys[0]))).decode()
+
+    @staticmethod
+    def _sign(payload, key):
+        return hmac.new(key, payload, hashlib.sha256).digest()
+
+
+class RevocationList:
+    """
+    Revoked sessions and users, mirrored in memory from token_revocations.
+
+    connect is a callable returning a connection (get_db inside a request).
+    """
+
+    def __init__(self, connect, refresh_interval=30, purge_interval=3600):
+        self._connect = connect
+        self.refresh_interval = refresh_interval
+        self.purge_interval = purge_interval
+        self._sessions = {}   # session id -> expires_at
+        self._users = {}      # user id -> (issued_before, expires_at)
+        self._last_id = 0
+        self._next_refresh = 0.0
+        self._next_purge = 0.0
+        self._lock = threading.Lock()
+
+    def is_revoked(self, claims, refresh=True):
+        if refresh:
+            self._maybe_refresh()
+        if claims['sid'] in self._sessions:
+            return True
+        user = self._users.get(claims['sub'])
+        return user is not None and claims['iat'] < user[0]
+
+    def revoke_session(self, session_id, expires_at):
+        """Revoke every token of one session; expires_at is when its last token expires."""
+        self._store(session_id, None, None, expires_at)
+        with self._lock:
+            self._sessions[session_id] = expires_at
+
+    def revoke_user(self, user_id, expires_at=None):
+        """Revoke every token issued to a user up to now."""
+        # iat has whole-second resolution, so this second's tokens go too
+        issued_before = int(time.time()) + 1
+        expires_at = expires_at or issued_before + REFRESH_TTL
+        self._store(None, user_id, issued_before, expires_at)
+        with self._lock:
+            self._users[user_id] = (issued_before, expires_at)
+
+    def __len__(self):
+        return len(self._sessions) + len(self._users)
+
+    def _store(self, session_id, user_id, issued_before, expires_at):
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO token_revocations (session_id, user_id, issued_before, expires_at)
+            VALUES (%s, %s, %s, %s)
+        """, (session_id, user_id, _datetime(issued_before), _datetime(expires_at)))
+        conn.commit()
+        if time.monotonic() >= self._next_purge:
+            self._next_purge = time.monotonic() + self.purge_interval
+            cursor.execute("DELETE FROM token_revocations WHERE expires_at < %s LIMIT 1000", (datetime.utcnow(),))
+            conn.commit()
+        cursor.close()
+
+    def start_refresh(self):
+        """
+        Claim a due refresh: returns the parameters for NEW_REVOCATIONS_SQL,
+        or None if none is due or another request claimed it. Callers with
+        their own connection (asgi.py) run the query and pass the rows to
+        load().
+        """
+        with self._lock:
+            if time.monotonic() < self._next_refresh:
+                return None
+            self._next_refresh = time.monotonic() + self.refresh_interval
+            return self._last_id, datetime.utcnow()
+
+    def load(self, rows):
+        """Apply rows read with NEW_REVOCATIONS_SQL, then drop expired entries."""
+        now = time.time()
+        with self._lock:
+            for row in rows:
+                expires_at = utc_timestamp(row['expires_at'])
+                if row['session_id'] is not None:
+                    self._sessions[row['session_id']] = expires_at
+                else:
+                    issued_before = utc_timestamp(row['issued_before'])
+                    previous = self._users.get(row['user_id'], (0, 0))
+                    self._users[row['user_id']] = (max(issued_before, previous[0]), max(expires_at, previous[1]))
+                self._last_id = max(self._last_id, row['id'])
+            self._sessions = {sid: expires for sid, expires in self._sessions.items() if expires > now}
+            self._users = {user: entry for user, entry in self._users.items() if entry[1] > now}
+
+    def _maybe_refresh(self):
+        if time.monotonic() < self._next_refresh:
+            return
+        params = self.start_refresh()
+        if params is None:
+            return
+        try:
+            conn = self._connect()
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(NEW_REVOCATIONS_SQL, params)
+            rows = cursor.fetchall()
+            cursor.close()
+            # End the read's implicit transaction: routes that call
+            # start_transaction() run on this same connection
+            conn.commit()
+        except Error:
+            # Keep answering from what is already known; retried next interval
+            logger.exception('Token revocation refresh error')
+            return
+        self.load(rows)
+
+
+NEW_REVOCATIONS_SQL = """
+    SELECT id, session_id, user_id, issued_before, expires_at
+    FROM token_revocations
+    WHERE id > %s AND expires_at > %s
+    ORDER BY id
+"""
+
+
+def current_caller():
+    """The authenticated Caller of this request, or None."""
+    return g.get('caller')
+
+
+def init_app(app, issuer, revocations, exempt=()):
+    """
+    Authenticate "Authorization: Bearer <access token>" before every request.
+
+    Requests without the header go through unauthenticated; a header with
+    an invalid, expired or revoked token is rejected with 401. Endpoints in
+    exempt are left alone: those that use the header for something else, and
+    those (login, refresh) a client must reach while its token is stale.
+    """
+    app.extensions['token_issuer'] = issuer
+    exempt = frozenset(exempt)
+
+    @app.before_request
+    def authenticate():
+        if request.endpoint in exempt:
+            return None
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return None
+        try:
+            claims = issuer.verify(token.strip())
+            if revocations.is_revoked(claims):
+                raise TokenError('Token revoked')
+        except TokenError as e:
+            response = jsonify({'error': str(e)})
+            response.status_code = 401
+            response.headers['WWW-Authenticate'] = 'Bearer error="invalid_token"'
+            return response
+        g.caller = Caller(claims)
+        return None
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def _unb64(data):
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+def _datetime(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)